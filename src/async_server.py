@@ -0,0 +1,142 @@
+import asyncio
+import signal
+import socket
+import time
+from server import TelemetryCollector, log
+
+
+class CollectorProtocol(asyncio.DatagramProtocol):
+    """Receive path of the asyncio engine: hands each datagram to the collector"""
+
+    def __init__(self, collector):
+        self.collector = collector
+
+    def connection_made(self, transport):
+        self.collector.transport = transport
+
+    def datagram_received(self, data, addr):
+        collector = self.collector
+        collector.handle_packet_info(collector.process_packet(data, addr))
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable after an ACK to a sensor that already exited
+        pass
+
+
+class AsyncTelemetryCollector(TelemetryCollector):
+    """
+    TelemetryCollector driven by an asyncio event loop.
+
+    Packet processing, CSV columns and statistics are shared with the blocking
+    engine. Housekeeping runs as independent timer tasks instead of piggy-backing
+    on packet arrival or the 5 second socket timeout:
+      - reorder buffer flush at the deadline of the next buffered packet
+      - coalesced ACK flush ack_delay after a device's first unacknowledged packet
+      - offline-device check every device_check_interval seconds
+      - CSV flush every sink_flush_interval seconds
+      - [STATISTICS] summary line every summary_interval seconds
+    """
+
+    def __init__(self, host=socket.gethostbyname(socket.gethostname()), port=5000):
+        super().__init__(host, port)
+        self.engine = 'asyncio'
+        self.receive_mode = 'datagram-protocol'
+        self.transport = None
+        self.buffer_wakeup = None          # asyncio.Event set when the reorder buffer becomes non-empty
+        self.device_check_interval = 1.0   # seconds between offline-device checks (O(expired) each)
+        self.sink_flush_interval = 1.0     # seconds between CSV flushes
+        self.flush_every_write = False     # The sink flush task owns flushing
+
+    def send_ack(self, ack_packet, addr):
+        """Send an ACK datagram back to a sensor"""
+        self.transport.sendto(ack_packet, addr)
+
+    def queue_ack(self, device_id, seq_num, addr, now):
+        """Hold the ACK and arm the flush timer if no ACK was waiting"""
+        was_idle = not self.ack_deadlines
+        super().queue_ack(device_id, seq_num, addr, now)
+        if was_idle:
+            asyncio.get_running_loop().call_later(self.ack_delay, self.ack_timer)
+
+    def ack_timer(self):
+        """Send due ACKs, then re-arm for the next device still waiting"""
+        self.flush_acks()
+        if self.ack_deadlines:
+            delay = max(0.0, self.ack_deadlines[0][0] - time.time())
+            asyncio.get_running_loop().call_later(delay, self.ack_timer)
+
+    def add_to_buffer(self, packet_info):
+        """Add packet to buffer for reordering, waking the flush task if it was idle"""
+        was_empty = not self.packet_buffer
+        super().add_to_buffer(packet_info)
+        if was_empty:
+            self.buffer_wakeup.set()
+
+    async def buffer_flush_task(self):
+        """Release buffered packets as their deadlines come due"""
+        while True:
+            deadline = self.packet_buffer.next_deadline()
+            if deadline is None:
+                # Deadlines only grow, so nothing can become due before the next packet is buffered
+                self.buffer_wakeup.clear()
+                await self.buffer_wakeup.wait()
+                continue
+            await asyncio.sleep(max(0.0, deadline - time.time()))
+            self.process_buffer()
+
+    async def periodic(self, interval, callback):
+        """Run callback every interval seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            callback()
+
+    def flush_sink(self):
+        """Flush rows written since the last tick"""
+        if self.sink:
+            self.sink.flush()
+
+    async def serve(self):
+        """Start the endpoint and the housekeeping tasks, then run until cancelled"""
+        loop = asyncio.get_running_loop()
+        self.buffer_wakeup = asyncio.Event()
+        self.socket.setblocking(False)
+        await loop.create_datagram_endpoint(lambda: CollectorProtocol(self), sock=self.socket)
+
+        tasks = [
+            asyncio.create_task(self.buffer_flush_task()),
+            asyncio.create_task(self.periodic(self.device_check_interval, self.check_device_timeout)),
+            asyncio.create_task(self.periodic(self.sink_flush_interval, self.flush_sink)),
+            asyncio.create_task(self.periodic(self.summary_interval, self.log_summary)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.flush_acks(force=True)
+            self.get_kernel_drops()  # Read before the transport closes the socket
+            self.transport.close()
+
+    def run(self):
+        """Main server loop (asyncio engine)"""
+        try:
+            self.start()
+            asyncio.run(self.serve())
+
+        except KeyboardInterrupt:
+            # Shutdown has started: a repeated Ctrl+C must not cut the sink close short
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            log.info("-" * 80)
+            log.info("[SERVER] Shutting down...")
+            # Process any remaining buffered packets
+            self.process_buffer(force=True)
+            self.close_sink()
+            self.stop_monitor()
+            self.print_statistics()
+        except Exception as e:
+            log.error(f"[ERROR] Server error: {e}")
+        finally:
+            self.close_metrics()
+            self.close_sink()
+            if self.socket:
+                self.socket.close()
@@ -4,8 +4,15 @@ import time
 import json
 import random
 import threading
+from collections import deque
 from datetime import datetime
-from protocol import TinyTelemetryProtocol, MSG_INIT, MSG_DATA, MSG_HEARTBEAT, MSG_ACK
+from protocol import (TinyTelemetryProtocol, MSG_INIT, MSG_DATA, MSG_HEARTBEAT, MSG_ACK,
+                      PROTOCOL_VERSION_JSON, PROTOCOL_VERSION_BINARY, SEQ_MASK, FLAG_SACK_OK, MAX_ACK_DELAY,
+                      sack_covers)
+from scheduler import EventScheduler
+from telemetry_log import get_logger, setup_logging, flush_logging, shutdown_logging, PacketLogSampler, LOG_SUMMARY_INTERVAL
+
+log = get_logger('client')
 
 class TelemetrySensor:
     def __init__(self, device_id, server_host=socket.gethostbyname(socket.gethostname()), server_port=5000):
@@ -19,7 +26,9 @@ class TelemetrySensor:
         self.jitter_max = 0.0  # Maximum jitter in seconds (e.g., 0.5 = 500ms)
         self.batch_size = 0  # Number of messages to batch before sending
         self.batch_buffer = []
+        self.protocol_version = PROTOCOL_VERSION_BINARY  # PROTOCOL_VERSION_JSON for legacy JSON payloads
         self.pending_packets = {}
+        self.sack_enabled = True  # Set FLAG_SACK_OK: the collector may answer with coalesced selective ACKs
         # Dynamic timeout calculation (RTO = estimatedRTT + 4 * devRTT)
         self.estimated_rtt = 0.5  # Initial estimate: 500ms
         self.dev_rtt = 0.1  # Initial deviation: 100ms
@@ -27,72 +36,187 @@ class TelemetrySensor:
         self.alpha = 0.125  # RTT estimation weight
         self.beta = 0.25  # Deviation estimation weight
         self.max_retries = 3
+        self.min_rto = 0.2  # RTO floor (s), well above scheduler jitter: a ~0 localhost RTT must not fire timers early
+        self.max_rto = 8.0  # Per-packet timeout cap after exponential backoff (seconds)
         self.retransmission_count = 0
-        self.ack_received_count = 0
+        self.ack_received_count = 0  # Packets acknowledged
+        self.ack_datagrams_received = 0
         self.total_rtt_samples = 0
         self.ack_lock = threading.Lock()
 
+        # Send window (selective repeat): at most window_size DATA/BATCH packets awaiting ACK
+        self.window_size = 32        # 0 = unbounded (original behaviour)
+        self.window_policy = 'block'  # 'block': queue the packet until a slot frees; 'drop': discard it
+        self.window_backlog = deque()  # (park time, readings, send function, args) waiting for a slot ('block')
+        self.backlog_windows = 4      # 'block' queues at most this many windows of packets, then drops the oldest
+        self.max_backlog = 0
+        self.packets_sent = 0             # DATA/BATCH datagrams sent (first transmissions)
+        self.readings_acked = 0           # Readings inside acknowledged packets
+        self.bytes_acked = 0
+        self.retransmissions_recovered = 0  # Retransmitted packets that were then acknowledged
+        self.packets_given_up = 0         # Packets dropped after max_retries
+        self.window_drops = 0             # Readings discarded because the window was full ('drop'), or the backlog ('block')
+        self.window_blocked_time = 0.0    # Seconds packets spent queued for a slot ('block'), summed
+        self.occupancy_sum = 0            # Sum of window occupancy sampled at each send
+        self.occupancy_samples = 0
+        self.max_occupancy = 0
+        # Per-send log lines are sampled (TT_LOG_SAMPLE); progress is summarised periodically
+        self.packet_log = PacketLogSampler(log)
+        self.summary_interval = LOG_SUMMARY_INTERVAL
+        # One timer heap drives readings, heartbeats, jittered sends and retransmission timeouts
+        self.scheduler = EventScheduler()
+        self.heartbeat_interval = 10  # seconds without DATA before a HEARTBEAT is sent
+        self.last_activity = 0.0
+
     def ack_listener_thread(self):
         """Thread to listen for ACK messages from server"""
         while True:
             try:
                 data, _ = self.ack_socket.recvfrom(1024)
-                header, _ = TinyTelemetryProtocol.parse_message(data)
-                msg_type = header['msg_type']
-                seq_num = header['seq_num']
-
-                if msg_type == MSG_ACK:
-                    current_time = time.time()
-                    with self.ack_lock:
-                        if seq_num in self.pending_packets:
-                            # Calculate sample RTT
-                            send_time = self.pending_packets[seq_num]['send_time']
-                            sample_rtt = current_time - send_time
-                            
-                            # Update RTT estimates (TCP-style)
-                            # estimatedRTT = (1-α) * estimatedRTT + α * sampleRTT
-                            self.estimated_rtt = (1 - self.alpha) * self.estimated_rtt + self.alpha * sample_rtt
-                            # devRTT = (1-β) * devRTT + β * |sampleRTT - estimatedRTT|
-                            self.dev_rtt = (1 - self.beta) * self.dev_rtt + self.beta * abs(sample_rtt - self.estimated_rtt)
-                            # RTO = estimatedRTT + 4 * devRTT
-                            self.ack_timeout = self.estimated_rtt + 4 * self.dev_rtt
-                            
-                            # Track metrics
-                            self.ack_received_count += 1
-                            self.total_rtt_samples += 1
-                            
-                            # Remove from pending
-                            del self.pending_packets[seq_num]
+                self.handle_ack(data)
             except socket.timeout:
                 continue  # Normal timeout, keep listening
             except Exception:
                 break  # Socket closed, exit thread
-    
-    def retransmission_timer_thread(self):
-        """Thread to check for timed-out packets and retransmit"""
+
+    def handle_ack(self, data):
+        """Process one datagram from the server (ACKs free window slots and update the RTT estimate)"""
+        header, payload = TinyTelemetryProtocol.parse_message(data)
+        msg_type = header.msg_type
+        seq_num = header.seq_num
+
+        if msg_type == MSG_ACK:
+            current_time = time.time()
+            sack = TinyTelemetryProtocol.decode_sack_payload(payload)
+            with self.ack_lock:
+                self.ack_datagrams_received += 1
+                if sack is None:
+                    # Legacy ACK: acknowledges its own seq only
+                    acked = [seq_num] if seq_num in self.pending_packets else []
+                else:
+                    # Selective ACK: anchor seq, everything up to the cumulative seq, and the bitmap
+                    cumulative_seq, bitmap = sack
+                    acked = [seq for seq in self.pending_packets
+                             if sack_covers(seq, seq_num, cumulative_seq, bitmap)]
+                # Karn's algorithm: only never-retransmitted packets give unambiguous RTT samples
+                send_times = [self.pending_packets[seq]['send_time'] for seq in acked
+                              if self.pending_packets[seq]['retry_count'] == 0]
+                if send_times:
+                    # Calculate sample RTT (one sample per ACK, from the newest packet it covers)
+                    sample_rtt = current_time - max(send_times)
+
+                    # Update RTT estimates (TCP-style)
+                    # estimatedRTT = (1-α) * estimatedRTT + α * sampleRTT
+                    self.estimated_rtt = (1 - self.alpha) * self.estimated_rtt + self.alpha * sample_rtt
+                    # devRTT = (1-β) * devRTT + β * |sampleRTT - estimatedRTT|
+                    self.dev_rtt = (1 - self.beta) * self.dev_rtt + self.beta * abs(sample_rtt - self.estimated_rtt)
+                    # RTO = estimatedRTT + 4 * devRTT (at least rto_floor())
+                    self.ack_timeout = max(self.rto_floor(), self.estimated_rtt + 4 * self.dev_rtt)
+
+                    self.total_rtt_samples += 1
+
+                if acked:
+                    # Track metrics
+                    self.ack_received_count += len(acked)
+
+                    # Remove from pending (frees window slots)
+                    for seq in acked:
+                        packet_info = self.pending_packets.pop(seq)
+                        self.readings_acked += packet_info['readings']
+                        self.bytes_acked += len(packet_info['packet'])
+                        if packet_info['retry_count'] > 0:
+                            self.retransmissions_recovered += 1
+                    if self.window_backlog:
+                        self.scheduler.call_soon(self.drain_backlog)
+
+    def check_timeout(self, seq_num, packet_info):
+        """Retransmission timeout of one packet (scheduler event armed when it was sent)"""
+        drain = False
+        with self.ack_lock:
+            if self.pending_packets.get(seq_num) is not packet_info:
+                return  # Acknowledged (or given up) since the timer was armed
+
+            if packet_info['retry_count'] < self.max_retries:
+                # Retransmit, doubling this packet's timeout (exponential backoff)
+                self.socket.sendto(packet_info['packet'], packet_info['addr'])
+                packet_info['send_time'] = time.time()
+                packet_info['rto'] = min(max(packet_info['rto'] * 2, self.rto_floor()), self.max_rto)
+                packet_info['retry_count'] += 1
+                self.retransmission_count += 1
+                self.scheduler.call_at(packet_info['send_time'] + packet_info['rto'],
+                                       self.check_timeout, seq_num, packet_info)
+                if self.packet_log.enabled and self.packet_log.sample():
+                    log.info(f"[{datetime.now().strftime('%H:%M:%S')}] [RETRANSMIT] seq {seq_num} (attempt {packet_info['retry_count']}/{self.max_retries})")
+            else:
+                # Max retries exceeded, give up (frees the window slot)
+                del self.pending_packets[seq_num]
+                self.packets_given_up += 1
+                drain = bool(self.window_backlog)
+                log.warning(f"[{datetime.now().strftime('%H:%M:%S')}] [LOST] seq {seq_num} after {self.max_retries} retries")
+        if drain:
+            self.drain_backlog()
+
+    def rto_floor(self):
+        """
+        Lowest RTO: min_rto, and never less than twice the longest ACK hold of a
+        coalescing collector (MAX_ACK_DELAY). The hold counts as RTT in the samples
+        with almost no deviation, so without this the RTO would settle just above
+        it and fire on the flush tail.
+        """
+        return max(self.min_rto, 2 * MAX_ACK_DELAY)
+
+    def window_admits(self, readings, send, *args):
+        """
+        True if a packet may be sent now. Otherwise the window is full: with the
+        'block' policy send(*args) is queued until an ACK (or a give-up) frees a
+        slot, with 'drop' the packet's readings are discarded. The scheduler
+        thread never waits for the window. The 'block' queue holds at most
+        backlog_windows * window_size packets (e.g. while the collector is
+        down); beyond that the oldest queued packet is dropped.
+        """
+        with self.ack_lock:
+            if not self.window_size or (not self.window_backlog and
+                                        len(self.pending_packets) < self.window_size):
+                return True
+            if self.window_policy == 'drop':
+                self.window_drops += readings
+                return False
+            if len(self.window_backlog) >= self.backlog_windows * self.window_size:
+                _, dropped_readings, _, _ = self.window_backlog.popleft()
+                self.window_drops += dropped_readings
+            self.window_backlog.append((time.time(), readings, send, args))
+            if len(self.window_backlog) > self.max_backlog:
+                self.max_backlog = len(self.window_backlog)
+            return False
+
+    def drain_backlog(self):
+        """Send queued packets, oldest first, while the window has free slots"""
         while True:
-            try:
-                time.sleep(0.1)  # Check every 100ms
-                current_time = time.time()
-                
-                with self.ack_lock:
-                    for seq_num, packet_info in list(self.pending_packets.items()):
-                        time_elapsed = current_time - packet_info['send_time']
-                        
-                        if time_elapsed > self.ack_timeout:
-                            if packet_info['retry_count'] < self.max_retries:
-                                # Retransmit
-                                self.socket.sendto(packet_info['packet'], packet_info['addr'])
-                                packet_info['send_time'] = current_time
-                                packet_info['retry_count'] += 1
-                                self.retransmission_count += 1
-                                print(f"[{datetime.now().strftime('%H:%M:%S')}] [RETRANSMIT] seq {seq_num} (attempt {packet_info['retry_count']}/{self.max_retries})")
-                            else:
-                                # Max retries exceeded, give up
-                                del self.pending_packets[seq_num]
-                                print(f"[{datetime.now().strftime('%H:%M:%S')}] [LOST] seq {seq_num} after {self.max_retries} retries")
-            except Exception:
-                break  # Exit on error
+            with self.ack_lock:
+                if not self.window_backlog or len(self.pending_packets) >= self.window_size:
+                    return
+                parked_at, _, send, args = self.window_backlog.popleft()
+                self.window_blocked_time += time.time() - parked_at
+            send(*args)
+
+    def track_packet(self, seq, message, readings, send_time):
+        """Put a DATA/BATCH packet in the send window (caller holds ack_lock)"""
+        rto = max(self.rto_floor(), self.ack_timeout)
+        self.pending_packets[seq] = {
+            'packet': message,
+            'retry_count': 0,
+            'send_time': send_time,
+            'rto': rto,  # Backed off per packet on each retransmission
+            'readings': readings,
+            'addr': (self.server_host, self.server_port)
+        }
+        self.scheduler.call_at(send_time + rto, self.check_timeout, seq, self.pending_packets[seq])
+        self.packets_sent += 1
+        occupancy = len(self.pending_packets)
+        self.occupancy_sum += occupancy
+        self.occupancy_samples += 1
+        if occupancy > self.max_occupancy:
+            self.max_occupancy = occupancy
 
     def connect(self):
         """Create UDP socket"""
@@ -106,34 +230,34 @@ class TelemetrySensor:
         # Get the local port for sending (so server knows where to send ACKs)
         self.socket = self.ack_socket  # Use same socket for send/receive
         
-        print("[SENSOR] TinyTelemetry Sensor v1")
-        print(f"[SENSOR] Device ID: {self.device_id}")
-        print(f"[SENSOR] Target server: {self.server_host}:{self.server_port}")
-        print("-" * 80)
+        self.packet_log = PacketLogSampler(log, self.packet_log.every)  # Logging may have been set up since __init__
+        log.info("[SENSOR] TinyTelemetry Sensor v1")
+        log.info(f"[SENSOR] Device ID: {self.device_id}")
+        log.info(f"[SENSOR] Target server: {self.server_host}:{self.server_port}")
+        log.info("-" * 80)
         
-        # Start ACK listener and retransmission timer threads
+        # Start ACK listener thread (retransmission timers run on the scheduler)
         ack_thread = threading.Thread(target=self.ack_listener_thread, daemon=True)
         ack_thread.start()
-        
-        timer_thread = threading.Thread(target=self.retransmission_timer_thread, daemon=True)
-        timer_thread.start()
 
     def send_init(self):
         """Send INIT message to server"""
         message = TinyTelemetryProtocol.create_message(
             msg_type=MSG_INIT,
             device_id=self.device_id,
-            seq_num=self.seq_num
+            seq_num=self.seq_num,
+            version=self.protocol_version
         )
 
         self.socket.sendto(message, (self.server_host, self.server_port))
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Sent INIT message (seq: {self.seq_num})")
+        log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Sent INIT message (seq: {self.seq_num})")
         self.seq_num += 1
 
     def send_data(self, temperature, humidity):
         # Simulate packet loss
         if random.random() < self.packet_loss_rate:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] [SIMULATED LOSS] Packet seq {self.seq_num} dropped!")
+            if self.packet_log.enabled and self.packet_log.sample():
+                log.info(f"[{datetime.now().strftime('%H:%M:%S')}] [SIMULATED LOSS] Packet seq {self.seq_num} dropped!")
             self.seq_num += 1  # Still increment seq so server detects gap
             return  # Don't send the packet
 
@@ -152,113 +276,121 @@ class TelemetrySensor:
             return
 
         """Send DATA message with sensor readings"""
-        # Create JSON payload
-        payload_dict = {
-            'temperature': round(temperature, 2),
-            'humidity': round(humidity, 2)
-        }
-        payload = json.dumps(payload_dict).encode('utf-8')
+        seq_num = self.seq_num
+        self.seq_num += 1  # Consumed even if the window discards the reading: the server sees a gap
+        if self.window_admits(1, self.send_reading, seq_num, temperature, humidity):
+            self.send_reading(seq_num, temperature, humidity)
+
+    def send_reading(self, seq_num, temperature, humidity):
+        """Encode one reading as a DATA packet and send it (window slot already granted)"""
+        if self.protocol_version == PROTOCOL_VERSION_BINARY:
+            # Fixed-point binary payload (4 bytes)
+            payload = TinyTelemetryProtocol.encode_data_payload(temperature, humidity)
+        else:
+            # Create JSON payload
+            payload_dict = {
+                'temperature': round(temperature, 2),
+                'humidity': round(humidity, 2)
+            }
+            payload = json.dumps(payload_dict).encode('utf-8')
 
         # Create message
         message = TinyTelemetryProtocol.create_message(
             msg_type=MSG_DATA,
             device_id=self.device_id,
-            seq_num=self.seq_num,
-            payload=payload
+            seq_num=seq_num,
+            payload=payload,
+            flags=FLAG_SACK_OK if self.sack_enabled else 0,
+            version=self.protocol_version
         )
         
-        current_seq = self.seq_num  # Capture for logging
+        current_seq = seq_num & SEQ_MASK  # Header seq (wraps at 16 bits); keys pending_packets
         
-        # Simulate network jitter using threading (packets can overtake each other)
+        # Simulate network jitter with a scheduler event (packets can overtake each other)
         if self.jitter_max > 0:
             delay = random.uniform(0, self.jitter_max)
-            # Create a thread that waits, then sends
-            def delayed_send(msg, seq, delay_time, temp, hum):
-                time.sleep(delay_time)
-                # Add pending entry BEFORE sending to avoid race where ACK arrives
-                # before the pending entry exists.
-                with self.ack_lock:
-                    self.pending_packets[seq] = {
-                        'packet': msg,
-                        'retry_count': 0,
-                        'send_time': time.time(),
-                        'addr': (self.server_host, self.server_port)
-                    }
-                self.socket.sendto(msg, (self.server_host, self.server_port))
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] Sent DATA (seq: {seq}, delay: {delay_time*1000:.0f}ms): "
-                      f"temp={temp:.1f}°C, humidity={hum:.1f}%")
-            
-            thread = threading.Thread(target=delayed_send, args=(message, current_seq, delay, temperature, humidity))
-            thread.daemon = True
-            thread.start()
+            # Take the window slot now; the timer starts when the delayed send goes out
+            with self.ack_lock:
+                self.track_packet(current_seq, message, 1, time.time() + delay)
+            self.scheduler.call_later(delay, self.delayed_send, message, current_seq, delay, temperature, humidity)
         else:
             # No jitter - send immediately
             # Add to pending packets BEFORE sending to avoid ACK race
             with self.ack_lock:
-                self.pending_packets[current_seq] = {
-                    'packet': message,
-                    'retry_count': 0,
-                    'send_time': time.time(),
-                    'addr': (self.server_host, self.server_port)
-                }
+                self.track_packet(current_seq, message, 1, time.time())
             self.socket.sendto(message, (self.server_host, self.server_port))
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Sent DATA (seq: {self.seq_num}): "
-                  f"temp={temperature:.1f}°C, humidity={humidity:.1f}%")
-        
-        self.seq_num += 1
+            if self.packet_log.enabled and self.packet_log.sample():
+                log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Sent DATA (seq: {seq_num}): "
+                         f"temp={temperature:.1f}°C, humidity={humidity:.1f}%")
 
-    def send_batch(self):
-        """Send all buffered readings as a single BATCH message"""
-        if not self.batch_buffer:
+    def delayed_send(self, message, seq_num, delay, temperature, humidity):
+        """Send a jittered DATA packet once its delay has passed (scheduler event)"""
+        self.socket.sendto(message, (self.server_host, self.server_port))
+        if self.packet_log.enabled and self.packet_log.sample():
+            log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Sent DATA (seq: {seq_num}, delay: {delay*1000:.0f}ms): "
+                     f"temp={temperature:.1f}°C, humidity={humidity:.1f}%")
+
+    def send_batch(self, readings=None):
+        """Send buffered readings (default: the whole batch buffer) as a single BATCH message"""
+        if readings is None:
+            readings, self.batch_buffer = self.batch_buffer, []  # Clear buffer
+        if not readings:
             return
         
         # Use the last reading's seq_num as the batch packet seq
-        last_seq = self.batch_buffer[-1]['seq_num']
+        last_seq = readings[-1]['seq_num']
         
-        # Create compact JSON (no spaces, 2 decimal places for floats)
-        compact_buffer = [
-            {
-                'seq_num': r['seq_num'],
-                'temperature': round(r['temperature'], 2),
-                'humidity': round(r['humidity'], 2)
-            }
-            for r in self.batch_buffer
-        ]
-        payload = json.dumps(compact_buffer, separators=(',', ':')).encode('utf-8')
+        version = self.protocol_version
+        payload = None
+        if version == PROTOCOL_VERSION_BINARY:
+            try:
+                payload = TinyTelemetryProtocol.encode_batch_payload(readings)
+            except ValueError:
+                # Seq gap too large for a delta (or reading out of range): send this batch as JSON
+                version = PROTOCOL_VERSION_JSON
+
+        if payload is None:
+            # Create compact JSON (no spaces, 2 decimal places for floats)
+            compact_buffer = [
+                {
+                    'seq_num': r['seq_num'],
+                    'temperature': round(r['temperature'], 2),
+                    'humidity': round(r['humidity'], 2)
+                }
+                for r in readings
+            ]
+            payload = json.dumps(compact_buffer, separators=(',', ':')).encode('utf-8')
         
         # Check payload size (max 200 bytes for Phase 2)
         if len(payload) > 200:
-            print(f"[WARNING] Batch payload {len(payload)} bytes exceeds 200 byte limit! Splitting batch...")
+            log.warning(f"[WARNING] Batch payload {len(payload)} bytes exceeds 200 byte limit! Splitting batch...")
             # Split batch in half and send separately
-            mid = len(self.batch_buffer) // 2
-            first_half = self.batch_buffer[:mid]
-            second_half = self.batch_buffer[mid:]
-            self.batch_buffer = first_half
-            self.send_batch()  # Recursive call for first half
-            self.batch_buffer = second_half
-            self.send_batch()  # Recursive call for second half
+            mid = len(readings) // 2
+            self.send_batch(readings[:mid])  # Recursive call for first half
+            self.send_batch(readings[mid:])  # Recursive call for second half
             return
         
         message = TinyTelemetryProtocol.create_message(
             msg_type=3,  # MSG_BATCH
             device_id=self.device_id,
             seq_num=last_seq,  # Use last reading's seq, not a new one
-            payload=payload
+            payload=payload,
+            flags=FLAG_SACK_OK if self.sack_enabled else 0,
+            version=version
         )
-        self.socket.sendto(message, (self.server_host, self.server_port))
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] [BATCH] Sent {len(self.batch_buffer)} readings (seq {self.batch_buffer[0]['seq_num']}-{last_seq}) | {len(payload)} bytes")
+        # Don't increment seq_num - readings already have their seq numbers
+        if self.window_admits(len(readings), self.transmit_batch, readings, message, len(payload)):
+            self.transmit_batch(readings, message, len(payload))
+
+    def transmit_batch(self, readings, message, payload_size):
+        """Send an encoded BATCH packet (window slot already granted)"""
+        last_seq = readings[-1]['seq_num']
         # Add to pending packets for ACK tracking BEFORE sending to avoid race
         with self.ack_lock:
-            self.pending_packets[last_seq] = {
-                'packet': message,
-                'retry_count': 0,
-                'send_time': time.time(),
-                'addr': (self.server_host, self.server_port)
-            }
-        # Note: packet was already sent above; keeping ordering consistent
-        
-        # Don't increment seq_num - readings already have their seq numbers
-        self.batch_buffer = []  # Clear buffer
+            self.track_packet(last_seq & SEQ_MASK, message, len(readings), time.time())
+        self.socket.sendto(message, (self.server_host, self.server_port))
+        if self.packet_log.enabled and self.packet_log.sample():
+            log.info(f"[{datetime.now().strftime('%H:%M:%S')}] [BATCH] Sent {len(readings)} readings (seq {readings[0]['seq_num']}-{last_seq}) | {payload_size} bytes")
 
     def simulate_sensor_readings(self):
         """Generate realistic sensor readings"""
@@ -291,61 +423,47 @@ class TelemetrySensor:
 
             # Send DATA messages periodically
             start_time = time.time()
-            next_send_time = start_time + interval
+            end_time = start_time + duration
 
-            print(f"\n[SENSOR] Starting data transmission (interval: {interval}s, duration: {duration}s)")
-            print("-" * 80)
+            log.info(f"[SENSOR] Starting data transmission (interval: {interval}s, duration: {duration}s)")
+            log.info("-" * 80)
 
-            # Send HEARTBEAT messages periodically
-            last_heartbeat_time = start_time
-            heartbeat_interval = 10  # seconds
-
-            while time.time() - start_time < duration:
-                current_time = time.time()
-
-                if current_time >= next_send_time:
-                    # Generate and send sensor data
-                    temperature, humidity = self.simulate_sensor_readings()
-                    self.send_data(temperature, humidity)
-
-                    # Schedule next send
-                    next_send_time += interval
-                    last_heartbeat_time = current_time
-                
-                #send HEARTBEAT if no data has been sent recently
-                if current_time - last_heartbeat_time >= heartbeat_interval:
-                    self.send_heartbeat()
-                    last_heartbeat_time = current_time
-
-                # Small sleep to prevent busy waiting
-                time.sleep(0.01)
+            # Readings, heartbeats and summaries are scheduler events; so are jittered
+            # sends and retransmission timeouts, armed as packets go out
+            self.last_activity = start_time
+            self.scheduler.call_at(start_time + interval, self.reading_event, start_time + interval, interval, end_time)
+            self.scheduler.call_at(start_time + self.heartbeat_interval, self.heartbeat_event, end_time)
+            self.scheduler.call_at(start_time + self.summary_interval, self.summary_event,
+                                   start_time + self.summary_interval, end_time)
+            self.scheduler.run(until=end_time)
 
             # Flush any remaining readings in batch buffer
             if self.batch_buffer:
-                print(f"[SENSOR] Flushing {len(self.batch_buffer)} remaining readings from batch buffer...")
+                log.info(f"[SENSOR] Flushing {len(self.batch_buffer)} remaining readings from batch buffer...")
                 self.send_batch()
 
             # Wait for final ACKs
-            print("[SENSOR] Waiting for final ACKs...")
-            time.sleep(2)
+            log.info("[SENSOR] Waiting for final ACKs...")
+            self.scheduler.run(until=time.time() + 2)  # Retransmissions keep running meanwhile
             
-            print("-" * 80)
-            print(f"[SENSOR] Transmission complete. Sent {self.seq_num} messages total.")
+            log.info("-" * 80)
+            log.info(f"[SENSOR] Transmission complete. Sent {self.seq_num} messages total.")
+            flush_logging()  # Queued log lines first, so the report comes last
             
             # Display RDT statistics
             print("\n" + "=" * 80)
             print("[RDT STATISTICS]")
             print("=" * 80)
             print(f"  Total packets sent:       {self.seq_num}")
-            print(f"  ACKs received:            {self.ack_received_count}")
+            print(f"  ACKs received:            {self.ack_received_count} ({self.ack_datagrams_received} ACK datagrams)")
             print(f"  Retransmissions:          {self.retransmission_count}")
             if self.seq_num > 0:
                 print(f"  Retransmission rate:      {(self.retransmission_count / self.seq_num * 100):.2f}%")
             print(f"  Estimated RTT:            {self.estimated_rtt * 1000:.2f} ms")
             print(f"  RTT deviation:            {self.dev_rtt * 1000:.2f} ms")
             print(f"  Current timeout (RTO):    {self.ack_timeout * 1000:.2f} ms")
-            print(f"  Timeout calculation:      RTO = estimatedRTT + 4 * devRTT")
-            print(f"                            = {self.estimated_rtt * 1000:.2f} + 4 * {self.dev_rtt * 1000:.2f}")
+            print(f"  Timeout calculation:      RTO = max(minRTO, estimatedRTT + 4 * devRTT)")
+            print(f"                            = max({self.rto_floor() * 1000:.2f}, {self.estimated_rtt * 1000:.2f} + 4 * {self.dev_rtt * 1000:.2f})")
             print(f"                            = {self.ack_timeout * 1000:.2f} ms")
             
             with self.ack_lock:
@@ -354,26 +472,93 @@ class TelemetrySensor:
                 print(f"  Unacknowledged packets:   {unacked} (lost after {self.max_retries} retries)")
             else:
                 print(f"  Unacknowledged packets:   0 (100% delivery success!)")
+            self.print_window_statistics(time.time() - start_time)
             print("=" * 80)
 
         except KeyboardInterrupt:
-            print("\n[SENSOR] Interrupted by user")
+            log.info("[SENSOR] Interrupted by user")
         except Exception as e:
-            print(f"[ERROR] Sensor error: {e}")
+            log.error(f"[ERROR] Sensor error: {e}")
         finally:
             if self.socket:
                 self.socket.close()
 
+    def reading_event(self, when, interval, end_time):
+        """Take and send one reading, then schedule the next one interval later"""
+        if time.time() >= end_time:
+            return
+        # Generate and send sensor data
+        temperature, humidity = self.simulate_sensor_readings()
+        self.send_data(temperature, humidity)
+        self.last_activity = time.time()
+        # Schedule next send (on the original grid, so a late event does not shift later readings)
+        self.scheduler.call_at(when + interval, self.reading_event, when + interval, interval, end_time)
+
+    def heartbeat_event(self, end_time):
+        """Send HEARTBEAT if no data has been sent recently"""
+        current_time = time.time()
+        if current_time >= end_time:
+            return
+        if current_time - self.last_activity >= self.heartbeat_interval:
+            self.send_heartbeat()
+            self.last_activity = current_time
+        self.scheduler.call_at(self.last_activity + self.heartbeat_interval, self.heartbeat_event, end_time)
+
+    def summary_event(self, when, end_time):
+        """Periodic progress line"""
+        if time.time() >= end_time:
+            return
+        self.log_summary()
+        self.scheduler.call_at(when + self.summary_interval, self.summary_event, when + self.summary_interval, end_time)
+
+    def print_window_statistics(self, elapsed):
+        """Print send window accounting: occupancy, goodput and retransmission efficiency"""
+        with self.ack_lock:
+            window = f"{self.window_size} packets" if self.window_size else 'unbounded'
+            print(f"  Send window:              {window} ({self.window_policy} when full)")
+            avg_occupancy = self.occupancy_sum / self.occupancy_samples if self.occupancy_samples else 0.0
+            print(f"  Window occupancy:         avg {avg_occupancy:.1f}, max {self.max_occupancy}")
+            if self.window_policy == 'drop':
+                print(f"  Window-full drops:        {self.window_drops} readings")
+            else:
+                print(f"  Time queued for window:   {self.window_blocked_time:.2f} s total "
+                      f"(max {self.max_backlog} packets queued, {len(self.window_backlog)} never sent)")
+                if self.window_drops:
+                    print(f"  Backlog-full drops:       {self.window_drops} readings "
+                          f"(queue limit {self.backlog_windows * self.window_size} packets)")
+            if elapsed > 0:
+                print(f"  Goodput:                  {self.readings_acked / elapsed:.2f} readings/s "
+                      f"({self.bytes_acked / elapsed:.0f} B/s acknowledged)")
+            if self.retransmission_count > 0:
+                print(f"  Retransmission efficiency: {self.retransmissions_recovered}/{self.retransmission_count} "
+                      f"retransmitted packets recovered "
+                      f"({self.retransmissions_recovered / self.retransmission_count * 100:.1f}%), "
+                      f"{self.packets_given_up} given up")
+            transmissions = self.packets_sent + self.retransmission_count
+            if transmissions > 0:
+                print(f"  Useful transmissions:     {self.ack_received_count / transmissions * 100:.1f}% "
+                      f"({self.ack_received_count} ACKed / {transmissions} sent incl. retransmissions)")
+
+    def log_summary(self):
+        """Log one aggregated progress line (per-send lines may be sampled away)"""
+        with self.ack_lock:
+            pending = len(self.pending_packets)
+        log.info(f"[SENSOR] Progress: seq {self.seq_num}, {self.ack_received_count} ACKs, "
+                 f"{self.retransmission_count} retransmissions, {pending} awaiting ACK, "
+                 f"RTO {self.ack_timeout * 1000:.0f} ms")
+
     def send_heartbeat(self):
         """Send HEARTBEAT message to server (doesn't consume sequence number)"""
         message = TinyTelemetryProtocol.create_message(
             msg_type=MSG_HEARTBEAT,
             device_id=self.device_id,
-            seq_num=0  # Heartbeats don't need sequence tracking
+            seq_num=0,  # Heartbeats don't need sequence tracking
+            version=self.protocol_version
         )
 
         self.socket.sendto(message, (self.server_host, self.server_port))
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Sent HEARTBEAT message")
+        if self.packet_log.enabled and self.packet_log.sample():
+            log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Sent HEARTBEAT message")
         # Don't increment seq_num - heartbeats are just status signals
 
 
@@ -388,9 +573,12 @@ def main():
     packet_loss_rate = 0.0
     jitter_max = 0.0
     batch_size = 0
+    payload_format = 'binary'
+    window_size = 32
+    window_policy = 'block'
 
     # Parse command line arguments
-    # Usage: python client.py <device_id> <interval> <duration> <loss_rate> <jitter_max> <batch_size> [server_ip]
+    # Usage: python client.py <device_id> <interval> <duration> <loss_rate> <jitter_max> <batch_size> [server_ip] [json|binary] [window_size] [block|drop]
     if len(sys.argv) > 1:
         device_id = int(sys.argv[1])
     if len(sys.argv) > 2:
@@ -405,19 +593,34 @@ def main():
         batch_size = int(sys.argv[6])
     if len(sys.argv) > 7:
         server_host = sys.argv[7]  # Remote server IP
+    if len(sys.argv) > 8:
+        payload_format = sys.argv[8].lower()  # 'json' for legacy (v1) collectors
+    if len(sys.argv) > 9:
+        window_size = int(sys.argv[9])  # 0 = unbounded
+    if len(sys.argv) > 10:
+        window_policy = sys.argv[10].lower()
     
+    # Logging is configured from TT_LOG_LEVEL / TT_LOG_FILE / TT_LOG_SAMPLE / TT_LOG_SUMMARY
+    setup_logging()
+
     # Print configuration
-    print(f"[CONFIG] Server: {server_host}:{server_port}")
-    print(f"[CONFIG] Device ID: {device_id}, Interval: {interval}s, Duration: {duration}s")
-    print(f"[CONFIG] Loss Rate: {packet_loss_rate*100}%, Jitter Max: {jitter_max}s, Batch Size: {batch_size}")
-    print("-" * 80)
+    log.info(f"[CONFIG] Server: {server_host}:{server_port}")
+    log.info(f"[CONFIG] Device ID: {device_id}, Interval: {interval}s, Duration: {duration}s")
+    log.info(f"[CONFIG] Loss Rate: {packet_loss_rate*100}%, Jitter Max: {jitter_max}s, Batch Size: {batch_size}")
+    log.info(f"[CONFIG] Payload Format: {payload_format}")
+    log.info(f"[CONFIG] Send Window: {window_size or 'unbounded'} ({window_policy} when full)")
+    log.info("-" * 80)
     
     # Create and configure sensor
     sensor = TelemetrySensor(device_id, server_host, server_port)
     sensor.packet_loss_rate = packet_loss_rate
     sensor.jitter_max = jitter_max
     sensor.batch_size = batch_size
+    sensor.window_size = window_size
+    sensor.window_policy = window_policy
+    sensor.protocol_version = PROTOCOL_VERSION_JSON if payload_format == 'json' else PROTOCOL_VERSION_BINARY
     sensor.run(interval, duration)
+    shutdown_logging()
 
 if __name__ == '__main__':
     main()
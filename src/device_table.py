@@ -0,0 +1,122 @@
+from array import array
+
+MAX_DEVICES = 1 << 16  # device_id is a 16-bit header field
+
+# (column, array typecode, value for a device that was never seen / was reset)
+COLUMNS = [
+    ('active', 'b', 0),             # 1 while the collector tracks the device
+    ('last_seq', 'i', -1),          # Newest DATA seq received (-1: none yet; heartbeats do not count)
+    ('last_timestamp', 'q', 0),     # Header timestamp of the last accepted packet
+    ('packet_count', 'q', 0),       # Packets accepted (duplicates excluded)
+    ('heartbeat_count', 'q', 0),
+    ('last_seen', 'd', 0.0),        # Arrival time of the last accepted packet
+    ('cum_ack', 'i', 0),            # Cumulative ACK point sent to the device (sack mode)
+    ('last_reading_seq', 'i', 0),   # Seq of the last reading of the last BATCH (INIT is seq 0)
+]
+
+
+def _numpy():
+    """The numpy module, or None if it is not installed (reductions then run in pure Python)"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class DeviceTable:
+    """
+    Per-device collector state in preallocated columns indexed by device_id.
+
+    Each column is an array.array of MAX_DEVICES entries (about 2.5 MB for
+    the whole table), so memory does not grow with the fleet and a lookup is
+    one index into a flat array: `table.last_seq[device_id]`. Whole-fleet
+    statistics are reductions over the columns (numpy views of the same
+    buffers when numpy is installed, no copy).
+    """
+
+    def __init__(self):
+        for name, typecode, initial in COLUMNS:
+            setattr(self, name, array(typecode, [initial]) * MAX_DEVICES)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, device_id):
+        return self.active[device_id] == 1
+
+    def add(self, device_id, cum_ack, now):
+        """Start tracking a device with fresh state"""
+        for name, _, initial in COLUMNS:
+            getattr(self, name)[device_id] = initial
+        self.active[device_id] = 1
+        self.cum_ack[device_id] = cum_ack
+        self.last_seen[device_id] = now
+        self.count += 1
+
+    def remove(self, device_id):
+        """Stop tracking a device (its columns are reset when it is added again)"""
+        if self.active[device_id]:
+            self.active[device_id] = 0
+            self.count -= 1
+
+    def ids(self):
+        """Tracked device_ids in ascending order"""
+        np = _numpy()
+        if np is not None:
+            return np.flatnonzero(np.frombuffer(self.active, dtype=np.int8)).tolist()
+        return [device_id for device_id, active in enumerate(self.active) if active]
+
+    def rows(self, columns):
+        """{device_id: {column: value}} for every tracked device (in device_id order)"""
+        ids = self.ids()
+        np = _numpy()
+        if np is not None and ids:
+            index = np.array(ids)
+            values = [np.frombuffer(getattr(self, column), dtype=getattr(self, column).typecode)[index].tolist()
+                      for column in columns]
+            return {device_id: dict(zip(columns, row)) for device_id, row in zip(ids, zip(*values))}
+        return {device_id: {column: getattr(self, column)[device_id] for column in columns} for device_id in ids}
+
+    def fleet_stats(self):
+        """
+        Reductions over the tracked devices: {'devices', 'packets', 'heartbeats',
+        'min_packets', 'max_packets', 'oldest_last_seen'} (None where there are no devices)
+        """
+        np = _numpy()
+        if np is None:
+            ids = self.ids()
+            packets = [self.packet_count[device_id] for device_id in ids]
+            return {
+                'devices': len(ids),
+                'packets': sum(packets),
+                'heartbeats': sum(self.heartbeat_count[device_id] for device_id in ids),
+                'min_packets': min(packets) if ids else None,
+                'max_packets': max(packets) if ids else None,
+                'oldest_last_seen': min((self.last_seen[device_id] for device_id in ids), default=None),
+            }
+        active = np.frombuffer(self.active, dtype=np.int8).astype(bool)
+        packets = np.frombuffer(self.packet_count, dtype=np.int64)[active]
+        devices = int(packets.size)
+        return {
+            'devices': devices,
+            'packets': int(packets.sum()),
+            'heartbeats': int(np.frombuffer(self.heartbeat_count, dtype=np.int64)[active].sum()),
+            'min_packets': int(packets.min()) if devices else None,
+            'max_packets': int(packets.max()) if devices else None,
+            'oldest_last_seen': float(np.frombuffer(self.last_seen, dtype=np.float64)[active].min()) if devices else None,
+        }
+
+
+def merge_fleet_stats(fleets):
+    """Combine fleet_stats() of shards that track disjoint devices"""
+    merged = {'devices': 0, 'packets': 0, 'heartbeats': 0,
+              'min_packets': None, 'max_packets': None, 'oldest_last_seen': None}
+    for fleet in fleets:
+        for key in ('devices', 'packets', 'heartbeats'):
+            merged[key] += fleet[key]
+        if fleet['devices']:
+            for key, pick in (('min_packets', min), ('max_packets', max), ('oldest_last_seen', min)):
+                merged[key] = fleet[key] if merged[key] is None else pick(merged[key], fleet[key])
+    return merged
@@ -0,0 +1,178 @@
+from array import array
+
+# Log-linear buckets (HdrHistogram style): each power of two is split into
+# 64 equal sub-buckets, so a recorded value is known to within 1/64 (1.6%)
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+MAX_VALUE_BITS = 44  # Values up to 2**44 ns (~4.9 hours); larger ones land in the last bucket
+BUCKET_COUNT = (MAX_VALUE_BITS - SUB_BUCKET_BITS) * SUB_BUCKET_HALF + (1 << SUB_BUCKET_BITS)
+
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(value):
+    """Bucket of a non-negative integer value"""
+    bits = value.bit_length()
+    if bits <= SUB_BUCKET_BITS:
+        return value  # Small values get a bucket each
+    shift = bits - SUB_BUCKET_BITS
+    index = (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+    return index if index < BUCKET_COUNT else BUCKET_COUNT - 1
+
+
+def bucket_range(index):
+    """(lowest, highest) value counted in a bucket"""
+    if index < (1 << SUB_BUCKET_BITS):
+        return index, index
+    shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    low = (index - (shift << (SUB_BUCKET_BITS - 1))) << shift
+    return low, low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Fixed-memory latency histogram in nanoseconds.
+
+    Recording is one bucket increment whatever the number of samples, and two
+    histograms merge exactly by adding their buckets, so shards can combine
+    them into true percentiles. Percentiles report the highest value of the
+    bucket they fall in (at most 1.6% above the recorded value).
+    """
+
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = array('q', bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0  # Sum of recorded values (ns), for the mean
+
+    def record(self, value):
+        """Add one non-negative integer value in nanoseconds (bucket_index inlined: this is per packet)"""
+        bits = value.bit_length()
+        if bits <= SUB_BUCKET_BITS:
+            index = value
+        else:
+            shift = bits - SUB_BUCKET_BITS
+            index = (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+            if index >= BUCKET_COUNT:
+                index = BUCKET_COUNT - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def record_seconds(self, seconds):
+        """Add one value given in seconds (negative ones, from clock steps, count as 0)"""
+        self.record(int(seconds * 1e9) if seconds > 0 else 0)
+
+    def record_since(self, timestamps, now):
+        """Add now - t for each time.time() timestamp t (e.g. rows written at now, by arrival time)"""
+        for timestamp in timestamps:
+            self.record_seconds(now - timestamp)
+
+    def merge(self, other):
+        """Add every sample of other to this histogram"""
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+
+    def percentiles(self, percents=REPORT_PERCENTILES):
+        """Values (ns) at each percentile, in one pass over the buckets (zeros if empty)"""
+        if not self.count:
+            return [0] * len(percents)
+        targets = sorted((max(1, -(-self.count * percent // 100)), position)
+                         for position, percent in enumerate(percents))
+        results = [0] * len(percents)
+        seen = 0
+        pending = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while pending < len(targets) and targets[pending][0] <= seen:
+                results[targets[pending][1]] = bucket_range(index)[1]
+                pending += 1
+            if pending == len(targets):
+                break
+        return results
+
+    def max(self):
+        """Highest value recorded (ns, to bucket precision), 0 if empty"""
+        for index in range(BUCKET_COUNT - 1, -1, -1):
+            if self.counts[index]:
+                return bucket_range(index)[1]
+        return 0
+
+    def summary(self):
+        """{'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'p999_ms', 'max_ms'} ({'count': 0} if empty)"""
+        if not self.count:
+            return {'count': 0}
+        p50, p90, p99, p999 = self.percentiles(REPORT_PERCENTILES)
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e6,
+            'p50_ms': p50 / 1e6,
+            'p90_ms': p90 / 1e6,
+            'p99_ms': p99 / 1e6,
+            'p999_ms': p999 / 1e6,
+            'max_ms': self.max() / 1e6,
+        }
+
+    def to_dict(self):
+        """Plain dict of the non-empty buckets (picklable, JSON-serializable)"""
+        return {
+            'count': self.count,
+            'total_ns': self.total,
+            'buckets': {index: count for index, count in enumerate(self.counts) if count},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, count in data['buckets'].items():
+            histogram.counts[int(index)] = count  # JSON turns the keys into strings
+        histogram.count = data['count']
+        histogram.total = data['total_ns']
+        return histogram
+
+
+class HistogramSet:
+    """LatencyHistograms by name (a processing stage or stage.message-type), created on first use"""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def __iter__(self):
+        return iter(sorted(self.histograms.items()))
+
+    def get(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        return histogram
+
+    def merge_dicts(self, data):
+        """Merge a to_dicts() snapshot (e.g. from another worker) into this set"""
+        for name, histogram in data.items():
+            self.get(name).merge(LatencyHistogram.from_dict(histogram))
+
+    def to_dicts(self):
+        return {name: histogram.to_dict() for name, histogram in self}
+
+
+def format_ms(value_ms):
+    """Latency with a readable unit (µs below 1 ms, s from 1 s)"""
+    if value_ms < 1:
+        return f"{value_ms * 1000:.1f} µs"
+    if value_ms < 1000:
+        return f"{value_ms:.2f} ms"
+    return f"{value_ms / 1000:.2f} s"
+
+
+def format_summary_line(name, summary):
+    """One report line for a LatencyHistogram.summary()"""
+    return (f"{name:<18} n={summary['count']:<9} p50 {format_ms(summary['p50_ms']):>10}  "
+            f"p90 {format_ms(summary['p90_ms']):>10}  p99 {format_ms(summary['p99_ms']):>10}  "
+            f"p99.9 {format_ms(summary['p999_ms']):>10}  max {format_ms(summary['max_ms']):>10}")
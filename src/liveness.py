@@ -0,0 +1,63 @@
+import heapq
+
+DEFAULT_DEVICE_TIMEOUT = 30.0  # Seconds without a packet before a device is marked offline
+
+
+class LivenessTracker:
+    """
+    Offline detection for devices, kept in a heap of deadlines (last_seen + timeout).
+
+    A packet only updates the device's last_seen time: its heap entry is left
+    where it is and re-pushed with the new deadline when it comes due (lazy
+    re-push), so each device has at most one entry and a packet costs one
+    dict store. expire() touches only the entries that are due, so a check
+    costs O(expired) rather than a scan of every device.
+    """
+
+    def __init__(self, timeout=DEFAULT_DEVICE_TIMEOUT):
+        self.timeout = timeout
+        self.heap = []         # (deadline, device_id), one entry per online device
+        self.last_seen = {}    # device_id -> time of the last packet (online devices only)
+        self.offline = {}      # device_id -> time it was marked offline, until it comes back
+        self.offline_events = 0
+        self.online_events = 0  # Devices coming back after being marked offline
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def seen(self, device_id, now):
+        """
+        Record a packet from device_id. Returns how long the device had been
+        offline if this packet brings it back online, else None.
+        """
+        if device_id in self.last_seen:
+            self.last_seen[device_id] = now
+            return None
+        self.last_seen[device_id] = now
+        heapq.heappush(self.heap, (now + self.timeout, device_id))
+        went_offline = self.offline.pop(device_id, None)
+        if went_offline is None:
+            return None  # First contact, not a transition
+        self.online_events += 1
+        return now - went_offline
+
+    def next_deadline(self):
+        """Earliest time a device may expire (entries can be stale: the device was seen since), or None"""
+        return self.heap[0][0] if self.heap else None
+
+    def expire(self, now):
+        """Mark devices silent for longer than the timeout as offline; returns [(device_id, silent seconds)]"""
+        heap = self.heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            _, device_id = heapq.heappop(heap)
+            last_seen = self.last_seen[device_id]
+            deadline = last_seen + self.timeout
+            if deadline > now:
+                heapq.heappush(heap, (deadline, device_id))  # Seen since the entry was pushed
+                continue
+            del self.last_seen[device_id]
+            self.offline[device_id] = now
+            self.offline_events += 1
+            expired.append((device_id, now - last_seen))
+        return expired
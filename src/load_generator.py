@@ -0,0 +1,317 @@
+import argparse
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from client import TelemetrySensor
+from protocol import TinyTelemetryProtocol, PROTOCOL_VERSION_JSON, PROTOCOL_VERSION_BINARY
+from scheduler import EventScheduler
+from telemetry_log import get_logger, setup_logging, flush_logging, shutdown_logging, PacketLogSampler, LOG_LEVEL, LOG_FILE
+
+log = get_logger('loadgen')
+
+# Device profiles: reporting interval (s), readings per packet, client-side loss rate, max jitter (s)
+PROFILES = {
+    'steady':  {'interval': 1.0, 'batch_size': 1, 'loss': 0.0, 'jitter': 0.0},
+    'batched': {'interval': 1.0, 'batch_size': 5, 'loss': 0.0, 'jitter': 0.0},
+    'lossy':   {'interval': 1.0, 'batch_size': 1, 'loss': 0.05, 'jitter': 0.05},
+    'bursty':  {'interval': 0.1, 'batch_size': 10, 'loss': 0.0, 'jitter': 0.02},
+}
+
+MAX_DEVICE_ID = 65535
+
+
+def parse_profile_mix(spec):
+    """
+    'steady' or 'steady=70,lossy=30' -> [(profile name, weight)].
+    Weights are relative; a profile without one counts as 1.
+    """
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in PROFILES:
+            raise ValueError(f"Unknown profile '{name}' (choose from {', '.join(PROFILES)})")
+        mix.append((name, float(weight) if weight else 1.0))
+    return mix
+
+
+class LoadGenerator:
+    """
+    Simulates thousands of sensors from one process.
+
+    Every device is a TelemetrySensor, so packets, window, RTO estimation,
+    retransmission and selective ACK handling are exactly the client's. The
+    devices share one EventScheduler (run on the main thread) and a small set
+    of UDP sockets, each with one thread that routes ACKs to their device by
+    the device_id in the ACK header. A device therefore costs a few dicts and
+    timer events instead of a process and two threads.
+    """
+
+    def __init__(self, server_host, server_port=5000, num_sockets=4):
+        self.server_host = server_host
+        self.server_port = server_port
+        self.num_sockets = num_sockets
+        self.sockets = []
+        self.listeners = []
+        self.devices = {}  # device_id -> TelemetrySensor
+        self.intervals = {}  # device_id -> reporting interval (s)
+        self.profile_counts = {}
+        self.scheduler = EventScheduler()
+        self.device_log = PacketLogSampler(get_logger('client'))  # Shared by all devices
+        self.running = False
+        self.summary_interval = 5.0
+        self.unroutable_datagrams = 0  # ACKs for unknown devices or too short to parse
+        self.max_lag = 0.0             # Worst scheduler lateness seen by the lag probe (seconds)
+        self.lag_sum = 0.0
+        self.lag_samples = 0
+
+    def add_devices(self, first_device_id, count, profile_mix, overrides=None, window_size=32,
+                    window_policy='block', protocol_version=PROTOCOL_VERSION_BINARY):
+        """Create count devices starting at first_device_id, drawing each one's profile from profile_mix"""
+        if first_device_id + count - 1 > MAX_DEVICE_ID:
+            raise ValueError(f"device_id range {first_device_id}-{first_device_id + count - 1} exceeds {MAX_DEVICE_ID}")
+        names = [name for name, _ in profile_mix]
+        weights = [weight for _, weight in profile_mix]
+        for device_id in range(first_device_id, first_device_id + count):
+            name = random.choices(names, weights)[0]
+            profile = dict(PROFILES[name], **(overrides or {}))
+            sensor = TelemetrySensor(device_id, self.server_host, self.server_port)
+            sensor.scheduler = self.scheduler
+            sensor.packet_log = self.device_log
+            self.intervals[device_id] = profile['interval']
+            sensor.batch_size = profile['batch_size']
+            sensor.packet_loss_rate = profile['loss']
+            sensor.jitter_max = profile['jitter']
+            sensor.window_size = window_size
+            sensor.window_policy = window_policy
+            sensor.protocol_version = protocol_version
+            self.devices[device_id] = sensor
+            self.profile_counts[name] = self.profile_counts.get(name, 0) + 1
+
+    def open_sockets(self):
+        """Create the shared sockets and start one ACK listener thread per socket"""
+        for _ in range(self.num_sockets):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(('', 0))
+            sock.settimeout(0.5)  # Lets the listener notice shutdown
+            self.sockets.append(sock)
+            listener = threading.Thread(target=self.ack_listener_thread, args=(sock,), daemon=True)
+            listener.start()
+            self.listeners.append(listener)
+        # Spread devices over the sockets (a device always uses the same source port)
+        for device_id, sensor in self.devices.items():
+            sensor.socket = self.sockets[device_id % self.num_sockets]
+
+    def ack_listener_thread(self, sock):
+        """Receive ACKs on one shared socket and hand each to the device it acknowledges"""
+        devices = self.devices
+        while self.running:
+            try:
+                data, _ = sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # Socket closed
+            try:
+                sensor = devices.get(TinyTelemetryProtocol.unpack_header(data).device_id)
+                if sensor is None:
+                    self.unroutable_datagrams += 1
+                    continue
+                sensor.handle_ack(data)
+            except ValueError:
+                self.unroutable_datagrams += 1
+
+    def start_device(self, sensor, end_time):
+        """Send a device's INIT and arm its reading and heartbeat events"""
+        sensor.send_init()
+        now = time.time()
+        interval = self.intervals[sensor.device_id]
+        sensor.last_activity = now
+        sensor.scheduler.call_at(now + interval, sensor.reading_event, now + interval, interval, end_time)
+        sensor.scheduler.call_at(now + sensor.heartbeat_interval, sensor.heartbeat_event, end_time)
+
+    def lag_probe(self, when):
+        """Measure how late the scheduler runs events (the generator itself is saturated if this grows)"""
+        lag = time.time() - when
+        self.lag_sum += lag
+        self.lag_samples += 1
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if self.running:
+            self.scheduler.call_at(when + 0.1, self.lag_probe, when + 0.1)
+
+    def totals(self):
+        """Counters summed over all devices"""
+        totals = {'packets_sent': 0, 'readings': 0, 'readings_acked': 0, 'acked_packets': 0,
+                  'ack_datagrams': 0, 'retransmissions': 0, 'recovered': 0, 'given_up': 0,
+                  'window_drops': 0, 'pending': 0, 'backlog': 0, 'rtt_sum': 0.0, 'rtt_devices': 0}
+        for sensor in self.devices.values():
+            with sensor.ack_lock:
+                totals['packets_sent'] += sensor.packets_sent
+                totals['readings'] += max(0, sensor.seq_num - 1)  # Minus the INIT
+                totals['readings_acked'] += sensor.readings_acked
+                totals['acked_packets'] += sensor.ack_received_count
+                totals['ack_datagrams'] += sensor.ack_datagrams_received
+                totals['retransmissions'] += sensor.retransmission_count
+                totals['recovered'] += sensor.retransmissions_recovered
+                totals['given_up'] += sensor.packets_given_up
+                totals['window_drops'] += sensor.window_drops
+                totals['pending'] += len(sensor.pending_packets)
+                totals['backlog'] += len(sensor.window_backlog)
+                if sensor.total_rtt_samples:
+                    totals['rtt_sum'] += sensor.estimated_rtt
+                    totals['rtt_devices'] += 1
+        return totals
+
+    def summary_event(self, when, previous, end_time):
+        """Periodic [LOADGEN] rate line"""
+        if time.time() >= end_time:
+            return
+        totals = self.totals()
+        elapsed = self.summary_interval
+        log.info(f"[LOADGEN] {len(self.devices)} devices | "
+                 f"{(totals['packets_sent'] - previous['packets_sent']) / elapsed:.0f} packets/s, "
+                 f"{(totals['readings'] - previous['readings']) / elapsed:.0f} readings/s, "
+                 f"{(totals['readings_acked'] - previous['readings_acked']) / elapsed:.0f} acked/s | "
+                 f"{totals['retransmissions'] - previous['retransmissions']} retransmissions, "
+                 f"{totals['pending']} awaiting ACK, {totals['backlog']} queued | "
+                 f"scheduler lag max {self.max_lag * 1000:.1f} ms")
+        self.max_lag = 0.0
+        self.scheduler.call_at(when + self.summary_interval, self.summary_event,
+                               when + self.summary_interval, totals, end_time)
+
+    def run(self, duration=60, ramp=1.0, final_wait=2.0):
+        """
+        Start every device within the first ramp seconds, generate load for
+        duration seconds, then wait final_wait seconds for outstanding ACKs.
+        Returns the final totals() with elapsed_s and devices added.
+        """
+        self.running = True
+        start_time = time.time()
+        stats = None
+        try:
+            self.open_sockets()
+            end_time = start_time + duration
+            log.info(f"[LOADGEN] {len(self.devices)} devices -> {self.server_host}:{self.server_port} "
+                     f"over {self.num_sockets} sockets, duration {duration}s, ramp {ramp}s")
+            log.info("[LOADGEN] Profiles: " + ", ".join(f"{name} x{count}" for name, count in self.profile_counts.items()))
+            log.info("-" * 80)
+
+            # Random start offsets keep devices from reporting in lockstep
+            for sensor in self.devices.values():
+                self.scheduler.call_at(start_time + random.uniform(0, ramp), self.start_device, sensor, end_time)
+            self.scheduler.call_at(start_time, self.lag_probe, start_time)
+            self.scheduler.call_at(start_time + self.summary_interval, self.summary_event,
+                                   start_time + self.summary_interval, self.totals(), end_time)
+            self.scheduler.run(until=end_time)
+
+            # Flush readings still in batch buffers, then let retransmissions finish
+            for sensor in self.devices.values():
+                if sensor.batch_buffer:
+                    sensor.send_batch()
+            log.info("[LOADGEN] Waiting for final ACKs...")
+            self.scheduler.run(until=time.time() + final_wait)
+            stats = self.print_report(time.time() - start_time)
+
+        except KeyboardInterrupt:
+            log.info("[LOADGEN] Interrupted by user")
+            stats = self.print_report(time.time() - start_time)
+        finally:
+            self.running = False
+            for sock in self.sockets:
+                sock.close()
+        return stats
+
+    def print_report(self, elapsed):
+        """Aggregate RDT statistics over all devices"""
+        totals = self.totals()
+        flush_logging()  # Queued log lines first, so the report comes last
+        print("\n" + "=" * 80)
+        print("[LOAD GENERATOR STATISTICS]")
+        print("=" * 80)
+        print(f"  Devices:                  {len(self.devices)} over {self.num_sockets} sockets")
+        print(f"  Elapsed:                  {elapsed:.1f} s")
+        print(f"  Readings generated:       {totals['readings']}")
+        print(f"  Packets sent:             {totals['packets_sent']} "
+              f"({totals['packets_sent'] / elapsed:.0f} packets/s, first transmissions)")
+        print(f"  Retransmissions:          {totals['retransmissions']} "
+              f"({totals['recovered']} recovered, {totals['given_up']} given up)")
+        print(f"  ACKs received:            {totals['acked_packets']} packets in {totals['ack_datagrams']} ACK datagrams")
+        print(f"  Goodput:                  {totals['readings_acked'] / elapsed:.0f} readings/s acknowledged")
+        if totals['readings'] > 0:
+            print(f"  Readings acknowledged:    {totals['readings_acked'] / totals['readings'] * 100:.2f}%")
+        print(f"  Window-full drops:        {totals['window_drops']} readings, {totals['backlog']} packets still queued")
+        print(f"  Unacknowledged packets:   {totals['pending']}")
+        if totals['rtt_devices']:
+            print(f"  Mean estimated RTT:       {totals['rtt_sum'] / totals['rtt_devices'] * 1000:.2f} ms")
+        if self.lag_samples:
+            print(f"  Scheduler lag:            avg {self.lag_sum / self.lag_samples * 1000:.2f} ms")
+        print(f"  Scheduler events run:     {self.scheduler.events_run}")
+        if self.unroutable_datagrams:
+            print(f"  Unroutable datagrams:     {self.unroutable_datagrams}")
+        print("=" * 80)
+        totals.update(elapsed_s=elapsed, devices=len(self.devices))
+        return totals
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description='TinyTelemetry multi-device load generator')
+    parser.add_argument('devices', nargs='?', type=int, default=1000, help='Number of simulated devices')
+    parser.add_argument('duration', nargs='?', type=float, default=60, help='Seconds of load')
+    parser.add_argument('--host', default=socket.gethostbyname(socket.gethostname()), help='Collector address')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--first-device-id', type=int, default=10000)
+    parser.add_argument('--profile', default='steady',
+                        help=f"Profile or weighted mix, e.g. 'steady=70,lossy=30' (profiles: {', '.join(PROFILES)})")
+    parser.add_argument('--interval', type=float, default=None, help='Override every profile\'s reporting interval (s)')
+    parser.add_argument('--batch-size', type=int, default=None, help='Override every profile\'s readings per packet')
+    parser.add_argument('--loss', type=float, default=None, help='Override every profile\'s client-side loss rate')
+    parser.add_argument('--jitter', type=float, default=None, help='Override every profile\'s max jitter (s)')
+    parser.add_argument('--window', type=int, default=32, help='Per-device send window (0 = unbounded)')
+    parser.add_argument('--window-policy', choices=['block', 'drop'], default='block',
+                        help='When the window is full: block queues the packet (at most 4 windows per device, '
+                             'then the oldest is dropped), drop discards it')
+    parser.add_argument('--payload-format', choices=['binary', 'json'], default='binary')
+    parser.add_argument('--sockets', type=int, default=4, help='Shared UDP sockets (devices are spread over them)')
+    parser.add_argument('--ramp', type=float, default=1.0, help='Seconds over which devices start')
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'debug', 'info', 'warning', 'error'])
+    parser.add_argument('--log-file', default=LOG_FILE, help='Write log lines to this file instead of stdout')
+    parser.add_argument('--device-log-sample', type=int, default=0,
+                        help='Log 1 in N device packets (0 = only [LOADGEN] summaries and device warnings)')
+    parser.add_argument('--summary-interval', type=float, default=5.0, help='Seconds between [LOADGEN] lines')
+    parser.add_argument('--stats-json', default=None, help='Also write the final totals to this JSON file')
+    args = parser.parse_args()
+    setup_logging(args.log_level, args.log_file)
+
+    overrides = {key: value for key, value in (('interval', args.interval), ('batch_size', args.batch_size),
+                                               ('loss', args.loss), ('jitter', args.jitter))
+                 if value is not None}
+    try:
+        profile_mix = parse_profile_mix(args.profile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.device_log_sample <= 0:
+        get_logger('client').setLevel(logging.WARNING)  # INIT/DATA lines of thousands of devices
+
+    generator = LoadGenerator(args.host, args.port, args.sockets)
+    generator.device_log = PacketLogSampler(get_logger('client'), max(0, args.device_log_sample))
+    generator.summary_interval = args.summary_interval
+    try:
+        generator.add_devices(args.first_device_id, args.devices, profile_mix, overrides, args.window,
+                              args.window_policy,
+                              PROTOCOL_VERSION_JSON if args.payload_format == 'json' else PROTOCOL_VERSION_BINARY)
+    except ValueError as e:
+        parser.error(str(e))
+    stats = generator.run(args.duration, args.ramp)
+    if stats and args.stats_json:
+        with open(args.stats_json, 'w') as f:
+            json.dump(stats, f, indent=2)
+    shutdown_logging()
+
+if __name__ == '__main__':
+    main()
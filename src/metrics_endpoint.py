@@ -0,0 +1,162 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from histogram import LatencyHistogram
+from server import phase2_metrics
+from telemetry_log import get_logger
+
+log = get_logger('metrics')
+
+PREFIX = 'tinytelemetry'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus text exposition format
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# (metric, get_counters() key, help) exported as Prometheus counters
+COUNTERS = [
+    ('readings_received_total', 'total_received', 'Readings received (a BATCH counts each reading; INIT and HEARTBEAT count 1)'),
+    ('datagrams_total', 'total_datagrams', 'Datagrams processed (every message type)'),
+    ('bytes_received_total', 'total_bytes_received', 'Bytes received (header + payload)'),
+    ('duplicates_total', 'total_duplicates', 'Duplicate messages detected'),
+    ('retransmits_total', 'total_retransmits', 'Retransmissions detected (duplicates due to RDT)'),
+    ('sequence_gaps_total', 'sequence_gap_count', 'Sequence gap events'),
+    ('lost_total', 'total_lost', 'Readings missing from sequence gaps'),
+    ('ack_requests_total', 'total_ack_requests', 'DATA/BATCH packets that asked for an ACK'),
+    ('acks_sent_total', 'total_acks_sent', 'ACK datagrams sent'),
+    ('sink_rows_written_total', 'sink_rows_written', 'Rows written by the telemetry sink'),
+    ('sink_write_errors_total', 'sink_write_errors', 'Failed telemetry sink writes (the rows are retried)'),
+    ('device_offline_events_total', 'device_offline_events', 'Devices marked offline after the liveness timeout'),
+    ('device_online_events_total', 'device_online_events', 'Devices that came back after being marked offline'),
+]
+
+# (metric, phase2_metrics() key, help) exported as gauges
+PHASE2_GAUGES = [
+    ('bytes_per_report', 'bytes_per_report', 'Average bytes (header + payload) per reading'),
+    ('duplicate_rate', 'duplicate_rate', 'Fraction of messages that were duplicates'),
+    ('retransmit_rate', 'retransmit_rate', 'Fraction of messages that were retransmissions'),
+    ('cpu_ms_per_report', 'cpu_ms_per_report', 'process_packet time per reading (ms)'),
+    ('packet_loss_rate_percent', 'packet_loss_rate', 'Readings lost as a percentage of received + lost'),
+]
+
+# (metric, rolling window key, help) exported per window for the fleet and each device
+ROLLING_GAUGES = [
+    ('loss_rate_percent', 'loss_rate', 'Readings lost as a percentage of received + lost over the window'),
+    ('duplicate_rate', 'duplicate_rate', 'Fraction of messages that were duplicates over the window'),
+]
+
+# (metric, DeviceTable column, type, help) exported per device
+DEVICE_METRICS = [
+    ('device_packets_total', 'packet_count', 'counter', 'Packets received from the device (duplicates excluded)'),
+    ('device_heartbeats_total', 'heartbeat_count', 'counter', 'Heartbeats received from the device'),
+    ('device_last_seq', 'last_seq', 'gauge', 'Newest sequence number received (-1 before the first DATA)'),
+    ('device_last_seen_timestamp_seconds', 'last_seen', 'gauge', 'Unix time of the last packet from the device'),
+]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def render_metrics(collector):
+    """
+    The collector's counters, Phase 2 metrics, latency percentiles,
+    per-device state and rolling-window rates in Prometheus text format.
+
+    Runs on the endpoint thread without taking any lock of its own, so a
+    scrape never makes ingestion wait. This relies on the GIL: each counter
+    read and each index into the device table's arrays (DeviceTable.rows())
+    is atomic while packets keep arriving, so every value is consistent on
+    its own, though values may be a packet apart from each other.
+    """
+    base = collector.metrics_labels
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}_{name}{format_labels({**base, **labels})} {value}")
+
+    counters = collector.get_counters()
+    for name, key, help_text in COUNTERS:
+        family(name, 'counter', help_text, [({}, counters[key])])
+    if counters['kernel_drops'] is not None:
+        family('kernel_drops_total', 'counter', 'Datagrams dropped by the kernel (socket receive buffer full)',
+               [({}, counters['kernel_drops'])])
+
+    metrics = phase2_metrics(counters)
+    for name, key, help_text in PHASE2_GAUGES:
+        family(name, 'gauge', help_text, [({}, metrics[key])])
+
+    devices = collector.devices.rows([key for _, key, _, _ in DEVICE_METRICS])
+    family('devices', 'gauge', 'Devices currently tracked', [({}, len(devices))])
+    family('devices_online', 'gauge', 'Devices heard from within the liveness timeout',
+           [({}, counters['devices_online'])])
+    family('reorder_buffer_packets', 'gauge', 'Packets held in the reorder buffer', [({}, len(collector.packet_buffer))])
+    family('sink_queue_depth', 'gauge', 'Rows queued for the sink writer', [({}, counters['sink_queue_depth'])])
+
+    # Latency histograms as summaries: quantiles plus _sum and _count (seconds)
+    lines.append(f"# HELP {PREFIX}_latency_seconds Latency per processing stage (see histogram.py)")
+    lines.append(f"# TYPE {PREFIX}_latency_seconds summary")
+    for stage, data in sorted(collector.latency_histograms().items()):
+        histogram = LatencyHistogram.from_dict(data)
+        labels = {**base, 'stage': stage}
+        for quantile, value in zip(QUANTILES, histogram.percentiles([q * 100 for q in QUANTILES])):
+            lines.append(f"{PREFIX}_latency_seconds{format_labels({**labels, 'quantile': quantile})} {value / 1e9}")
+        lines.append(f"{PREFIX}_latency_seconds_sum{format_labels(labels)} {histogram.total / 1e9}")
+        lines.append(f"{PREFIX}_latency_seconds_count{format_labels(labels)} {histogram.count}")
+
+    for name, key, kind, help_text in DEVICE_METRICS:
+        family(name, kind, help_text, [({'device_id': device_id}, row[key]) for device_id, row in devices.items()])
+
+    rolling = collector.rolling.snapshot(time.time())
+    for name, key, help_text in ROLLING_GAUGES:
+        family(f'recent_{name}', 'gauge', help_text,
+               [({'window': label}, window[key]) for label, window in rolling['fleet'].items()])
+        family(f'device_recent_{name}', 'gauge', help_text,
+               [({'device_id': device_id, 'window': label}, window[key])
+                for device_id, windows in rolling['devices'].items() for label, window in windows.items()])
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics (or /) returns render_metrics() of the server's collector"""
+
+    def do_GET(self):
+        if self.path not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_metrics(self.server.collector).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f"[METRICS] {self.address_string()} {format % args}")
+
+
+class MetricsServer:
+    """Serves a collector's metrics over HTTP from a daemon thread"""
+
+    def __init__(self, collector, host='127.0.0.1', port=9100):
+        self.httpd = HTTPServer((host, port), MetricsHandler)
+        self.httpd.collector = collector
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-endpoint', daemon=True)
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def start(self):
+        self.thread.start()
+        host, port = self.address
+        log.info(f"[METRICS] Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,340 @@
+import argparse
+import os
+import socket
+import struct
+import time
+from protocol import TinyTelemetryProtocol, MSG_DATA, MSG_HEARTBEAT, MSG_BATCH, SEQ_MASK, seq_diff
+from seq_window import SequenceWindow, DEFAULT_WINDOW_SIZE
+from sinks import create_sink
+from telemetry_log import get_logger, setup_logging, shutdown_logging, LOG_LEVEL, LOG_FILE
+
+log = get_logger('replay')
+
+# Classic libpcap file format (pcapng files must be converted: editcap -F pcap in.pcapng out.pcap)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),  # Little-endian, microsecond timestamps
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),  # Nanosecond timestamps
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+
+# Link-layer types handled (LINKTYPE_* numbers from the pcap file header)
+LINKTYPE_NULL = 0        # BSD loopback: 4-byte address family in host byte order
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101       # Bare IPv4/IPv6 packets
+LINKTYPE_LINUX_SLL = 113  # tcpdump -i any (cooked capture)
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_UDP = 17
+UDP_HEADER_SIZE = 8
+
+
+def read_pcap(path):
+    """
+    Stream the records of a pcap file: yields (linktype, capture time, frame bytes).
+    The file is read one record at a time, so captures of any size work.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if header[:4] == PCAPNG_MAGIC:
+            raise ValueError(f"{path} is pcapng; convert it first: editcap -F pcap {path} out.pcap")
+        if len(header) < 24 or header[:4] not in PCAP_MAGIC:
+            raise ValueError(f"{path} is not a pcap file")
+        endian, resolution = PCAP_MAGIC[header[:4]]
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF  # Upper bits: FCS info
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            record_header = f.read(record.size)
+            if len(record_header) < record.size:
+                return  # End of file (or a record cut short by a killed tcpdump)
+            seconds, fraction, captured_length, _ = record.unpack(record_header)
+            frame = f.read(captured_length)
+            if len(frame) < captured_length:
+                return
+            yield linktype, seconds + fraction * resolution, frame
+
+
+def network_layer(linktype, frame):
+    """(ethertype, offset of the IP header) of a frame, or None for frames that are not IP"""
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype, offset = struct.unpack_from('!H', frame, 12)[0], 14
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype, offset = struct.unpack_from('!H', frame, offset + 2)[0], offset + 4
+        return ethertype, offset
+    if linktype == LINKTYPE_LINUX_SLL:
+        return struct.unpack_from('!H', frame, 14)[0], 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return struct.unpack_from('!H', frame, 0)[0], 20
+    if linktype == LINKTYPE_NULL:
+        family = struct.unpack_from('<I', frame, 0)[0]
+        if family > 0xFFFF:
+            family = struct.unpack_from('>I', frame, 0)[0]  # Written on a big-endian host
+        if family == socket.AF_INET:
+            return ETHERTYPE_IPV4, 4
+        return ETHERTYPE_IPV6, 4  # AF_INET6 differs between BSDs (24, 28, 30); the IP version check decides
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        return (ETHERTYPE_IPV4 if frame[0] >> 4 == 4 else ETHERTYPE_IPV6), 0
+    return None
+
+
+def udp_datagram(linktype, frame):
+    """
+    ((src ip, src port), (dst ip, dst port), payload) of a UDP frame, or None
+    for anything else (other protocols, IP fragments, truncated frames).
+    """
+    try:
+        layer = network_layer(linktype, frame)
+        if layer is None:
+            return None
+        ethertype, offset = layer
+        if ethertype == ETHERTYPE_IPV4 and frame[offset] >> 4 == 4:
+            header_length = (frame[offset] & 0x0F) * 4
+            fragment, protocol = struct.unpack_from('!HxB', frame, offset + 6)
+            if protocol != IPPROTO_UDP or fragment & 0x3FFF:
+                return None  # Not UDP, or a fragment (more-fragments flag or non-zero offset)
+            src = socket.inet_ntop(socket.AF_INET, frame[offset + 12:offset + 16])
+            dst = socket.inet_ntop(socket.AF_INET, frame[offset + 16:offset + 20])
+            udp = offset + header_length
+        elif ethertype == ETHERTYPE_IPV6 and frame[offset] >> 4 == 6:
+            if frame[offset + 6] != IPPROTO_UDP:
+                return None  # Extension headers are not followed
+            src = socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24])
+            dst = socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40])
+            udp = offset + 40
+        else:
+            return None
+        src_port, dst_port, udp_length = struct.unpack_from('!HHH', frame, udp)
+        payload = frame[udp + UDP_HEADER_SIZE:udp + udp_length]
+        if len(payload) != udp_length - UDP_HEADER_SIZE:
+            return None  # Frame cut short by the capture's snap length
+        return (src, src_port), (dst, dst_port), payload
+    except (IndexError, struct.error, ValueError):
+        return None
+
+
+def telemetry_datagrams(path, port=5000):
+    """
+    Stream the UDP payloads sent to the collector's port in a pcap file:
+    yields (capture time, source address, payload). ACKs from the collector
+    (sent from that port) are left out.
+    """
+    for linktype, timestamp, frame in read_pcap(path):
+        datagram = udp_datagram(linktype, frame)
+        if datagram is not None and datagram[1][1] == port:
+            yield timestamp, datagram[0], datagram[2]
+
+
+class CaptureDecoder:
+    """
+    Turns captured datagrams into telemetry rows (sinks.CSV_COLUMNS), as the
+    collector would write them: one row per DATA packet and per BATCH
+    reading, timestamped with the capture time. Duplicate and gap flags come
+    from the same per-device SequenceWindow and seq_diff checks as the
+    collector's, applied in capture order (there is no reorder buffer).
+    """
+
+    def __init__(self, sink, window_size=DEFAULT_WINDOW_SIZE):
+        self.sink = sink
+        self.window_size = window_size
+        self.windows = {}  # device_id -> SequenceWindow
+        self.last_seq = {}  # device_id -> newest DATA seq
+        self.last_reading_seq = {}  # device_id -> seq of the last BATCH reading
+        self.datagrams = 0
+        self.malformed = 0
+        self.rows = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.message_types = {}
+
+    def decode(self, timestamp, data):
+        self.datagrams += 1
+        try:
+            header, payload = TinyTelemetryProtocol.parse_message(data)
+        except ValueError:
+            self.malformed += 1
+            return
+        msg_type_str = TinyTelemetryProtocol.msg_type_to_string(header.msg_type)
+        self.message_types[msg_type_str] = self.message_types.get(msg_type_str, 0) + 1
+        device_id = header.device_id
+        seq_num = header.seq_num
+        window = self.windows.get(device_id)
+        if window is None:
+            window = self.windows[device_id] = SequenceWindow(self.window_size)
+        if header.msg_type == MSG_HEARTBEAT:
+            return  # Heartbeats all use seq 0 and write no row
+
+        duplicate = window.seen(seq_num)
+        if duplicate:
+            self.duplicates += 1
+        gap = False
+        last_seq = self.last_seq.get(device_id)
+        if header.msg_type != MSG_BATCH and last_seq is not None and seq_diff(seq_num, last_seq) > 1:
+            gap = True
+            self.gaps += 1
+
+        try:
+            if header.msg_type == MSG_DATA and payload:
+                # Duplicates get a row too (flagged, and counted as retransmissions like the collector does)
+                reading = TinyTelemetryProtocol.decode_data_payload(header.version, payload)
+                if not isinstance(reading, dict):
+                    reading = {}
+                self.write(timestamp, device_id, seq_num, 'DATA', reading, duplicate, gap, duplicate, len(data))
+            elif header.msg_type == MSG_BATCH and not duplicate:
+                last_reading_seq = self.last_reading_seq.get(device_id, 0)
+                for reading in TinyTelemetryProtocol.decode_batch_payload(header.version, payload):
+                    reading_seq = reading.get('seq_num', 0)
+                    reading_duplicate = window.seen(reading_seq)
+                    reading_gap = seq_diff(reading_seq, last_reading_seq) > 1
+                    if reading_gap:
+                        self.gaps += 1
+                    self.write(header.timestamp, device_id, reading_seq, 'BATCH_DATA', reading,
+                               reading_duplicate, reading_gap, False, len(data))
+                    if not reading_duplicate:
+                        window.mark(reading_seq)
+                    last_reading_seq = reading_seq
+                self.last_reading_seq[device_id] = last_reading_seq
+        except ValueError:
+            self.malformed += 1
+            return
+
+        if not duplicate:
+            if header.msg_type != MSG_BATCH:
+                self.last_seq[device_id] = seq_num & SEQ_MASK
+            window.mark(seq_num)
+
+    def write(self, timestamp, device_id, seq_num, msg_type_str, reading, duplicate, gap, retransmit, packet_bytes):
+        self.sink.write([
+            timestamp,
+            device_id,
+            seq_num,
+            msg_type_str,
+            reading.get('temperature', ''),
+            reading.get('humidity', ''),
+            1 if duplicate else 0,
+            1 if gap else 0,
+            1 if retransmit else 0,
+            packet_bytes
+        ])
+        self.rows += 1
+
+
+def decode_capture(path, output, sink_kind='csv', port=5000):
+    """Decode the telemetry in a pcap file into a telemetry CSV (or columnar directory); returns the decoder"""
+    sink = create_sink(sink_kind, output)
+    decoder = CaptureDecoder(sink)
+    try:
+        for timestamp, _, data in telemetry_datagrams(path, port):
+            decoder.decode(timestamp, data)
+    finally:
+        sink.close()
+    return decoder
+
+
+def replay_capture(path, host, port=5000, capture_port=5000, speed=1.0):
+    """
+    Send the telemetry datagrams of a pcap file to a collector.
+
+    speed 1 keeps the original timing, 2 replays twice as fast, 0 sends as
+    fast as possible. Each source address of the capture gets a socket of
+    its own, so ACKs and per-source sharding behave as for the real devices.
+    Returns {'datagrams', 'bytes', 'elapsed_s', 'sources', 'max_lag_ms'}.
+    """
+    sockets = {}
+    target = (host, port)
+    family = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0][0]
+    sent = sent_bytes = 0
+    max_lag = 0.0
+    first_timestamp = None
+    start = time.perf_counter()
+    try:
+        for timestamp, source, data in telemetry_datagrams(path, capture_port):
+            if speed > 0:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                due = start + (timestamp - first_timestamp) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)  # Behind schedule (sender too slow for this speed)
+            sock = sockets.get(source)
+            if sock is None:
+                sock = sockets[source] = socket.socket(family, socket.SOCK_DGRAM)
+            try:
+                sock.sendto(data, target)
+            except OSError as e:
+                log.warning(f"[REPLAY] Send failed: {e}")
+                continue
+            sent += 1
+            sent_bytes += len(data)
+    finally:
+        for sock in sockets.values():
+            sock.close()
+    return {
+        'datagrams': sent,
+        'bytes': sent_bytes,
+        'elapsed_s': time.perf_counter() - start,
+        'sources': len(sockets),
+        'max_lag_ms': max_lag * 1000,
+    }
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description='Decode or replay TinyTelemetry traffic from a pcap capture')
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'debug', 'info', 'warning', 'error'])
+    parser.add_argument('--log-file', default=LOG_FILE, help='Write log lines to this file instead of stdout')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    decode = commands.add_parser('decode', help='Write the captured telemetry as collector output')
+    decode.add_argument('pcap', help='Capture file (classic pcap format)')
+    decode.add_argument('output', nargs='?', default=None,
+                        help='Output CSV (columnar: a directory of the same name without .csv); default <pcap>.csv')
+    decode.add_argument('--port', type=int, default=5000, help='Collector port in the capture')
+    decode.add_argument('--sink', choices=['csv', 'columnar'], default='csv')
+
+    replay = commands.add_parser('replay', help='Send the captured telemetry to a live collector')
+    replay.add_argument('pcap', help='Capture file (classic pcap format)')
+    replay.add_argument('--host', default=socket.gethostbyname(socket.gethostname()), help='Collector address')
+    replay.add_argument('--port', type=int, default=5000, help='Collector port to send to')
+    replay.add_argument('--capture-port', type=int, default=None,
+                        help='Collector port in the capture (default: same as --port)')
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help='Timing: 1 = original, 2 = twice as fast, 0 = as fast as possible')
+
+    args = parser.parse_args()
+    setup_logging(args.log_level, args.log_file)
+    try:
+        if args.command == 'decode':
+            output = args.output or os.path.splitext(args.pcap)[0] + '.csv'
+            decoder = decode_capture(args.pcap, output, args.sink, args.port)
+            types = ', '.join(f"{name} {count}" for name, count in sorted(decoder.message_types.items()))
+            log.info(f"[DECODE] {decoder.datagrams} datagrams ({types or 'none'}) from {len(decoder.windows)} devices")
+            log.info(f"[DECODE] {decoder.rows} rows written to {output}: {decoder.duplicates} duplicates, "
+                     f"{decoder.gaps} gaps, {decoder.malformed} malformed datagrams")
+        else:
+            if args.speed < 0:
+                parser.error('--speed must be >= 0')
+            capture_port = args.capture_port if args.capture_port is not None else args.port
+            timing = 'maximum speed' if args.speed == 0 else f"{args.speed:g}x original timing"
+            log.info(f"[REPLAY] {args.pcap} -> {args.host}:{args.port} at {timing}")
+            result = replay_capture(args.pcap, args.host, args.port, capture_port, args.speed)
+            elapsed = result['elapsed_s']
+            log.info(f"[REPLAY] Sent {result['datagrams']} datagrams ({result['bytes']} bytes) from "
+                     f"{result['sources']} sources in {elapsed:.2f}s "
+                     f"({result['datagrams'] / elapsed if elapsed > 0 else 0:.0f}/s, "
+                     f"max {result['max_lag_ms']:.1f} ms behind schedule)")
+    except (OSError, ValueError) as e:
+        log.error(f"[ERROR] {e}")
+    finally:
+        shutdown_logging()
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,204 @@
-import psutil
+import csv
+import os
+import threading
 import time
+from collections import deque
+
+SAMPLE_HISTORY = 3600  # Samples kept by the background sampler (1 hour at 1 s)
+
+# Columns of a sampler time series (one tuple per sample, in this order)
+SERIES_COLUMNS = ['time', 'cpu_percent', 'rss_mb', 'ctx_switches_per_s', 'open_fds', 'rx_queue_bytes']
+SUMMARY_PERCENTILES = (50, 95, 99)
+
+
+def udp_socket_stats(sock):
+    """
+    Kernel counters for a bound UDP socket, read from /proc/net/udp(6).
+    Returns {'rx_queue': bytes queued, 'drops': datagrams dropped}, or None
+    when the platform does not expose them (non-Linux).
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except (OSError, ValueError):
+        return None
+    for table in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(table) as f:
+                next(f)  # Skip column header line
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return {
+                            'rx_queue': int(fields[4].split(':')[1], 16),
+                            'drops': int(fields[12])
+                        }
+        except OSError:
+            continue
+    return None
+
+
+def _psutil():
+    """The psutil module, or None if it is not installed"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil
+
+
+class ProcessProbe:
+    """
+    Point-in-time readings of this process: CPU time, RSS, context switches
+    and open file descriptors. Uses psutil when it is installed, otherwise
+    the standard library (/proc on Linux, getrusage elsewhere on Unix).
+    Readings a platform cannot provide are None.
+    """
 
-class PerformanceMonitor:
     def __init__(self):
-        self.process = psutil.Process()
-        self.start_cpu_time = self.process.cpu_times()
-        self.start_memory = self.process.memory_info()
+        psutil = _psutil()
+        self.process = psutil.Process() if psutil else None
+
+    def cpu_time(self):
+        """User + system CPU seconds used so far"""
+        if self.process:
+            times = self.process.cpu_times()
+            return times.user + times.system
+        times = os.times()
+        return times.user + times.system
+
+    def rss_bytes(self):
+        if self.process:
+            return self.process.memory_info().rss
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            pass
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Peak, not current: best available
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+    def ctx_switches(self):
+        """Voluntary + involuntary context switches so far"""
+        if self.process:
+            switches = self.process.num_ctx_switches()
+            return switches.voluntary + switches.involuntary
+        try:
+            import resource
+        except ImportError:
+            return None
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_nvcsw + usage.ru_nivcsw
+
+    def open_fds(self):
+        if self.process:
+            if hasattr(self.process, 'num_fds'):
+                return self.process.num_fds()
+            return self.process.num_handles()  # Windows
+        try:
+            return len(os.listdir('/proc/self/fd'))
+        except OSError:
+            return None
+
+
+class PerformanceMonitor:
+    """
+    CPU and memory of the collector process.
+
+    get_stats() never blocks: CPU% is the average since the monitor was
+    created (or over the sampled series). start_sampler() adds a daemon
+    thread that records CPU%, RSS, context switches/s, open fds and the
+    socket's receive queue every `interval` seconds into a bounded ring
+    buffer, summarized at the end of the run and exportable as CSV.
+    """
+
+    def __init__(self, history=SAMPLE_HISTORY):
+        self.probe = ProcessProbe()
         self.start_time = time.time()
-    
+        self.start_cpu_time = self.probe.cpu_time()
+        self.samples = deque(maxlen=history)  # Tuples in SERIES_COLUMNS order, oldest dropped first
+        self.interval = None
+        self.socket = None  # Socket whose receive queue is sampled (optional)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start_sampler(self, interval=1.0, sock=None):
+        """Start sampling every interval seconds on a background thread"""
+        self.interval = interval
+        self.socket = sock
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.sampler_thread, name='performance-sampler', daemon=True)
+        self.thread.start()
+
+    def stop_sampler(self):
+        """Stop the sampler thread (the samples are kept)"""
+        if self.thread:
+            self.stopped.set()
+            self.thread.join(timeout=2 * self.interval + 1)
+            self.thread = None
+
+    def sampler_thread(self):
+        probe = self.probe
+        last_time = time.time()
+        last_cpu = probe.cpu_time()
+        last_switches = probe.ctx_switches()
+        while not self.stopped.wait(self.interval):
+            now = time.time()
+            cpu = probe.cpu_time()
+            switches = probe.ctx_switches()
+            rss = probe.rss_bytes()
+            socket_stats = udp_socket_stats(self.socket) if self.socket else None
+            elapsed = now - last_time
+            self.samples.append((
+                now,
+                (cpu - last_cpu) / elapsed * 100 if elapsed > 0 else 0.0,
+                rss / 1024 / 1024 if rss is not None else None,
+                (switches - last_switches) / elapsed if switches is not None and elapsed > 0 else None,
+                probe.open_fds(),
+                socket_stats['rx_queue'] if socket_stats else None,
+            ))
+            last_time, last_cpu, last_switches = now, cpu, switches
+
+    def series_summary(self):
+        """{column: {'min', 'max', 'avg', 'p50', 'p95', 'p99'}} over the samples kept (columns without data left out)"""
+        samples = list(self.samples)  # Copy: the sampler thread may append meanwhile
+        summary = {}
+        for index, column in enumerate(SERIES_COLUMNS[1:], start=1):
+            values = sorted(sample[index] for sample in samples if sample[index] is not None)
+            if not values:
+                continue
+            last = len(values) - 1
+            summary[column] = {'min': values[0], 'max': values[last], 'avg': sum(values) / len(values)}
+            for percent in SUMMARY_PERCENTILES:
+                summary[column][f'p{percent}'] = values[round(last * percent / 100)]
+        return summary
+
+    def export_csv(self, path):
+        """Write the sampled series to a CSV file; returns False if there is nothing to write"""
+        samples = list(self.samples)
+        if not samples:
+            return False
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(SERIES_COLUMNS)
+            writer.writerows(samples)
+        return True
+
     def get_stats(self):
-        cpu_times = self.process.cpu_times()
-        memory = self.process.memory_info()
+        cpu_time = self.probe.cpu_time()
+        rss = self.probe.rss_bytes()
         elapsed = time.time() - self.start_time
-        
-        return {
-            'cpu_percent': self.process.cpu_percent(interval=0.1),
-            'memory_mb': memory.rss / 1024 / 1024,
-            'cpu_time_ms': (cpu_times.user + cpu_times.system) * 1000,
+        stats = {
+            'cpu_percent': (cpu_time - self.start_cpu_time) / elapsed * 100 if elapsed > 0 else 0.0,
+            'memory_mb': rss / 1024 / 1024 if rss is not None else 0.0,
+            'cpu_time_ms': cpu_time * 1000,
             'elapsed_s': elapsed
-        }
\ No newline at end of file
+        }
+        if self.samples:
+            stats['samples'] = len(self.samples)
+            stats['sample_interval_s'] = self.interval
+            stats['series'] = self.series_summary()
+        return stats
@@ -1,10 +1,21 @@
+import json
 import struct
 import time
+from collections import namedtuple
 
 # Protocol constants
 PROTOCOL_VERSION = 1
 HEADER_SIZE = 10  # bytes
 
+# Payload formats, selected by the version nibble of the header
+PROTOCOL_VERSION_JSON = 1    # v1: JSON payloads (original sensors)
+PROTOCOL_VERSION_BINARY = 2  # v2: fixed-layout struct-packed payloads
+
+# Sequence numbers are 16-bit header fields and wrap around
+SEQ_MODULUS = 1 << 16
+SEQ_MASK = SEQ_MODULUS - 1
+SEQ_HALF = SEQ_MODULUS >> 1
+
 # Message types
 MSG_INIT = 0
 MSG_DATA = 1
@@ -12,63 +23,182 @@ MSG_HEARTBEAT = 2
 MSG_BATCH = 3
 MSG_ACK = 4
 
+# Binary payload layouts (network byte order)
+# DATA:  temperature (int16, centi-degrees C), humidity (uint16, centi-percent)
+# BATCH: base seq (uint16), reading count (uint8), then per reading:
+#        seq delta from previous reading (uint8), temperature (int16), humidity (uint16)
+DATA_PAYLOAD_FORMAT = '!hH'
+BATCH_PREFIX_FORMAT = '!HB'
+BATCH_READING_FORMAT = '!BhH'
+FIXED_POINT_SCALE = 100  # 2 decimal places, same precision as the JSON payloads
+
+# Header flags
+FLAG_SACK_OK = 0x01  # Set by sensors on DATA/BATCH: they understand cumulative/selective ACKs
+
+# Selective ACK payload (only sent to sensors that set FLAG_SACK_OK).
+# The ACK header's seq_num is the anchor: the newest seq being acknowledged.
+# Payload: cumulative seq (uint16, every seq up to and including it was received)
+#          bitmap (uint64, bit i set => seq anchor - 1 - i was received)
+# A legacy ACK has an empty payload and acknowledges only its header seq_num.
+SACK_PAYLOAD_FORMAT = '!HQ'
+SACK_BITMAP_BITS = 64
+# Longest a collector may hold a coalesced ACK (seconds). Sensors keep their RTO
+# well above it, or the hold alone would make them retransmit.
+MAX_ACK_DELAY = 0.05
+
+# Precompiled codecs (format strings are parsed once, at import time)
+HEADER_STRUCT = struct.Struct('!BHHIB')
+DATA_PAYLOAD_STRUCT = struct.Struct(DATA_PAYLOAD_FORMAT)
+BATCH_PREFIX_STRUCT = struct.Struct(BATCH_PREFIX_FORMAT)
+BATCH_READING_STRUCT = struct.Struct(BATCH_READING_FORMAT)
+DATA_PAYLOAD_SIZE = DATA_PAYLOAD_STRUCT.size        # 4 bytes
+BATCH_PREFIX_SIZE = BATCH_PREFIX_STRUCT.size        # 3 bytes
+BATCH_READING_SIZE = BATCH_READING_STRUCT.size      # 5 bytes
+SACK_PAYLOAD_STRUCT = struct.Struct(SACK_PAYLOAD_FORMAT)
+SACK_PAYLOAD_SIZE = SACK_PAYLOAD_STRUCT.size        # 10 bytes
+
+# Decoded header record (a tuple: cheap to build, fields read as header.device_id etc.)
+Header = namedtuple('Header', ['version', 'msg_type', 'device_id', 'seq_num', 'timestamp', 'flags'])
+_new_tuple = tuple.__new__  # Skips namedtuple's Python-level __new__ on the hot path
+
+MSG_TYPE_NAMES = {MSG_INIT: 'INIT', MSG_DATA: 'DATA', MSG_HEARTBEAT: 'HEARTBEAT', MSG_BATCH: 'BATCH', MSG_ACK: 'ACK'}
+
+def seq_diff(a, b):
+    """
+    Signed distance a - b between two 16-bit sequence numbers (RFC 1982 serial
+    arithmetic): positive when a is newer than b, even across wraparound.
+    """
+    return ((a - b + SEQ_HALF) & SEQ_MASK) - SEQ_HALF
+
+def sack_covers(seq, anchor, cumulative_seq, bitmap):
+    """True if a selective ACK (anchor, cumulative_seq, bitmap) acknowledges seq"""
+    behind = seq_diff(anchor, seq)
+    if behind == 0:
+        return True
+    if 0 < behind <= SACK_BITMAP_BITS and (bitmap >> (behind - 1)) & 1:
+        return True
+    return seq_diff(seq, cumulative_seq) <= 0
+
 class TinyTelemetryProtocol:
 
     @staticmethod
-    def pack_header(msg_type, device_id, seq_num, timestamp=None, flags=0):
+    def pack_header(msg_type, device_id, seq_num, timestamp=None, flags=0, version=PROTOCOL_VERSION):
         if timestamp is None:
             timestamp = int(time.time())
 
         # Combine version (4 bits) and msg_type (4 bits) into 1 byte
-        version_and_type = (PROTOCOL_VERSION << 4) | (msg_type & 0x0F)
+        version_and_type = ((version & 0x0F) << 4) | (msg_type & 0x0F)
 
-        # Pack: version+type, device_id, seq_num, timestamp, flags
-        header = struct.pack('!BHHIB',
-                           version_and_type,
-                           device_id,
-                           seq_num,
-                           timestamp,
-                           flags)
-        return header
+        # Pack: version+type, device_id, seq_num (wrapped to 16 bits), timestamp, flags
+        return HEADER_STRUCT.pack(version_and_type, device_id, seq_num & SEQ_MASK, timestamp, flags)
 
     @staticmethod
     def unpack_header(data):
+        """Decode the header of a datagram (bytes, bytearray or memoryview) without copying it"""
         if len(data) < HEADER_SIZE:
             raise ValueError(f"Data too short: {len(data)} bytes, need {HEADER_SIZE}")
 
-        # Unpack header
-        version_and_type, device_id, seq_num, timestamp, flags = struct.unpack(
-            '!BHHIB', data[:HEADER_SIZE]
-        )
+        # Unpack header in place
+        version_and_type, device_id, seq_num, timestamp, flags = HEADER_STRUCT.unpack_from(data)
 
         # Extract version and msg_type
-        version = (version_and_type >> 4) & 0x0F
-        msg_type = version_and_type & 0x0F
-
-        return {
-            'version': version,
-            'msg_type': msg_type,
-            'device_id': device_id,
-            'seq_num': seq_num,
-            'timestamp': timestamp,
-            'flags': flags
-        }
+        return _new_tuple(Header, (version_and_type >> 4, version_and_type & 0x0F,
+                                   device_id, seq_num, timestamp, flags))
 
     @staticmethod
-    def create_message(msg_type, device_id, seq_num, payload=b'', timestamp=None, flags=0):
+    def create_message(msg_type, device_id, seq_num, payload=b'', timestamp=None, flags=0, version=PROTOCOL_VERSION):
         header = TinyTelemetryProtocol.pack_header(
-            msg_type, device_id, seq_num, timestamp, flags
+            msg_type, device_id, seq_num, timestamp, flags, version
         )
         return header + payload
 
     @staticmethod
     def parse_message(data):
-        header = TinyTelemetryProtocol.unpack_header(data)
-        payload = data[HEADER_SIZE:]
-        return header, payload
+        """
+        Split a datagram into (Header, payload). The payload is a memoryview
+        over the original buffer, so it is only valid while that buffer is.
+        """
+        return TinyTelemetryProtocol.unpack_header(data), memoryview(data)[HEADER_SIZE:]
+
+    @staticmethod
+    def encode_data_payload(temperature, humidity):
+        """Encode a single reading as a binary DATA payload (4 bytes)"""
+        try:
+            return DATA_PAYLOAD_STRUCT.pack(round(temperature * FIXED_POINT_SCALE),
+                                            round(humidity * FIXED_POINT_SCALE))
+        except struct.error as e:
+            raise ValueError(f"Reading out of range for binary payload: {e}")
+
+    @staticmethod
+    def encode_batch_payload(readings):
+        """
+        Encode a list of {'seq_num', 'temperature', 'humidity'} readings as a
+        binary BATCH payload. Sequence numbers are stored as deltas from the
+        previous reading, so gaps larger than 255 cannot be encoded.
+        """
+        if not readings or len(readings) > 255:
+            raise ValueError(f"Batch of {len(readings)} readings cannot be binary encoded")
+
+        base_seq = readings[0]['seq_num'] & SEQ_MASK
+        parts = [BATCH_PREFIX_STRUCT.pack(base_seq, len(readings))]
+        prev_seq = base_seq
+        try:
+            for reading in readings:
+                seq = reading['seq_num'] & SEQ_MASK
+                parts.append(BATCH_READING_STRUCT.pack((seq - prev_seq) & SEQ_MASK,
+                                                       round(reading['temperature'] * FIXED_POINT_SCALE),
+                                                       round(reading['humidity'] * FIXED_POINT_SCALE)))
+                prev_seq = seq
+        except struct.error as e:
+            raise ValueError(f"Batch cannot be binary encoded: {e}")
+        return b''.join(parts)
+
+    @staticmethod
+    def decode_data_payload(version, payload):
+        """Decode a DATA payload into a {'temperature', 'humidity'} dict"""
+        if version == PROTOCOL_VERSION_BINARY:
+            if len(payload) != DATA_PAYLOAD_SIZE:
+                raise ValueError(f"Binary DATA payload must be {DATA_PAYLOAD_SIZE} bytes, got {len(payload)}")
+            temperature, humidity = DATA_PAYLOAD_STRUCT.unpack_from(payload)
+            return {
+                'temperature': temperature / FIXED_POINT_SCALE,
+                'humidity': humidity / FIXED_POINT_SCALE
+            }
+        return json.loads(str(payload, 'utf-8'))
+
+    @staticmethod
+    def decode_batch_payload(version, payload):
+        """Decode a BATCH payload into a list of {'seq_num', 'temperature', 'humidity'} dicts"""
+        if version == PROTOCOL_VERSION_BINARY:
+            if len(payload) < BATCH_PREFIX_SIZE:
+                raise ValueError(f"Binary BATCH payload too short: {len(payload)} bytes")
+            seq, count = BATCH_PREFIX_STRUCT.unpack_from(payload)
+            if len(payload) != BATCH_PREFIX_SIZE + count * BATCH_READING_SIZE:
+                raise ValueError(f"Binary BATCH payload length {len(payload)} does not match {count} readings")
+            readings = []
+            for delta, temperature, humidity in BATCH_READING_STRUCT.iter_unpack(payload[BATCH_PREFIX_SIZE:]):
+                seq = (seq + delta) & SEQ_MASK
+                readings.append({
+                    'seq_num': seq,
+                    'temperature': temperature / FIXED_POINT_SCALE,
+                    'humidity': humidity / FIXED_POINT_SCALE
+                })
+            return readings
+        return json.loads(str(payload, 'utf-8'))
+
+    @staticmethod
+    def encode_sack_payload(cumulative_seq, bitmap):
+        """Encode the payload of a selective ACK (see SACK_PAYLOAD_FORMAT)"""
+        return SACK_PAYLOAD_STRUCT.pack(cumulative_seq & SEQ_MASK, bitmap & ((1 << SACK_BITMAP_BITS) - 1))
+
+    @staticmethod
+    def decode_sack_payload(payload):
+        """Decode a selective ACK payload into (cumulative_seq, bitmap), or None for a legacy ACK"""
+        if len(payload) != SACK_PAYLOAD_SIZE:
+            return None
+        return SACK_PAYLOAD_STRUCT.unpack_from(payload)
 
     @staticmethod
     def msg_type_to_string(msg_type):
         """Convert message type code to string"""
-        types = {MSG_INIT: 'INIT', MSG_DATA: 'DATA', MSG_HEARTBEAT: 'HEARTBEAT', MSG_BATCH: 'BATCH', MSG_ACK: 'ACK'}
-        return types.get(msg_type, f'UNKNOWN({msg_type})')
+        return MSG_TYPE_NAMES.get(msg_type, f'UNKNOWN({msg_type})')
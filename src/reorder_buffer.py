@@ -0,0 +1,52 @@
+import heapq
+import itertools
+from protocol import seq_diff
+
+
+class ReorderBuffer:
+    """
+    Packets held back for reordering, kept in a heap keyed by release deadline.
+
+    Adding a packet and releasing one cost O(log n); a flush only touches the
+    packets whose deadline has passed. Released packets are ordered by
+    (device_id, seq), with seq compared in 16-bit serial arithmetic.
+    """
+
+    def __init__(self):
+        self.heap = []                    # (deadline, insertion order, packet_info)
+        self.counter = itertools.count()  # Tie-breaker so packet dicts are never compared
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, packet_info, deadline):
+        """Hold a packet until deadline (time.time() based)"""
+        heapq.heappush(self.heap, (deadline, next(self.counter), packet_info))
+
+    def next_deadline(self):
+        """Deadline of the next packet to release, or None if empty"""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_ready(self, now):
+        """Remove and return every packet whose deadline has passed, in (device_id, seq) order"""
+        heap = self.heap
+        ready = []
+        while heap and heap[0][0] <= now:
+            ready.append(heapq.heappop(heap)[2])
+        return self.order(ready)
+
+    def pop_all(self):
+        """Remove and return every buffered packet, in (device_id, seq) order"""
+        ready = [entry[2] for entry in self.heap]
+        self.heap = []
+        return self.order(ready)
+
+    @staticmethod
+    def order(packets):
+        """Sort packets by device, then by seq relative to the device's oldest-deadline packet"""
+        if len(packets) > 1:
+            anchors = {}
+            for packet in packets:
+                anchors.setdefault(packet['device_id'], packet['seq'])
+            packets.sort(key=lambda p: (p['device_id'], seq_diff(p['seq'], anchors[p['device_id']])))
+        return packets
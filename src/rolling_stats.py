@@ -0,0 +1,156 @@
+from array import array
+
+# (label, seconds) of the rolling windows kept for the fleet and for each device
+ROLLING_WINDOWS = (('10s', 10.0), ('1m', 60.0), ('5m', 300.0))
+WINDOW_SLOTS = 10  # Each window is a ring of 10 slots: it covers its last 9-10 slots (10% granularity)
+COUNTERS = ('received', 'lost', 'duplicates')
+
+
+def loss_rate(received, lost):
+    """Readings lost as a percentage of received + lost"""
+    total = received + lost
+    return lost / total * 100 if total else 0.0
+
+
+def duplicate_rate(received, duplicates):
+    """Fraction of messages that were duplicates"""
+    total = received + duplicates
+    return duplicates / total if total else 0.0
+
+
+def window_summary(received, lost, duplicates):
+    """Counters of one window with the rates derived from them"""
+    return {
+        'received': received,
+        'lost': lost,
+        'duplicates': duplicates,
+        'loss_rate': loss_rate(received, lost),
+        'duplicate_rate': duplicate_rate(received, duplicates),
+    }
+
+
+class RollingCounters:
+    """
+    Received/lost/duplicate counts over several rolling windows.
+
+    A packet only adds to three pending counters for the current slot of the
+    finest window (1 s by default). When that slot is over, its counts are
+    folded into one ring of WINDOW_SLOTS slots per window, each slot tagged
+    with the tick it holds, so a slot that has rolled out of its window is
+    simply ignored (and overwritten later) rather than cleared. Recording is
+    a few additions and reading sums a fixed number of slots, whatever the
+    traffic. Window widths must be multiples of the finest one.
+    """
+
+    __slots__ = ('widths', 'pending_tick', 'slot_end', 'received', 'lost', 'duplicates', 'ticks', 'counts')
+
+    def __init__(self, widths):
+        self.widths = widths  # Slot width (s) per window, finest first, shared between instances
+        self.pending_tick = None  # Finest-window tick of the pending counts (None: nothing recorded yet)
+        self.slot_end = float('-inf')  # Time at which the pending slot is over
+        self.received = self.lost = self.duplicates = 0  # Pending counts, not yet folded into the rings
+        self.ticks = array('q', [-1]) * (len(widths) * WINDOW_SLOTS)  # Tick held by each ring slot
+        self.counts = array('q', bytes(8 * len(widths) * WINDOW_SLOTS * 3))  # received, lost, duplicates per slot
+
+    def record(self, now, received, lost, duplicates):
+        if now >= self.slot_end:
+            self.roll(now)
+        self.received += received
+        self.lost += lost
+        self.duplicates += duplicates
+
+    def roll(self, now):
+        """Fold the pending counts into the rings and start the slot that holds now"""
+        fine = self.widths[0]
+        if self.pending_tick is not None:
+            start = self.pending_tick * fine
+            for window, width in enumerate(self.widths):
+                tick = int(start // width)
+                slot = window * WINDOW_SLOTS + tick % WINDOW_SLOTS
+                base = slot * 3
+                if self.ticks[slot] != tick:  # Slot still holds an older tick: reuse it
+                    self.ticks[slot] = tick
+                    self.counts[base] = self.counts[base + 1] = self.counts[base + 2] = 0
+                self.counts[base] += self.received
+                self.counts[base + 1] += self.lost
+                self.counts[base + 2] += self.duplicates
+        # A clock stepped back (now < slot_end) never gets here: its counts stay in the pending slot
+        self.pending_tick = int(now // fine)
+        self.slot_end = (self.pending_tick + 1) * fine
+        self.received = self.lost = self.duplicates = 0
+
+    def read(self, now):
+        """
+        (received, lost, duplicates) per window as of now. Does not modify
+        anything, so another thread may call it while packets are recorded.
+        """
+        ticks = self.ticks
+        counts = self.counts
+        results = []
+        for window, width in enumerate(self.widths):
+            newest = int(now // width)
+            oldest = newest - WINDOW_SLOTS + 1
+            received = lost = duplicates = 0
+            for slot in range(window * WINDOW_SLOTS, (window + 1) * WINDOW_SLOTS):
+                if oldest <= ticks[slot] <= newest:
+                    base = slot * 3
+                    received += counts[base]
+                    lost += counts[base + 1]
+                    duplicates += counts[base + 2]
+            pending_tick = self.pending_tick
+            if pending_tick is not None and oldest <= int(pending_tick * self.widths[0] // width) <= newest:
+                received += self.received
+                lost += self.lost
+                duplicates += self.duplicates
+            results.append((received, lost, duplicates))
+        return results
+
+
+class RollingStats:
+    """RollingCounters for the whole fleet and for each device"""
+
+    def __init__(self, windows=ROLLING_WINDOWS):
+        windows = sorted(windows, key=lambda window: window[1])  # Finest first
+        self.labels = [label for label, _ in windows]
+        self.widths = tuple(span / WINDOW_SLOTS for _, span in windows)
+        self.fleet = RollingCounters(self.widths)
+        self.devices = {}  # device_id -> RollingCounters
+
+    def record(self, device_id, now, received, lost, duplicates):
+        """Add one packet's counts to the fleet's and the device's windows"""
+        self.fleet.record(now, received, lost, duplicates)
+        counters = self.devices.get(device_id)
+        if counters is None:
+            counters = self.devices[device_id] = RollingCounters(self.widths)
+        counters.record(now, received, lost, duplicates)
+
+    def remove(self, device_id):
+        self.devices.pop(device_id, None)
+
+    def summarize(self, counters, now):
+        """{label: window_summary()} for one RollingCounters"""
+        return {label: window_summary(*values) for label, values in zip(self.labels, counters.read(now))}
+
+    def snapshot(self, now):
+        """{'fleet': {label: window}, 'devices': {device_id: {label: window}}} (picklable, JSON-serializable)"""
+        devices = self.devices.copy()  # The receive thread may add devices meanwhile
+        return {
+            'fleet': self.summarize(self.fleet, now),
+            'devices': {device_id: self.summarize(counters, now) for device_id, counters in sorted(devices.items())},
+        }
+
+
+def merge_rolling(snapshots):
+    """Combine snapshot()s of shards that track disjoint devices (fleet counters add up)"""
+    fleet = {}
+    devices = {}
+    for snapshot in snapshots:
+        for label, window in snapshot['fleet'].items():
+            merged = fleet.setdefault(label, dict.fromkeys(COUNTERS, 0))
+            for counter in COUNTERS:
+                merged[counter] += window[counter]
+        devices.update(snapshot['devices'])
+    return {
+        'fleet': {label: window_summary(*(window[counter] for counter in COUNTERS)) for label, window in fleet.items()},
+        'devices': dict(sorted(devices.items())),
+    }
@@ -0,0 +1,74 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class EventScheduler:
+    """
+    Timer heap for everything a sensor does on a clock: readings, heartbeats,
+    delayed (jittered) sends and retransmission timeouts.
+
+    Callbacks run one at a time on the thread that calls run(), so a sensor
+    needs no extra threads however many timers are armed. Other threads (the
+    ACK listener) may add events at any time; the loop sleeps until the
+    earliest deadline and is woken early only when an earlier one arrives.
+    There is no cancel: callbacks check whether their event is still wanted.
+    """
+
+    def __init__(self):
+        self.heap = []                    # (when, insertion order, callback, args)
+        self.counter = itertools.count()  # Tie-breaker: equal deadlines run in scheduling order
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.events_run = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def call_at(self, when, callback, *args):
+        """Run callback(*args) at time when (time.time() based)"""
+        with self.cond:
+            heapq.heappush(self.heap, (when, next(self.counter), callback, args))
+            if self.heap[0][0] == when:
+                self.cond.notify()  # New earliest deadline: the loop may be sleeping past it
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) delay seconds from now"""
+        self.call_at(time.time() + delay, callback, *args)
+
+    def call_soon(self, callback, *args):
+        """Run callback(*args) on the scheduler thread as soon as possible"""
+        self.call_at(0.0, callback, *args)
+
+    def stop(self):
+        """Make run() return after the current callback"""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def run(self, until=None):
+        """
+        Run due callbacks until stop() is called or, if until is given, until that
+        time is reached. Events left in the heap stay armed for the next run().
+        """
+        heap = self.heap
+        cond = self.cond
+        self.stopped = False
+        while True:
+            with cond:
+                while not self.stopped:
+                    now = time.time()
+                    if until is not None and now >= until:
+                        return  # Checked first: a backlog of due events cannot overrun until
+                    if heap and heap[0][0] <= now:
+                        break
+                    deadline = heap[0][0] if heap else until
+                    if until is not None and deadline > until:
+                        deadline = until
+                    cond.wait(None if deadline is None else deadline - now)
+                if self.stopped:
+                    return
+                _, _, callback, args = heapq.heappop(heap)
+            self.events_run += 1
+            callback(*args)
@@ -0,0 +1,60 @@
+from protocol import seq_diff
+
+DEFAULT_WINDOW_SIZE = 1024  # sequence numbers remembered behind the newest one
+
+
+class SequenceWindow:
+    """
+    Fixed-size duplicate detector for one device (anti-replay window style).
+
+    Remembers the newest sequence number seen (top) and a bitmap of which of
+    the previous window_size - 1 numbers were seen, using 16-bit serial
+    arithmetic so it keeps working after seq_num wraps from 65535 to 0.
+    Memory is constant per device, unlike a set of every seq ever received.
+    Sequence numbers older than the window are reported as already seen.
+    """
+
+    __slots__ = ('size', 'mask', 'top', 'bitmap')
+
+    def __init__(self, size=DEFAULT_WINDOW_SIZE):
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.top = None   # Newest sequence number seen
+        self.bitmap = 0   # Bit i set => seq (top - i) seen
+
+    def seen(self, seq):
+        """True if seq was already recorded (or is too old to tell)"""
+        if self.top is None:
+            return False
+        offset = -seq_diff(seq, self.top)
+        if offset < 0:
+            return False  # Newer than anything seen
+        if offset >= self.size:
+            return True   # Fell out of the window: treat as a replay
+        return (self.bitmap >> offset) & 1 == 1
+
+    def mark(self, seq):
+        """Record seq as received, sliding the window forward if it is the newest"""
+        if self.top is None:
+            self.top = seq
+            self.bitmap = 1
+            return
+        advance = seq_diff(seq, self.top)
+        if advance > 0:
+            self.bitmap = ((self.bitmap << advance) | 1) & self.mask if advance < self.size else 1
+            self.top = seq
+        elif -advance < self.size:
+            self.bitmap |= 1 << -advance
+
+    def bits_below(self, anchor, count=64):
+        """
+        Bitmap of the count sequence numbers just below anchor: bit i set => seq
+        anchor - 1 - i was recorded. Numbers outside the window read as not seen.
+        """
+        if self.top is None:
+            return 0
+        offset = -seq_diff(anchor, self.top) + 1  # Window bit of anchor - 1
+        if offset < 0:
+            # anchor is newer than top: shift the window up instead
+            return (self.bitmap << -offset) & ((1 << count) - 1)
+        return (self.bitmap >> offset) & ((1 << count) - 1)
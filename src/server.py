@@ -1,14 +1,31 @@
 import socket
-import sys
+import select
+import os
+import signal
 import time
-import csv
+import argparse
 import json
+from collections import deque
 from datetime import datetime
-from protocol import TinyTelemetryProtocol, MSG_INIT, MSG_DATA, MSG_HEARTBEAT, MSG_ACK
-from performance_monitor import PerformanceMonitor
+from protocol import (TinyTelemetryProtocol, MSG_INIT, MSG_DATA, MSG_HEARTBEAT, MSG_ACK, PROTOCOL_VERSION_BINARY,
+                      FLAG_SACK_OK, SACK_BITMAP_BITS, MAX_ACK_DELAY, SEQ_MASK, seq_diff)
+from seq_window import SequenceWindow, DEFAULT_WINDOW_SIZE
+from reorder_buffer import ReorderBuffer
+from liveness import LivenessTracker
+from device_table import DeviceTable
+from rolling_stats import RollingStats, loss_rate, duplicate_rate
+from performance_monitor import PerformanceMonitor, udp_socket_stats
+from sinks import create_sink
+from histogram import HistogramSet, LatencyHistogram, format_summary_line
+from telemetry_log import (get_logger, setup_logging, flush_logging, shutdown_logging, PacketLogSampler,
+                           LOG_LEVEL, LOG_FILE, LOG_SAMPLE, LOG_SUMMARY_INTERVAL)
 
 # Maximum UDP application payload size (excluding header)
 MAX_UDP_PAYLOAD = 200  # bytes
+RECV_BUFFER_SIZE = 1024  # Largest datagram read per recvfrom
+LIVENESS_CHECK_INTERVAL = 1.0  # Seconds between offline-device checks (whatever the traffic)
+
+log = get_logger('server')
 
 class TelemetryCollector:
     def __init__(self, host=socket.gethostbyname(socket.gethostname()), port=5000):
@@ -16,145 +33,381 @@ class TelemetryCollector:
         self.port = port
         self.socket = None
         # Per-device state
-        self.device_state = {}  # device_id -> {'last_seq': num, 'last_timestamp': ts}
-        self.received_sequences = {}  # Track all received seq nums per device for duplicate detection
-        self.csv_file = None
-        self.csv_writer = None
+        self.devices = DeviceTable()  # Columns indexed by device_id: devices.last_seq[device_id] etc.
+        self.sequence_windows = {}  # device_id -> SequenceWindow of recently received seq nums (duplicate detection)
+        self.dedup_window_size = DEFAULT_WINDOW_SIZE
+        self.sink = None  # Telemetry row sink (see sinks.py)
+        self.sink_kind = 'queued-csv'  # 'csv' (receive thread), 'queued-csv' or 'columnar' (writer thread)
+        self.sink_options = {}  # Keyword arguments for the sink (flush policy, columnar segment rotation)
+        self.flush_every_write = True  # Flush the CSV after each packet (engines with a flush timer turn this off)
         self.total_expected = 0
         self.total_received = 0
         self.total_lost = 0
-        self.packet_buffer = []  # Buffer for reordering
+        self.rolling = RollingStats()  # Received/lost/duplicates over the last 10s, 1m and 5m (fleet and per device)
+        self.packet_buffer = ReorderBuffer()  # Buffer for reordering (heap keyed by release deadline)
         self.buffer_timeout = 2.0  # Wait 2 seconds before processing
+        self.liveness = LivenessTracker()  # Offline detection: deadline heap keyed by last_seen
+        self.next_liveness_check = time.time() + LIVENESS_CHECK_INTERVAL
         
         # Phase 2 Metrics
         self.total_duplicates = 0        # Count of duplicate messages
         self.total_retransmits = 0       # Count of retransmissions (duplicates due to RDT)
         self.sequence_gap_count = 0      # Number of gap events (not total missing)
         self.total_bytes_received = 0    # Total bytes (header + payload)
-        self.total_cpu_time_ms = 0       # Total CPU time spent processing
+        self.total_datagrams = 0         # Datagrams processed (every message type)
+        self.latency = HistogramSet()    # Per-stage latency histograms (process.<type>, reorder, display, ack)
+        self.reorder_latency = self.latency.get('reorder')  # Time held in the reorder buffer
+        self.display_latency = self.latency.get('display')  # display_packet (log line + sink row)
+        self.ack_latency = self.latency.get('ack')          # Arrival to coalesced ACK sent ('sack' mode)
         self.performance_monitor = PerformanceMonitor()
+        self.monitor_interval = None     # Seconds between background performance samples (None = no sampler)
+        self.stats_json = None           # Write the final statistics to this JSON file (benchmarks)
+        self.metrics_host = '127.0.0.1'  # Live metrics endpoint (Prometheus text format, see metrics_endpoint.py)
+        self.metrics_port = None         # None = no endpoint
+        self.metrics_labels = {}         # Labels added to every exported sample (e.g. shard)
+        self.metrics_server = None
+
+        # Receive path
+        self.engine = 'blocking'         # Event loop driving the collector (see async_server for 'asyncio')
+        self.receive_mode = 'blocking'   # 'blocking' (one recvfrom per loop) or 'batched' (drain socket)
+        self.recv_batch_size = 64        # Max datagrams drained per batch in 'batched' mode
+        self.rcvbuf_size = None          # SO_RCVBUF in bytes (None = OS default)
+        self.recv_buffers = []           # Preallocated receive buffers for 'batched' mode
+        self.total_batches = 0           # Number of non-empty batches drained
+        self.total_batched_datagrams = 0 # Datagrams read through drain_socket
+        self.kernel_drops = None         # Last kernel drop count read for the socket
+
+        # ACK path
+        self.ack_mode = 'sack'           # 'sack': coalesced cumulative/selective ACKs to sensors that set FLAG_SACK_OK
+                                         # 'immediate': one legacy ACK per DATA/BATCH packet
+        self.ack_delay = 0.01            # Seconds a device's ACK is held back to cover more packets ('sack' mode)
+        self.pending_acks = {}           # device_id -> {'addr': addr, 'seqs': [seq, ...]} awaiting the ACK flush
+        self.ack_deadlines = deque()     # (deadline, device_id); the delay is constant, so FIFO is deadline order
+        self.total_ack_requests = 0      # DATA/BATCH packets that asked for an ACK
+        self.total_acks_sent = 0         # ACK datagrams sent
+
+        # Console/file logging (per-packet lines are sampled, statistics are periodic summaries)
+        self.log_sample_every = LOG_SAMPLE            # Log 1 in N packets
+        self.summary_interval = LOG_SUMMARY_INTERVAL  # Seconds between [STATISTICS] lines
+        self.packet_log = PacketLogSampler(log, self.log_sample_every)
+        self.next_summary = time.time() + self.summary_interval
+        self.last_summary = {'time': time.time(), 'received': 0, 'lost': 0, 'duplicates': 0}
 
     def start(self):
         """Start the UDP server"""
+        self.open_socket()
+        # Logging settings may have changed since __init__
+        self.packet_log = PacketLogSampler(log, self.log_sample_every)
+        self.next_summary = time.time() + self.summary_interval
+        self.last_summary['time'] = time.time()
+        log.info(f"[SERVER] TinyTelemetry Collector v1 started")
+        log.info(f"[SERVER] Listening on {self.host}:{self.port}")
+        log.info(f"[SERVER] Engine: {self.engine}, receive mode: {self.receive_mode}, "
+                 f"SO_RCVBUF: {self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes")
+        if self.log_sample_every > 1:
+            log.info(f"[SERVER] Logging 1 in {self.log_sample_every} packets, summary every {self.summary_interval}s")
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.handle_latency_signal)
+            log.info(f"[SERVER] Latency percentiles on demand: kill -USR1 {os.getpid()}")
+        log.info(f"[SERVER] Waiting for sensor data...")
+        log.info("-" * 80)
+        if self.receive_mode == 'batched':
+            # Drain without blocking; select() provides the housekeeping timeouts
+            self.socket.setblocking(False)
+            self.recv_buffers = [memoryview(bytearray(RECV_BUFFER_SIZE)) for _ in range(self.recv_batch_size)]
+
+        self.open_sink()
+        if self.monitor_interval:
+            self.performance_monitor.start_sampler(self.monitor_interval, self.socket)
+        if self.metrics_port is not None:
+            from metrics_endpoint import MetricsServer
+            self.metrics_server = MetricsServer(self, self.metrics_host, self.metrics_port).start()
+
+    def open_socket(self):
+        """Create and bind the collector's UDP socket"""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.rcvbuf_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
         self.socket.bind((self.host, self.port))
-        print(f"[SERVER] TinyTelemetry Collector v1 started")
-        print(f"[SERVER] Listening on {self.host}:{self.port}")
-        print(f"[SERVER] Waiting for sensor data...")
-        print("-" * 80)
-        self.socket.settimeout(5.0)  # Timeout every 5 seconds
-        
 
+    def open_sink(self, csv_filename=None):
+        """Create the telemetry sink (CSV file with a header row)"""
         # Create CSV file with timestamp
-        csv_filename = f"telemetry_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        self.csv_file = open(csv_filename, 'w', newline='')
-        self.csv_writer = csv.writer(self.csv_file)
-        # Write header row with duplicate_flag, gap_flag, retransmit_flag columns
-        self.csv_writer.writerow(['timestamp', 'device_id', 'seq_num', 'msg_type', 'temperature', 'humidity', 'duplicate_flag', 'gap_flag', 'retransmit_flag', 'packet_bytes'])
-        self.csv_file.flush()
-        print(f"[SERVER] Logging to: {csv_filename}")
+        if csv_filename is None:
+            csv_filename = f"telemetry_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        self.sink = create_sink(self.sink_kind, csv_filename, **self.sink_options)
+        log.info(f"[SERVER] Logging to: {self.sink.describe()}")
+
+    def close_metrics(self):
+        """Stop the metrics endpoint, if one is running"""
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def performance_series_path(self):
+        """Where the sampled performance series is exported: next to the telemetry output"""
+        if self.sink is None:
+            return None
+        return f"{os.path.splitext(self.sink.filename)[0]}_perf.csv"
+
+    def stop_monitor(self):
+        """Stop the performance sampler and export its series (before the final statistics)"""
+        monitor = self.performance_monitor
+        if monitor.thread is None:
+            return
+        monitor.stop_sampler()
+        path = self.performance_series_path()
+        if path and monitor.export_csv(path):
+            log.info(f"[SERVER] Performance samples written to: {path} ({len(monitor.samples)} samples)")
+
+    def close_sink(self):
+        """Write out everything the sink has accepted and close it (safe to call twice)"""
+        if self.sink:
+            self.sink.close()
+
+    def send_ack(self, ack_packet, addr):
+        """Send an ACK datagram back to a sensor"""
+        self.socket.sendto(ack_packet, addr)
+
+    def queue_ack(self, device_id, seq_num, addr, now):
+        """Hold the ACK for seq_num so that one selective ACK covers the device's packets of the next ack_delay"""
+        pending = self.pending_acks.get(device_id)
+        if pending is None:
+            self.pending_acks[device_id] = {'addr': addr, 'seqs': [seq_num]}
+            self.ack_deadlines.append((now + self.ack_delay, device_id))
+        else:
+            pending['addr'] = addr  # Reply to the newest source address
+            pending['seqs'].append(seq_num)
+
+    def flush_acks(self, force=False):
+        """Send the selective ACKs whose delay has expired (all of them if force)"""
+        now = time.time()
+        deadlines = self.ack_deadlines
+        while deadlines and (force or deadlines[0][0] <= now):
+            deadline, device_id = deadlines.popleft()
+            pending = self.pending_acks.pop(device_id, None)
+            if pending:
+                self.send_selective_ack(device_id, pending['addr'], pending['seqs'])
+                self.ack_latency.record_seconds(now - deadline + self.ack_delay)
+
+    def send_selective_ack(self, device_id, addr, seqs):
+        """
+        Acknowledge everything the device's sequence window holds: one ACK anchored
+        at the newest seq (cumulative seq + 64-bit bitmap below it), plus an extra
+        ACK for each cluster of pending seqs too far behind for that bitmap.
+        """
+        window = self.sequence_windows.get(device_id)
+        devices = self.devices
+        if window is None or not devices.active[device_id] or window.top is None:
+            return  # Packet was rejected (or device timed out) before it was recorded
+
+        # Advance the cumulative point over every seq received in order. A seq that never
+        # arrives stalls it; it is never left further behind than the window, since older
+        # seqs are settled (the window reports them as seen) and serial comparisons need it close
+        cumulative = devices.cum_ack[device_id]
+        top = window.top
+        floor = (top - window.size) & SEQ_MASK
+        if seq_diff(floor, cumulative) > 0:
+            cumulative = floor
+        while seq_diff(top, cumulative) > 0 and window.seen((cumulative + 1) & SEQ_MASK):
+            cumulative = (cumulative + 1) & SEQ_MASK
+        devices.cum_ack[device_id] = cumulative
+
+        anchor = top
+        self.send_ack(TinyTelemetryProtocol.create_message(
+            MSG_ACK, device_id, anchor, timestamp=0,
+            payload=TinyTelemetryProtocol.encode_sack_payload(cumulative, window.bits_below(anchor))), addr)
+        self.total_acks_sent += 1
+
+        # Split off seqs the first ACK cannot express (newest first, one ACK per 64-seq cluster)
+        uncovered = [seq for seq in seqs
+                     if seq_diff(anchor, seq) > SACK_BITMAP_BITS and seq_diff(seq, cumulative) > 0]
+        for seq in sorted(uncovered, key=lambda q: seq_diff(q, anchor), reverse=True):
+            if seq_diff(anchor, seq) <= SACK_BITMAP_BITS:
+                continue  # Covered by the previous cluster's bitmap
+            anchor = seq
+            self.send_ack(TinyTelemetryProtocol.create_message(
+                MSG_ACK, device_id, anchor, timestamp=0,
+                payload=TinyTelemetryProtocol.encode_sack_payload(cumulative, window.bits_below(anchor))), addr)
+            self.total_acks_sent += 1
+
+    def write_row(self, row):
+        """Append one row to the telemetry sink (timestamp as epoch seconds)"""
+        self.sink.write(row)
+
+    def flush_rows(self):
+        """Flush written rows to disk (unless the engine flushes on its own schedule)"""
+        if self.flush_every_write:
+            self.sink.flush()
 
     def add_to_buffer(self, packet_info):
         """Add packet to buffer for reordering"""
-        self.packet_buffer.append(packet_info)
+        self.packet_buffer.push(packet_info, packet_info['buffer_time'] + self.buffer_timeout)
 
-    def process_buffer(self):
-        """Process buffered packets in timestamp order"""
+    def process_buffer(self, force=False):
+        """Release buffered packets whose hold time has expired (all of them if force), in seq order"""
         if not self.packet_buffer:
             return
     
-        current_time = time.time()
-        
-        # Find packets that have been in buffer long enough
-        ready_packets = []
-        remaining_packets = []
-        
-        for packet in self.packet_buffer:
-            if current_time - packet['buffer_time'] >= self.buffer_timeout:
-                ready_packets.append(packet)
-            else:
-                remaining_packets.append(packet)
-        
-        # Update buffer immediately to prevent re-processing
-        self.packet_buffer = remaining_packets
+        now = time.time()
+        if force:
+            ready_packets = self.packet_buffer.pop_all()
+        else:
+            ready_packets = self.packet_buffer.pop_ready(now)
         
         if ready_packets:
-            # Sort ready packets by timestamp (THIS IS THE REORDERING!)
-            print(f"\n[BUFFER] Processing {len(ready_packets)} buffered packets...")
-            ready_packets.sort(key=lambda p: p['timestamp'])
+            # Packets come out sorted by device and seq (THIS IS THE REORDERING!)
+            log.debug(f"[BUFFER] Processing {len(ready_packets)} buffered packets...")
         
             # Process sorted packets
+            reorder_latency = self.reorder_latency
+            display_latency = self.display_latency
             for packet in ready_packets:
+                reorder_latency.record_seconds(now - packet['buffer_time'])
+                started = time.perf_counter_ns()
                 self.display_packet(packet)
+                display_latency.record(time.perf_counter_ns() - started)
+
+    def housekeeping_timeout(self):
+        """Seconds until the next ACK flush, reorder-buffer release, summary line or liveness check, whichever is first"""
+        deadline = min(self.next_liveness_check, self.next_summary)
+        if self.ack_deadlines and self.ack_deadlines[0][0] < deadline:
+            deadline = self.ack_deadlines[0][0]
+        buffer_deadline = self.packet_buffer.next_deadline()
+        if buffer_deadline is not None and buffer_deadline < deadline:
+            deadline = buffer_deadline
+        return max(0.0, deadline - time.time())
 
     # feature: Check for device timeouts
-    def check_device_timeout(self, timeout=30):
-        """Check for devices that have timed out"""
-        current_time = time.time()
-        for device_id, state in list(self.device_state.items()):
-            if current_time - state['last_seen'] > timeout:
-                print(f"[TIMEOUT] Device {device_id} has not sent data for {timeout} seconds. Marking as offline.")
-                del self.device_state[device_id]
+    def check_device_timeout(self):
+        """Mark devices that have been silent for longer than the liveness timeout as offline (O(expired))"""
+        now = time.time()
+        self.next_liveness_check = now + LIVENESS_CHECK_INTERVAL
+        for device_id, silent in self.liveness.expire(now):
+            self.device_offline(device_id, silent)
+
+    def device_offline(self, device_id, silent):
+        """Offline transition: the device's state is dropped (it starts afresh if it comes back)"""
+        log.info(f"[TIMEOUT] Device {device_id} has not sent data for {silent:.0f} seconds. Marking as offline.")
+        self.devices.remove(device_id)
+        self.sequence_windows.pop(device_id, None)
+        self.rolling.remove(device_id)
+
+    def device_online(self, device_id, offline_for):
+        """Online transition: a device marked offline sent a packet again"""
+        log.info(f"[ONLINE] Device {device_id} is back after {offline_for:.0f} seconds offline")
+
+    def processing_time_ms(self):
+        """Total time spent in process_packet (sum of the process.<type> histograms)"""
+        return sum(histogram.total for name, histogram in self.latency if name.startswith('process.')) / 1e6
+
+    def latency_histograms(self):
+        """Snapshot of every latency histogram, the sink's ingest-to-sink latency included"""
+        histograms = self.latency.to_dicts()
+        if self.sink:
+            histograms['sink'] = self.sink.latency.to_dict()
+        return histograms
+
+    def handle_latency_signal(self, signum, frame):
+        """SIGUSR1: log the current latency percentiles without stopping the collector"""
+        log.warning(f"[LATENCY] Percentiles so far (pid {os.getpid()}):")
+        for name, histogram in sorted(self.latency_histograms().items()):
+            summary = LatencyHistogram.from_dict(histogram).summary()
+            if summary['count']:
+                log.warning(f"[LATENCY]   {format_summary_line(name, summary)}")
+
+    def log_summary(self):
+        """Log one aggregated [STATISTICS] line (replaces per-packet statistics lines)"""
+        now = time.time()
+        self.next_summary = now + self.summary_interval
+        last = self.last_summary
+        received = self.total_received - last['received']
+        if received == 0 and self.total_lost == last['lost'] and self.total_duplicates == last['duplicates']:
+            return  # Nothing new since the last summary
+        elapsed = now - last['time']
+        windows = self.rolling.summarize(self.rolling.fleet, now)
+        recent = ', '.join(f"{label} {window['loss_rate']:.2f}%" for label, window in windows.items())
+        log.info(f"[STATISTICS] Total Received: {self.total_received}, Total Lost: {self.total_lost}, "
+                 f"Loss Rate: {loss_rate(self.total_received, self.total_lost):.2f}% ({recent}) | last {elapsed:.1f}s: {received} readings "
+                 f"({received / elapsed if elapsed > 0 else 0:.1f}/s), {self.total_lost - last['lost']} lost, "
+                 f"{self.total_duplicates - last['duplicates']} duplicates, {len(self.devices)} devices")
+        self.last_summary = {'time': now, 'received': self.total_received, 'lost': self.total_lost,
+                             'duplicates': self.total_duplicates}
 
     def process_packet(self, data, addr):
         """Process received packet"""
-        cpu_start = time.perf_counter()  # Start CPU timing
+        cpu_start = time.perf_counter_ns()  # Start CPU timing
         
         try:
             # Track total bytes received (header + payload)
             packet_bytes = len(data)
             self.total_bytes_received += packet_bytes
+            self.total_datagrams += 1
             
             # Parse message
             header, payload = TinyTelemetryProtocol.parse_message(data)
             arrival_time = time.time()
             
-            device_id = header['device_id']
-            seq_num = header['seq_num']
-            timestamp = header['timestamp']
-            msg_type = header['msg_type']
+            device_id = header.device_id
+            seq_num = header.seq_num
+            timestamp = header.timestamp
+            msg_type = header.msg_type
+            version = header.version  # Selects JSON (v1) or binary (v2) payload format
             msg_type_str = TinyTelemetryProtocol.msg_type_to_string(msg_type)
+            # Per-packet log lines are sampled (1 in N) and skipped entirely when disabled
+            log_this = self.packet_log.enabled and self.packet_log.sample()
             
             # Send ACK for DATA and BATCH messages (not INIT or HEARTBEAT)
             if msg_type in [MSG_DATA, 3]:  # MSG_DATA or MSG_BATCH
-                ack_packet = TinyTelemetryProtocol.create_message(MSG_ACK, device_id, seq_num, timestamp=0, payload=b'')
-                self.socket.sendto(ack_packet, addr)
+                self.total_ack_requests += 1
+                if self.ack_mode == 'sack' and header.flags & FLAG_SACK_OK:
+                    # Coalesced: flushed after ack_delay, once this packet is in the sequence window
+                    self.queue_ack(device_id, seq_num, addr, arrival_time)
+                else:
+                    ack_packet = TinyTelemetryProtocol.create_message(MSG_ACK, device_id, seq_num, timestamp=0, payload=b'')
+                    self.send_ack(ack_packet, addr)
+                    self.total_acks_sent += 1
 
             # Check payload size constraint (Phase 2 requirement: <= 200 bytes)
             payload_size = len(payload) if payload else 0
             if payload_size > MAX_UDP_PAYLOAD:
-                print(f"[WARNING] Payload size {payload_size} exceeds max {MAX_UDP_PAYLOAD} bytes!")
+                log.warning(f"[WARNING] Payload size {payload_size} exceeds max {MAX_UDP_PAYLOAD} bytes!")
 
             # Initialize device state if new
-            if device_id not in self.device_state:
-                self.device_state[device_id] = {
-                    'last_seq': -1,
-                    'last_timestamp': 0,
-                    'packet_count': 0,
-                    'last_seen': arrival_time,
-                    'heartbeat_count': 0
-                }
-                self.received_sequences[device_id] = set()
-
-            state = self.device_state[device_id]
+            devices = self.devices
+            if not devices.active[device_id]:
+                # Cumulative ACK point: nothing before the first packet is claimed
+                devices.add(device_id, (seq_num - 1) & SEQ_MASK, arrival_time)
+                self.sequence_windows[device_id] = SequenceWindow(self.dedup_window_size)
+
+            # Any packet (duplicates included) shows the device is alive
+            offline_for = self.liveness.seen(device_id, arrival_time)
+            if offline_for is not None:
+                self.device_online(device_id, offline_for)
+
+            last_seq = devices.last_seq[device_id]
+            received_before = self.total_received
+            lost_before = self.total_lost
+            window = self.sequence_windows[device_id]
             duplicate_flag = False
             retransmit_flag = False
             gap_flag = False
 
             # Check for duplicate/retransmission (skip for heartbeats - they all use seq 0)
-            if msg_type != MSG_HEARTBEAT and seq_num in self.received_sequences[device_id]:
+            if msg_type != MSG_HEARTBEAT and window.seen(seq_num):
                 duplicate_flag = True
                 retransmit_flag = True  # Assume duplicate is a retransmission from RDT
                 self.total_duplicates += 1
                 self.total_retransmits += 1
 
             # Check for sequence gap (skip for HEARTBEAT messages)
-            if msg_type not in [3, MSG_HEARTBEAT] and state['last_seq'] != -1 and seq_num > state['last_seq'] + 1:
+            if msg_type not in [3, MSG_HEARTBEAT] and last_seq != -1 and seq_diff(seq_num, last_seq) > 1:
                 gap_flag = True
-                gap_size = seq_num - state['last_seq'] - 1
+                gap_size = seq_diff(seq_num, last_seq) - 1
                 self.sequence_gap_count += 1  # Track gap event count
-                print(f"[WARNING] Device {device_id}: Sequence gap detected! "
-                      f"Missing {gap_size} packet(s) between seq {state['last_seq']} and {seq_num}")
+                if log_this:
+                    log.warning(f"[WARNING] Device {device_id}: Sequence gap detected! "
+                                f"Missing {gap_size} packet(s) between seq {last_seq} and {seq_num}")
 
             if gap_flag:
                 self.total_lost += gap_size
@@ -166,29 +419,28 @@ class TelemetryCollector:
             if not duplicate_flag:
                 # Don't update last_seq for heartbeats (they don't have real sequence numbers)
                 if msg_type != MSG_HEARTBEAT:
-                    state['last_seq'] = seq_num
-                state['last_timestamp'] = timestamp
-                state['packet_count'] += 1
-                state['last_seen'] = arrival_time
+                    devices.last_seq[device_id] = seq_num
+                devices.last_timestamp[device_id] = timestamp
+                devices.packet_count[device_id] += 1
+                devices.last_seen[device_id] = arrival_time
                 
                 # Track heartbeat count (display immediately - not buffered)
                 if msg_type == MSG_HEARTBEAT:
-                    state['heartbeat_count'] += 1
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Device {device_id} | Seq {seq_num} | Type: {msg_type_str} | From {addr[0]}:{addr[1]}")
-                    print(f"          ♥ Device is still alive (Total heartbeats: {state['heartbeat_count']})")
+                    devices.heartbeat_count[device_id] += 1
+                    if log_this:
+                        log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Device {device_id} | Seq {seq_num} | Type: {msg_type_str} | From {addr[0]}:{addr[1]}")
+                        log.info(f"          ♥ Device is still alive (Total heartbeats: {devices.heartbeat_count[device_id]})")
                     self.total_received += 1  # Count heartbeat as 1 reading
-                    if self.total_received > 0:
-                        loss_rate = (self.total_lost / (self.total_received + self.total_lost)) * 100
-                        print(f"[STATISTICS] Total Received: {self.total_received}, Total Lost: {self.total_lost}, Loss Rate: {loss_rate:.2f}%")
                 elif msg_type == 3:  # BATCH
                     # Display BATCH header immediately (not buffered)
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Device {device_id} | Seq {seq_num} | Type: BATCH | From {addr[0]}:{addr[1]}")
-                    readings = json.loads(payload.decode('utf-8'))
-                    print(f"          [BATCH] {len(readings)} readings:")
+                    readings = TinyTelemetryProtocol.decode_batch_payload(version, payload)
+                    if log_this:
+                        log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Device {device_id} | Seq {seq_num} | Type: BATCH | From {addr[0]}:{addr[1]}")
+                        log.info(f"          [BATCH] {len(readings)} readings:")
                     
                     # Track last reading seq to detect gaps within batch
                     # Initialize to 0 (INIT seq), so first DATA reading should be seq 1
-                    last_reading_seq = state.get('last_reading_seq', 0)
+                    last_reading_seq = devices.last_reading_seq[device_id]
                     
                     for reading in readings:
                         reading_seq = reading.get('seq_num', 0)
@@ -196,80 +448,90 @@ class TelemetryCollector:
                         reading_duplicate_flag = False
                         
                         # Check for duplicate reading
-                        if reading_seq in self.received_sequences[device_id]:
+                        if window.seen(reading_seq):
                             reading_duplicate_flag = True
-                            print(f"            [DUPLICATE] Seq {reading_seq} already received")
+                            if log_this:
+                                log.info(f"            [DUPLICATE] Seq {reading_seq} already received")
                         
                         # Check for gap within batch (detect if first reading isn't seq 1, or any subsequent gap)
-                        if reading_seq > last_reading_seq + 1:
-                            gap_size = reading_seq - last_reading_seq - 1
+                        if seq_diff(reading_seq, last_reading_seq) > 1:
+                            gap_size = seq_diff(reading_seq, last_reading_seq) - 1
                             reading_gap_flag = True
-                            print(f"            [LOST] Missing {gap_size} reading(s) between seq {last_reading_seq} and {reading_seq}")
+                            if log_this:
+                                log.info(f"            [LOST] Missing {gap_size} reading(s) between seq {last_reading_seq} and {reading_seq}")
                             self.total_lost += gap_size
                             self.sequence_gap_count += 1
                         
                         # Display each reading
-                        print(f"            Seq {reading_seq} | Temp: {reading.get('temperature')}, Hum: {reading.get('humidity')}")
+                        if log_this:
+                            log.info(f"            Seq {reading_seq} | Temp: {reading.get('temperature')}, Hum: {reading.get('humidity')}")
                         
-                        # Log to CSV with duplicate_flag and gap_flag
-                        if self.csv_writer:
-                            self.csv_writer.writerow([
-                                datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
-                                device_id,
-                                reading_seq,
-                                'BATCH_DATA',
-                                reading.get('temperature'),
-                                reading.get('humidity'),
-                                1 if reading_duplicate_flag else 0,  # duplicate_flag
-                                1 if reading_gap_flag else 0,  # gap_flag
-                                1 if retransmit_flag else 0,  # retransmit_flag (batch-level retransmission)
-                                packet_bytes  # bytes for this packet
-                            ])
+                        # Log to CSV with duplicate_flag and gap_flag (the reading's time is the batch header timestamp)
+                        self.write_row([
+                            timestamp,
+                            device_id,
+                            reading_seq,
+                            'BATCH_DATA',
+                            reading.get('temperature'),
+                            reading.get('humidity'),
+                            1 if reading_duplicate_flag else 0,  # duplicate_flag
+                            1 if reading_gap_flag else 0,  # gap_flag
+                            1 if retransmit_flag else 0,  # retransmit_flag (batch-level retransmission)
+                            packet_bytes,  # bytes for this packet
+                            arrival_time  # ingest time, for the sink latency (not written)
+                        ])
                         
                         # Track this reading sequence as received
                         if not reading_duplicate_flag:
-                            self.received_sequences[device_id].add(reading_seq)
+                            window.mark(reading_seq)
                         
                         last_reading_seq = reading_seq
                     
                     # Save last reading seq for next batch
-                    state['last_reading_seq'] = last_reading_seq
-                    self.csv_file.flush()
+                    devices.last_reading_seq[device_id] = last_reading_seq
+                    self.flush_rows()
                     self.total_received += len(readings)  # Count each reading in batch
-                    # Display statistics after batch
-                    if self.total_received > 0:
-                        loss_rate = (self.total_lost / (self.total_received + self.total_lost)) * 100
-                        print(f"[STATISTICS] Total Received: {self.total_received}, Total Lost: {self.total_lost}, Loss Rate: {loss_rate:.2f}%")
                 elif msg_type == MSG_INIT:
-                    # Display INIT immediately (not buffered)
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Device {device_id} | Seq {seq_num} | Type: {msg_type_str} | From {addr[0]}:{addr[1]}")
-                    print("          >> New sensor initialized")
+                    # Display INIT immediately (not buffered); new sensors are always logged
+                    log.info(f"[{datetime.now().strftime('%H:%M:%S')}] Device {device_id} | Seq {seq_num} | Type: {msg_type_str} | From {addr[0]}:{addr[1]}")
+                    log.info("          >> New sensor initialized")
                     self.total_received += 1  # Count INIT as 1
-                    if self.total_received > 0:
-                        loss_rate = (self.total_lost / (self.total_received + self.total_lost)) * 100
-                        print(f"[STATISTICS] Total Received: {self.total_received}, Total Lost: {self.total_lost}, Loss Rate: {loss_rate:.2f}%")
                 elif msg_type == MSG_DATA:
                     self.total_received += 1  # Count single DATA as 1 reading
+
+            # Rolling-window counters: this packet's readings, losses and duplicate
+            self.rolling.record(device_id, arrival_time, self.total_received - received_before,
+                                self.total_lost - lost_before, 1 if duplicate_flag else 0)
             
             # Parse payload if DATA message
             payload_str = ""
+            reading = None
             if msg_type == MSG_DATA and payload:
                 try:
-                    payload_str = payload.decode('utf-8')
-                except:
-                    payload_str = f"<binary:{len(payload)}bytes>"
+                    reading = TinyTelemetryProtocol.decode_data_payload(version, payload)
+                    if not isinstance(reading, dict):
+                        reading = None
+                except Exception:
+                    reading = None
+                # The display string is only needed if this packet's lines are logged
+                if log_this and version == PROTOCOL_VERSION_BINARY:
+                    payload_str = (f"temperature={reading['temperature']}, humidity={reading['humidity']}"
+                                   if reading else f"<binary:{len(payload)}bytes>")
+                elif log_this:
+                    try:
+                        payload_str = str(payload, 'utf-8')
+                    except:
+                        payload_str = f"<binary:{len(payload)}bytes>"
 
             # DON'T print payload or statistics here - will be done in display_packet()
             
             # Track this sequence number as received (for duplicate/retransmit detection)
             # Do this BEFORE adding to buffer so buffer can detect duplicates
             if msg_type != MSG_HEARTBEAT and not duplicate_flag:
-                self.received_sequences[device_id].add(seq_num)
+                window.mark(seq_num)
             
-            # Record CPU time for this packet
-            cpu_end = time.perf_counter()
-            cpu_time_ms = (cpu_end - cpu_start) * 1000
-            self.total_cpu_time_ms += cpu_time_ms
+            # Record CPU time for this packet (histogram per message type)
+            self.latency.get('process.' + msg_type_str).record(time.perf_counter_ns() - cpu_start)
 
             return {
                 'device_id': device_id,
@@ -281,12 +543,15 @@ class TelemetryCollector:
                 'gap_flag': gap_flag,
                 'msg_type': msg_type_str,
                 'payload': payload_str,
+                'has_payload': bool(payload),
+                'reading': reading,
+                'log': log_this,
                 'packet_bytes': packet_bytes,
                 'addr': addr  # Include addr here
             }
 
         except Exception as e:
-            print(f"[ERROR] Failed to process packet from {addr}: {e}")
+            log.error(f"[ERROR] Failed to process packet from {addr}: {e}")
             return None
 
     def display_packet(self, packet_info):
@@ -302,32 +567,29 @@ class TelemetryCollector:
         arrival_time = packet_info['arrival_time']
         packet_bytes = packet_info.get('packet_bytes', 0)
         
-        # Log to console
-        flags_str = "[REORDERED] "
-        if duplicate_flag:
-            flags_str += "[DUPLICATE] "
-        if gap_flag:
-            flags_str += "[GAP] "
-        
-        print(f"[{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')}] {flags_str}"
-              f"Device {device_id} | Seq {seq_num} | Type: {msg_type_str} | "
-              f"From {addr[0]}:{addr[1]}")
-        
-        if payload_str:
-            print(f"          Payload: {payload_str}")
+        # Log to console (if this packet was sampled for logging)
+        if packet_info.get('log'):
+            flags_str = "[REORDERED] "
+            if duplicate_flag:
+                flags_str += "[DUPLICATE] "
+            if gap_flag:
+                flags_str += "[GAP] "
+
+            log.info(f"[{datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')}] {flags_str}"
+                     f"Device {device_id} | Seq {seq_num} | Type: {msg_type_str} | "
+                     f"From {addr[0]}:{addr[1]}")
+
+            if payload_str:
+                log.info(f"          Payload: {payload_str}")
         
         # Write to CSV with duplicate_flag and gap_flag (only for non-BATCH DATA)
-        if msg_type_str == 'DATA' and payload_str:
-            try:
-                payload_json = json.loads(payload_str)
-                temperature = payload_json.get('temperature', '')
-                humidity = payload_json.get('humidity', '')
-            except:
-                temperature = ''
-                humidity = ''
-
-            self.csv_writer.writerow([
-                datetime.fromtimestamp(arrival_time).strftime('%Y-%m-%d %H:%M:%S'),
+        if msg_type_str == 'DATA' and packet_info['has_payload']:
+            reading = packet_info.get('reading') or {}
+            temperature = reading.get('temperature', '')
+            humidity = reading.get('humidity', '')
+
+            self.write_row([
+                arrival_time,
                 device_id,
                 seq_num,
                 msg_type_str,
@@ -338,139 +600,408 @@ class TelemetryCollector:
                 1 if packet_info.get('retransmit_flag', False) else 0,
                 packet_bytes
             ])
-            self.csv_file.flush()
-        
-        # Print statistics after each packet display
-        if self.total_received > 0:
-            loss_rate = (self.total_lost / (self.total_received + self.total_lost)) * 100
-            print(f"[STATISTICS] Total Received: {self.total_received}, Total Lost: {self.total_lost}, Loss Rate: {loss_rate:.2f}%")
+            self.flush_rows()
+
+    def drain_socket(self):
+        """
+        Read every queued datagram (up to recv_batch_size) without blocking.
+        Returns a list of (memoryview, addr); the views point into the
+        preallocated receive buffers and are only valid until the next drain.
+        """
+        batch = []
+        recvfrom_into = self.socket.recvfrom_into
+        for buf in self.recv_buffers:
+            try:
+                nbytes, addr = recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                # Windows reports ICMP port unreachable from an earlier ACK here; skip it
+                continue
+            batch.append((buf[:nbytes], addr))
+        if batch:
+            self.total_batches += 1
+            self.total_batched_datagrams += len(batch)
+        return batch
+
+    def process_batch(self, batch):
+        """Process a batch of drained datagrams in arrival order"""
+        for data, addr in batch:
+            self.handle_packet_info(self.process_packet(data, addr))
+
+    def handle_packet_info(self, packet_info):
+        """Route a processed packet to the reorder buffer or display it immediately"""
+        # Add to buffer for reordering (skip BATCH, HEARTBEAT, INIT, and DUPLICATE packets)
+        # Duplicates have already been counted/tracked, no need to buffer them
+        # INIT (seq 0) is displayed immediately and should not be buffered
+        if (packet_info and 
+            packet_info['msg_type'] not in ['BATCH', 'HEARTBEAT', 'INIT'] and 
+            not packet_info['duplicate_flag']):
+            packet_info['buffer_time'] = time.time()
+            self.add_to_buffer(packet_info)
+        elif packet_info and packet_info['duplicate_flag'] and packet_info['log']:
+            # Display duplicates immediately (don't reorder them)
+            flags_str = "[DUPLICATE] "
+            if packet_info['gap_flag']:
+                flags_str += "[GAP] "
+            log.info(f"[{datetime.now().strftime('%H:%M:%S')}] {flags_str}"
+                     f"Device {packet_info['device_id']} | Seq {packet_info['seq']} | "
+                     f"Type: {packet_info['msg_type']} | From {packet_info['addr'][0]}:{packet_info['addr'][1]}")
+            if packet_info['payload']:
+                log.info(f"          Payload: {packet_info['payload']}")
+
+    def receive_loop(self):
+        """Blocking receive loop: one recvfrom per iteration"""
+        while True:
+            # Sleep in recvfrom until a packet arrives or the next housekeeping deadline
+            self.socket.settimeout(self.housekeeping_timeout())
+            try:
+                data, addr = self.socket.recvfrom(RECV_BUFFER_SIZE)
+                self.handle_packet_info(self.process_packet(data, addr))
+            except (socket.timeout, BlockingIOError):
+                pass
+            self.housekeeping()
+
+    def housekeeping(self):
+        """Send coalesced ACKs, release buffered packets, check for offline devices and log the summary, when due"""
+        if self.ack_deadlines:
+            self.flush_acks()
+        self.process_buffer()
+        now = time.time()
+        if now >= self.next_liveness_check:
+            self.check_device_timeout()
+        if now >= self.next_summary:
+            self.log_summary()
+
+    def batched_receive_loop(self):
+        """Batched receive loop: wait for readability, then drain the socket in one go"""
+        while True:
+            readable, _, _ = select.select([self.socket], [], [], self.housekeeping_timeout())
+            if readable:
+                self.process_batch(self.drain_socket())
+            self.housekeeping()
 
     def run(self):
         """Main server loop"""
         try:
             self.start()
-            last_buffer_check = time.time()
-            
-            while True:
-                try:
-                    data, addr = self.socket.recvfrom(1024)
-                    packet_info = self.process_packet(data, addr)
-                    
-                    # Add to buffer for reordering (skip BATCH, HEARTBEAT, INIT, and DUPLICATE packets)
-                    # Duplicates have already been counted/tracked, no need to buffer them
-                    # INIT (seq 0) is displayed immediately and should not be buffered
-                    if (packet_info and 
-                        packet_info['msg_type'] not in ['BATCH', 'HEARTBEAT', 'INIT'] and 
-                        not packet_info['duplicate_flag']):
-                        packet_info['buffer_time'] = time.time()
-                        self.add_to_buffer(packet_info)
-                    elif packet_info and packet_info['duplicate_flag']:
-                        # Display duplicates immediately (don't reorder them)
-                        flags_str = "[DUPLICATE] "
-                        if packet_info['gap_flag']:
-                            flags_str += "[GAP] "
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] {flags_str}"
-                              f"Device {packet_info['device_id']} | Seq {packet_info['seq']} | "
-                              f"Type: {packet_info['msg_type']} | From {packet_info['addr'][0]}:{packet_info['addr'][1]}")
-                        if packet_info['payload']:
-                            print(f"          Payload: {packet_info['payload']}")
-                        if self.total_received > 0:
-                            loss_rate = (self.total_lost / (self.total_received + self.total_lost)) * 100
-                            print(f"[STATISTICS] Total Received: {self.total_received}, Total Lost: {self.total_lost}, Loss Rate: {loss_rate:.2f}%")
-                    
-                    # Check buffer every 3 seconds even while receiving
-                    if time.time() - last_buffer_check >= 3.0:
-                        self.process_buffer()
-                        last_buffer_check = time.time()
-                    
-                except socket.timeout:
-                    # No packet received in 5 seconds, check for offline devices
-                    self.check_device_timeout()
-                    self.process_buffer()  # Process buffered packets
-                    last_buffer_check = time.time()
+            if self.receive_mode == 'batched':
+                self.batched_receive_loop()
+            else:
+                self.receive_loop()
 
         except KeyboardInterrupt:
-            print("\n" + "-" * 80)
-            print("[SERVER] Shutting down...")
-            # Process any remaining buffered packets
-            self.buffer_timeout = 0  # Force process all
-            self.process_buffer()
+            # Shutdown has started: a repeated Ctrl+C must not cut the sink close short
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            log.info("-" * 80)
+            log.info("[SERVER] Shutting down...")
+            # Send held ACKs and process any remaining buffered packets
+            self.flush_acks(force=True)
+            self.process_buffer(force=True)
+            self.close_sink()
+            self.stop_monitor()
             self.print_statistics()
         except Exception as e:
-            print(f"[ERROR] Server error: {e}")
+            log.error(f"[ERROR] Server error: {e}")
         finally:
-            if self.csv_file:
-                self.csv_file.close()
+            self.close_metrics()
+            self.close_sink()
             if self.socket:
                 self.socket.close()
 
+    def get_kernel_drops(self):
+        """Datagrams dropped by the kernel on this socket (receive buffer full), or None if unavailable"""
+        stats = udp_socket_stats(self.socket) if self.socket else None
+        if stats:
+            self.kernel_drops = stats['drops']
+        return self.kernel_drops
+
+    def get_statistics(self):
+        """Snapshot of the counters behind print_statistics (plain dict, can be merged across shards)"""
+        stats = {
+            'devices': self.devices.rows(['packet_count', 'heartbeat_count', 'last_seq']),
+            'fleet': self.devices.fleet_stats()
+        }
+        stats.update(self.get_counters())
+        stats['rolling'] = self.rolling.snapshot(time.time())
+        stats['sink_latency'] = self.sink.latency.summary() if self.sink else {'count': 0}
+        stats['latency'] = self.latency_histograms()
+        stats['performance'] = self.performance_monitor.get_stats()
+        return stats
+
+    def get_counters(self):
+        """
+        The scalar counters of get_statistics(). Plain attribute reads with no
+        lock, so another thread (the metrics endpoint) may call this while
+        packets are being processed.
+        """
+        return {
+            'total_received': self.total_received,
+            'total_lost': self.total_lost,
+            'total_duplicates': self.total_duplicates,
+            'total_retransmits': self.total_retransmits,
+            'sequence_gap_count': self.sequence_gap_count,
+            'total_bytes_received': self.total_bytes_received,
+            'total_datagrams': self.total_datagrams,
+            'total_cpu_time_ms': self.processing_time_ms(),
+            'kernel_drops': self.get_kernel_drops(),
+            'total_batches': self.total_batches,
+            'total_batched_datagrams': self.total_batched_datagrams,
+            'total_ack_requests': self.total_ack_requests,
+            'total_acks_sent': self.total_acks_sent,
+            'devices_online': len(self.liveness),
+            'device_offline_events': self.liveness.offline_events,
+            'device_online_events': self.liveness.online_events,
+            'sink_rows_written': self.sink.rows_written if self.sink else 0,
+            'sink_write_errors': getattr(self.sink, 'write_errors', 0),
+            'sink_queue_depth': self.sink.queue_depth if self.sink else 0,
+            'sink_max_queue_depth': getattr(self.sink, 'max_queue_depth', 0),
+        }
+
     def print_statistics(self):
         """Print server statistics including Phase 2 metrics"""
+        stats = self.get_statistics()
+        self.print_report(stats)
+        if self.stats_json:
+            write_stats_json(stats, self.stats_json)
+
+    @staticmethod
+    def print_report(stats):
+        """Print a get_statistics() snapshot (also used for merged shard statistics)"""
+        flush_logging()  # Queued log lines first, so the report comes last
+        total_received = stats['total_received']
+        total_lost = stats['total_lost']
+        total_duplicates = stats['total_duplicates']
+        total_retransmits = stats['total_retransmits']
+        total_bytes_received = stats['total_bytes_received']
+        total_cpu_time_ms = stats['total_cpu_time_ms']
+
         print("\n" + "=" * 80)
         print("[FINAL STATISTICS]")
         print("=" * 80)
         
         # Per-device stats
         print("\n[Per-Device Statistics]")
-        for device_id, state in self.device_state.items():
+        for device_id, state in stats['devices'].items():
             print(f"  Device {device_id}: {state['packet_count']} packets received, "
                   f"{state['heartbeat_count']} heartbeats, last seq: {state['last_seq']}")
+        fleet = stats['fleet']
+        if fleet['devices']:
+            print(f"  Fleet: {fleet['devices']} devices, {fleet['packets']} packets "
+                  f"({fleet['min_packets']}-{fleet['max_packets']} per device), {fleet['heartbeats']} heartbeats")
         
         # Phase 2 Required Metrics
         # getting CPU and memory stats
-        perf_stats = self.performance_monitor.get_stats()
+        perf_stats = stats['performance']
         print("-" * 40)
         
-        # bytes_per_report: Average total bytes (payload + header) per reading
-        bytes_per_report = self.total_bytes_received / self.total_received if self.total_received > 0 else 0
-        print(f"  bytes_per_report:     {bytes_per_report:.2f} bytes")
+        metrics = phase2_metrics(stats)
+        print(f"  bytes_per_report:     {metrics['bytes_per_report']:.2f} bytes")
         
         # packets_received: Count of successfully received packets
-        print(f"  packets_received:     {self.total_received}")
+        print(f"  packets_received:     {total_received}")
         
-        # duplicate_rate: Fraction of duplicate messages detected
-        total_packets = self.total_received + self.total_duplicates
-        duplicate_rate = self.total_duplicates / total_packets if total_packets > 0 else 0
-        print(f"  duplicate_rate:       {duplicate_rate:.4f} ({self.total_duplicates} duplicates)")
-        
-        # retransmit_rate: Fraction of packets that were retransmissions
-        retransmit_rate = self.total_retransmits / total_packets if total_packets > 0 else 0
-        print(f"  retransmit_rate:      {retransmit_rate:.4f} ({self.total_retransmits} retransmits)")
-        
-        # sequence_gap_count: Number of missing sequences detected (gap events)
-        print(f"  sequence_gap_count:   {self.sequence_gap_count}")
-        print(f"  total_lost_packets:   {self.total_lost}")
-        
-        # cpu_ms_per_report: CPU time per reading processed
-        cpu_ms_per_report = self.total_cpu_time_ms / self.total_received if self.total_received > 0 else 0
-        print(f"  cpu_ms_per_report:    {cpu_ms_per_report:.4f} ms")
+        print(f"  duplicate_rate:       {metrics['duplicate_rate']:.4f} ({total_duplicates} duplicates)")
+        print(f"  retransmit_rate:      {metrics['retransmit_rate']:.4f} ({total_retransmits} retransmits)")
+        print(f"  sequence_gap_count:   {metrics['sequence_gap_count']}")
+        print(f"  total_lost_packets:   {total_lost}")
+        print(f"  cpu_ms_per_report:    {metrics['cpu_ms_per_report']:.4f} ms")
         
         # Additional useful metrics
         print("\n[Additional Metrics]")
         print("-" * 40)
-        loss_rate = (self.total_lost / (self.total_received + self.total_lost)) * 100 if (self.total_received + self.total_lost) > 0 else 0
-        print(f"  packet_loss_rate:     {loss_rate:.2f}%")
-        print(f"  total_bytes:          {self.total_bytes_received} bytes")
-        print(f"  total_cpu_time:       {self.total_cpu_time_ms:.2f} ms")
+        print(f"  packet_loss_rate:     {metrics['packet_loss_rate']:.2f}%")
+        print(f"  total_bytes:          {total_bytes_received} bytes")
+        print(f"  total_cpu_time:       {total_cpu_time_ms:.2f} ms")
+        kernel_drops = stats['kernel_drops']
+        print(f"  kernel_drops:         {kernel_drops if kernel_drops is not None else 'n/a'}")
+        if stats['total_batches'] > 0:
+            print(f"  avg_batch_size:       {stats['total_batched_datagrams'] / stats['total_batches']:.2f} datagrams/batch")
+        if stats['total_acks_sent'] > 0:
+            print(f"  acks_sent:            {stats['total_acks_sent']} for {stats['total_ack_requests']} packets "
+                  f"({stats['total_ack_requests'] / stats['total_acks_sent']:.2f} packets/ACK)")
+        print(f"  devices_online:       {stats['devices_online']} ({stats['device_offline_events']} went offline, "
+              f"{stats['device_online_events']} came back)")
+        print(f"  sink_rows_written:    {stats['sink_rows_written']}")
+        if stats['sink_write_errors']:
+            print(f"  sink_write_errors:    {stats['sink_write_errors']}")
+        print(f"  sink_queue_depth:     {stats['sink_queue_depth']} (max {stats['sink_max_queue_depth']})")
+
+        # Rolling windows: network health over the last seconds/minutes rather than since start
+        print("\n[Recent Windows]")
+        print("-" * 40)
+        for label, window in stats['rolling']['fleet'].items():
+            print(f"  last {label:<4} {window['received']:>9} readings  {window['lost']:>7} lost "
+                  f"({window['loss_rate']:.2f}%)  {window['duplicates']:>7} duplicates ({window['duplicate_rate']:.4f})")
+
+        # Latency histograms: process.<type> is process_packet per message type, sink is ingest to sink
+        print("\n[Latency Percentiles]")
+        print("-" * 40)
+        for name, histogram in sorted(stats['latency'].items()):
+            summary = LatencyHistogram.from_dict(histogram).summary()
+            if summary['count']:
+                print(f"  {format_summary_line(name, summary)}")
         print("=" * 80)
         print("[PERFORMANCE]")
         print(f"  CPU Usage:     {perf_stats['cpu_percent']:.2f}%")
         print(f"  Memory Usage:  {perf_stats['memory_mb']:.2f} MB")
         print(f"  CPU Time:      {perf_stats['cpu_time_ms']:.2f} ms")
+        if perf_stats.get('series'):
+            print(f"  Sampled every {perf_stats['sample_interval_s']}s ({perf_stats['samples']} samples):")
+            for column, values in perf_stats['series'].items():
+                print(f"    {column:<20} min {values['min']:>10.2f}  avg {values['avg']:>10.2f}  "
+                      f"p95 {values['p95']:>10.2f}  p99 {values['p99']:>10.2f}  max {values['max']:>10.2f}")
+
+def phase2_metrics(stats):
+    """Phase 2 metrics derived from the counters of a get_statistics() snapshot"""
+    total_received = stats['total_received']
+    total_packets = total_received + stats['total_duplicates']
+    return {
+        # bytes_per_report: Average total bytes (payload + header) per reading
+        'bytes_per_report': stats['total_bytes_received'] / total_received if total_received > 0 else 0,
+        # duplicate_rate: Fraction of duplicate messages detected
+        'duplicate_rate': duplicate_rate(total_received, stats['total_duplicates']),
+        # retransmit_rate: Fraction of packets that were retransmissions
+        'retransmit_rate': stats['total_retransmits'] / total_packets if total_packets > 0 else 0,
+        # sequence_gap_count: Number of missing sequences detected (gap events)
+        'sequence_gap_count': stats['sequence_gap_count'],
+        # cpu_ms_per_report: CPU time per reading processed
+        'cpu_ms_per_report': stats['total_cpu_time_ms'] / total_received if total_received > 0 else 0,
+        # packet_loss_rate: Percentage of readings lost
+        'packet_loss_rate': loss_rate(total_received, stats['total_lost']),
+    }
+
+
+def write_stats_json(stats, path):
+    """Save a get_statistics() snapshot as JSON (read back by tests/benchmark.py)"""
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2, default=str)
+    log.info(f"[SERVER] Statistics written to: {path}")
+
 
 def main():
     """Main entry point"""
     # Use 0.0.0.0 to listen on all interfaces (needed for cross-platform)
-    host = '0.0.0.0'
-    port = 5000
+    parser = argparse.ArgumentParser(description='TinyTelemetry collector')
+    parser.add_argument('port', nargs='?', type=int, default=5000)
+    parser.add_argument('host', nargs='?', default='0.0.0.0', help='Optional: specify host')
+    parser.add_argument('--engine', choices=['blocking', 'asyncio'], default='blocking',
+                        help='blocking: socket receive loop; asyncio: DatagramProtocol with timer tasks (single process only)')
+    parser.add_argument('--recv-mode', choices=['blocking', 'batched'], default='blocking',
+                        help='blocking: one recvfrom per loop; batched: drain the socket into preallocated buffers (blocking engine only)')
+    parser.add_argument('--recv-batch', type=int, default=64,
+                        help='Max datagrams drained per batch (batched mode)')
+    parser.add_argument('--rcvbuf', type=int, default=None,
+                        help='Socket receive buffer size (SO_RCVBUF) in bytes')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of collector processes sharing the port via SO_REUSEPORT (Linux)')
+    parser.add_argument('--shard-output', choices=['per-shard', 'merged'], default='per-shard',
+                        help='per-shard: one CSV per worker; merged: workers stream rows into one CSV')
+    parser.add_argument('--sink', choices=['csv', 'queued-csv', 'columnar'], default='queued-csv',
+                        help='csv: write rows on the receive path; queued-csv: hand rows to a writer thread; '
+                             'columnar: typed .npy/Parquet chunks in rotated segment files (writer thread)')
+    parser.add_argument('--sink-flush-rows', type=int, default=None,
+                        help='Queued sink: write out after this many rows (default 1000, columnar 4096)')
+    parser.add_argument('--sink-flush-bytes', type=int, default=None,
+                        help='Queued sink: write out after this many buffered bytes (default 256 KB, columnar 1 MB)')
+    parser.add_argument('--sink-flush-interval', type=float, default=1.0,
+                        help='Queued sink: write out at least every this many seconds')
+    parser.add_argument('--columnar-format', choices=['auto', 'npy', 'parquet'], default='auto',
+                        help='Columnar sink chunk format (auto: Parquet if pyarrow is installed, else .npy)')
+    parser.add_argument('--segment-mb', type=float, default=64,
+                        help='Columnar sink: start a new segment file after this many MB')
+    parser.add_argument('--segment-seconds', type=float, default=3600,
+                        help='Columnar sink: start a new segment file after this many seconds')
+    parser.add_argument('--ack-mode', choices=['sack', 'immediate'], default='sack',
+                        help='sack: coalesced cumulative/selective ACKs for sensors that support them; '
+                             'immediate: one ACK per DATA/BATCH packet')
+    parser.add_argument('--ack-delay', type=float, default=0.01,
+                        help='Seconds an ACK is held to cover more packets of the same device '
+                             f'(sack mode, at most {MAX_ACK_DELAY})')
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'debug', 'info', 'warning', 'error'],
+                        help='INFO: sampled per-packet lines and summaries; WARNING: summaries off, errors only')
+    parser.add_argument('--log-file', default=LOG_FILE,
+                        help='Write log lines to this file instead of stdout')
+    parser.add_argument('--log-sample', type=int, default=LOG_SAMPLE,
+                        help='Log 1 in N packets (0 = no per-packet lines)')
+    parser.add_argument('--summary-interval', type=float, default=LOG_SUMMARY_INTERVAL,
+                        help='Seconds between aggregated [STATISTICS] lines')
+    parser.add_argument('--device-timeout', type=float, default=30.0,
+                        help='Seconds without a packet before a device is marked offline')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve live metrics in Prometheus text format on this port (workers use port + index)')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='Address of the metrics endpoint (default: local only)')
+    parser.add_argument('--monitor-interval', type=float, default=None,
+                        help='Sample CPU, RSS, context switches, fds and socket queue every N seconds in the background '
+                             '(summarized at exit, series saved as <telemetry output>_perf.csv)')
+    parser.add_argument('--stats-json', default=None,
+                        help='Also write the final statistics to this JSON file (used by tests/benchmark.py)')
+    args = parser.parse_args()
+    if not 0 <= args.ack_delay <= MAX_ACK_DELAY:
+        parser.error(f'--ack-delay must be between 0 and {MAX_ACK_DELAY} s (sensors keep their RTO above it)')
+    setup_logging(args.log_level, args.log_file)
+
+    sink_options = {}
+    if args.sink != 'csv':
+        sink_options['flush_interval'] = args.sink_flush_interval
+        if args.sink_flush_rows is not None:
+            sink_options['flush_rows'] = args.sink_flush_rows
+        if args.sink_flush_bytes is not None:
+            sink_options['flush_bytes'] = args.sink_flush_bytes
+    if args.sink == 'columnar':
+        sink_options['format'] = args.columnar_format
+        sink_options['segment_bytes'] = int(args.segment_mb * 1024 * 1024)
+        sink_options['segment_seconds'] = args.segment_seconds
 
-    if len(sys.argv) > 1:
-        port = int(sys.argv[1])
-    if len(sys.argv) > 2:
-        host = sys.argv[2]  # Optional: specify host
+    if args.workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            parser.error('--workers needs SO_REUSEPORT, which this platform does not support')
+        if args.engine != 'blocking':
+            parser.error(f'--engine {args.engine} is not supported with --workers > 1 (shards use the blocking engine)')
+        from sharded_server import run_sharded
+        run_sharded(args.host, args.port, args.workers,
+                    shard_output=args.shard_output,
+                    receive_mode=args.recv_mode,
+                    recv_batch_size=args.recv_batch,
+                    rcvbuf_size=args.rcvbuf,
+                    sink_kind=args.sink,
+                    sink_options=sink_options,
+                    logging_config={'level': args.log_level, 'log_file': args.log_file},
+                    log_sample_every=args.log_sample,
+                    summary_interval=args.summary_interval,
+                    ack_mode=args.ack_mode,
+                    ack_delay=args.ack_delay,
+                    stats_json=args.stats_json,
+                    metrics_host=args.metrics_host,
+                    metrics_port=args.metrics_port,
+                    monitor_interval=args.monitor_interval,
+                    device_timeout=args.device_timeout)
+        shutdown_logging()
+        return
 
-    collector = TelemetryCollector(host, port)
+    if args.engine == 'asyncio':
+        from async_server import AsyncTelemetryCollector
+        collector = AsyncTelemetryCollector(args.host, args.port)
+    else:
+        collector = TelemetryCollector(args.host, args.port)
+        collector.receive_mode = args.recv_mode
+    collector.recv_batch_size = args.recv_batch
+    collector.rcvbuf_size = args.rcvbuf
+    collector.sink_kind = args.sink
+    collector.sink_options = sink_options
+    collector.log_sample_every = args.log_sample
+    collector.summary_interval = args.summary_interval
+    collector.ack_mode = args.ack_mode
+    collector.ack_delay = args.ack_delay
+    collector.stats_json = args.stats_json
+    collector.metrics_host = args.metrics_host
+    collector.metrics_port = args.metrics_port
+    collector.monitor_interval = args.monitor_interval
+    collector.liveness.timeout = args.device_timeout
     collector.run()
+    shutdown_logging()
 
 if __name__ == '__main__':
     main()
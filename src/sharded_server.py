@@ -0,0 +1,339 @@
+import ctypes
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+from server import TelemetryCollector, log, write_stats_json
+from telemetry_log import setup_logging, flush_logging
+from sinks import create_sink
+from histogram import HistogramSet
+from device_table import merge_fleet_stats
+from rolling_stats import merge_rolling
+
+# Linux socket option for attaching a classic BPF program to a SO_REUSEPORT group
+SO_ATTACH_REUSEPORT_CBPF = 51
+
+# Classic BPF opcodes used by the shard steering program
+BPF_LD_H_ABS = 0x28   # A = 16-bit word at absolute offset k (UDP payload)
+BPF_ALU_MOD_K = 0x94  # A = A % k
+BPF_RET_A = 0x16      # return A (index of the socket in the reuseport group)
+
+DEVICE_ID_OFFSET = 1  # device_id follows the version/type byte in the header
+
+ROW_BATCH_SIZE = 256      # Rows per queue message in merged output mode
+ROW_BATCH_INTERVAL = 0.5  # Max seconds a worker holds rows before sending them
+
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_ushort), ('jt', ctypes.c_ubyte), ('jf', ctypes.c_ubyte), ('k', ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort), ('filter', ctypes.POINTER(_SockFilter))]
+
+
+def attach_device_steering(sock, num_workers):
+    """
+    Attach 'return device_id % num_workers' to the reuseport group of sock, so
+    every datagram of a device lands on the same worker regardless of its
+    source address. Returns False when the kernel does not support it.
+    """
+    program = (_SockFilter * 3)(
+        _SockFilter(BPF_LD_H_ABS, 0, 0, DEVICE_ID_OFFSET),
+        _SockFilter(BPF_ALU_MOD_K, 0, 0, num_workers),
+        _SockFilter(BPF_RET_A, 0, 0, 0),
+    )
+    fprog = _SockFprog(len(program), program)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, bytes(fprog))
+    except OSError:
+        return False
+    return True
+
+
+def create_shard_sockets(host, port, num_workers, rcvbuf_size=None):
+    """
+    Bind num_workers UDP sockets to the same port with SO_REUSEPORT.
+    Sockets join the reuseport group in list order, which is the index the
+    steering program returns, so socket i must be served by worker i.
+    Returns (sockets, steering) where steering describes how devices are mapped.
+    """
+    sockets = []
+    for _ in range(num_workers):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if rcvbuf_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf_size)
+        sock.bind((host, port))
+        sockets.append(sock)
+
+    if attach_device_steering(sockets[0], num_workers):
+        steering = f"device_id % {num_workers} (reuseport BPF)"
+    else:
+        # Kernel hashes on the source address: consistent per sensor socket, not across restarts
+        steering = "source address hash (kernel default)"
+    return sockets, steering
+
+
+class ShardCollector(TelemetryCollector):
+    """TelemetryCollector running as one worker of a sharded collector"""
+
+    def __init__(self, worker_index, shard_socket, stats_queue, row_queue=None, csv_filename=None):
+        host, port = shard_socket.getsockname()
+        super().__init__(host, port)
+        self.worker_index = worker_index
+        self.shard_socket = shard_socket
+        self.stats_queue = stats_queue
+        self.row_queue = row_queue          # Set in merged output mode
+        self.csv_filename = csv_filename    # Set in per-shard output mode
+        self.pending_rows = []
+        self.last_row_send = time.time()
+
+    def open_socket(self):
+        """Use the socket bound by the launcher"""
+        self.socket = self.shard_socket
+
+    def open_sink(self, csv_filename=None):
+        """Per-shard CSV file, or nothing in merged mode (rows go to the launcher)"""
+        if self.row_queue is None:
+            super().open_sink(self.csv_filename)
+
+    def write_row(self, row):
+        """Append one row to this shard's CSV, or queue it for the merged CSV"""
+        if self.row_queue is None:
+            super().write_row(row)
+            return
+        self.pending_rows.append(row)
+        if len(self.pending_rows) >= ROW_BATCH_SIZE or time.time() - self.last_row_send >= ROW_BATCH_INTERVAL:
+            self.send_rows()
+
+    def flush_rows(self):
+        """Flush rows (per-shard mode) - merged mode batches rows in write_row instead"""
+        if self.row_queue is None:
+            super().flush_rows()
+
+    def send_rows(self):
+        """Hand pending rows to the launcher's merged writer"""
+        if self.pending_rows:
+            self.row_queue.put(self.pending_rows)
+            self.pending_rows = []
+        self.last_row_send = time.time()
+
+    def performance_series_path(self):
+        """Next to this shard's CSV (merged mode included: workers have no sink there)"""
+        return f"{os.path.splitext(self.csv_filename)[0]}_perf.csv"
+
+    def print_statistics(self):
+        """Report statistics to the launcher, which prints the merged report"""
+        if self.row_queue is not None:
+            self.send_rows()
+        stats = self.get_statistics()
+        stats['worker_index'] = self.worker_index
+        self.stats_queue.put(stats)
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_shard(worker_index, shard_socket, config, stats_queue, row_queue, csv_filename):
+    """Worker process entry point"""
+    # The launcher owns Ctrl+C and asks workers to stop with SIGTERM, so a
+    # terminal SIGINT does not interrupt a worker that is already shutting down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)  # Until the collector installs its latency report
+    # The log listener thread does not survive fork(): start this worker's own
+    setup_logging(**config['logging'])
+
+    collector = ShardCollector(worker_index, shard_socket, stats_queue, row_queue, csv_filename)
+    collector.receive_mode = config['receive_mode']
+    collector.recv_batch_size = config['recv_batch_size']
+    collector.sink_kind = config['sink_kind']
+    collector.sink_options = config['sink_options']
+    collector.log_sample_every = config['log_sample_every']
+    collector.summary_interval = config['summary_interval']
+    collector.ack_mode = config['ack_mode']
+    collector.ack_delay = config['ack_delay']
+    collector.monitor_interval = config['monitor_interval']
+    collector.liveness.timeout = config['device_timeout']
+    if config['metrics_port'] is not None:
+        collector.metrics_host = config['metrics_host']
+        collector.metrics_port = config['metrics_port'] + worker_index
+        collector.metrics_labels = {'shard': worker_index}
+    collector.run()
+
+
+def merged_writer_thread(row_queue, sink):
+    """Write rows from all workers into a single sink until a None sentinel arrives"""
+    while True:
+        rows = row_queue.get()
+        if rows is None:
+            break
+        sink.write_rows(rows)
+        sink.flush()
+    sink.close()
+
+
+def merge_statistics(stats_list):
+    """Combine per-worker get_statistics() snapshots into one report"""
+    merged = {
+        'devices': {},
+        'total_received': 0,
+        'total_lost': 0,
+        'total_duplicates': 0,
+        'total_retransmits': 0,
+        'sequence_gap_count': 0,
+        'total_bytes_received': 0,
+        'total_datagrams': 0,
+        'total_cpu_time_ms': 0,
+        'kernel_drops': None,
+        'total_batches': 0,
+        'total_batched_datagrams': 0,
+        'total_ack_requests': 0,
+        'total_acks_sent': 0,
+        'devices_online': 0,
+        'device_offline_events': 0,
+        'device_online_events': 0,
+        'sink_rows_written': 0,
+        'sink_write_errors': 0,
+        'sink_queue_depth': 0,
+        'sink_max_queue_depth': 0,
+        'sink_latency': {'count': 0},
+        'latency': {},
+        'performance': {'cpu_percent': 0.0, 'memory_mb': 0.0, 'cpu_time_ms': 0.0, 'elapsed_s': 0.0}
+    }
+    latency = HistogramSet()
+    for stats in stats_list:
+        merged['devices'].update(stats['devices'])
+        for key in ('total_received', 'total_lost', 'total_duplicates', 'total_retransmits',
+                    'sequence_gap_count', 'total_bytes_received', 'total_datagrams', 'total_cpu_time_ms',
+                    'total_batches', 'total_batched_datagrams', 'total_ack_requests', 'total_acks_sent',
+                    'devices_online', 'device_offline_events', 'device_online_events',
+                    'sink_rows_written', 'sink_write_errors', 'sink_queue_depth'):
+            merged[key] += stats[key]
+        merged['sink_max_queue_depth'] = max(merged['sink_max_queue_depth'], stats['sink_max_queue_depth'])
+        # Histograms merge exactly: the percentiles are those of all shards' samples together
+        latency.merge_dicts(stats['latency'])
+        if stats['kernel_drops'] is not None:
+            merged['kernel_drops'] = (merged['kernel_drops'] or 0) + stats['kernel_drops']
+        for key in ('cpu_percent', 'memory_mb', 'cpu_time_ms'):
+            merged['performance'][key] += stats['performance'][key]
+        merged['performance']['elapsed_s'] = max(merged['performance']['elapsed_s'],
+                                                 stats['performance']['elapsed_s'])
+    merged['devices'] = dict(sorted(merged['devices'].items()))
+    merged['fleet'] = merge_fleet_stats(stats['fleet'] for stats in stats_list)
+    merged['rolling'] = merge_rolling(stats['rolling'] for stats in stats_list)
+    merged['latency'] = latency.to_dicts()
+    if 'sink' in merged['latency']:
+        merged['sink_latency'] = latency.get('sink').summary()
+    return merged
+
+
+def run_sharded(host, port, num_workers, shard_output='per-shard', receive_mode='blocking',
+                recv_batch_size=64, rcvbuf_size=None, sink_kind='queued-csv', sink_options=None,
+                logging_config=None, log_sample_every=1, summary_interval=5.0, ack_mode='sack', ack_delay=0.01,
+                stats_json=None, metrics_host='127.0.0.1', metrics_port=None, monitor_interval=None,
+                device_timeout=30.0):
+    """Launch num_workers collector processes on one port and print merged statistics on Ctrl+C"""
+    # Workers inherit the bound sockets, so they must be forked
+    ctx = multiprocessing.get_context('fork')
+    sockets, steering = create_shard_sockets(host, port, num_workers, rcvbuf_size)
+    stats_queue = ctx.Queue()
+    row_queue = ctx.Queue() if shard_output == 'merged' else None
+    config = {'receive_mode': receive_mode, 'recv_batch_size': recv_batch_size,
+              'sink_kind': sink_kind, 'sink_options': sink_options or {},
+              'logging': logging_config or {}, 'log_sample_every': log_sample_every,
+              'summary_interval': summary_interval, 'ack_mode': ack_mode, 'ack_delay': ack_delay,
+              'metrics_host': metrics_host, 'metrics_port': metrics_port, 'monitor_interval': monitor_interval,
+              'device_timeout': device_timeout}
+
+    run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    writer = None
+    if row_queue is not None:
+        # Rows already arrive in batches on a thread of their own, so a synchronous CSV sink is enough here
+        merged_kind = 'columnar' if sink_kind == 'columnar' else 'csv'
+        merged_options = sink_options if merged_kind == 'columnar' else {}
+        merged_sink = create_sink(merged_kind, f"telemetry_{run_stamp}.csv", **(merged_options or {}))
+        writer = threading.Thread(target=merged_writer_thread, args=(row_queue, merged_sink), daemon=True)
+        writer.start()
+
+    log.info(f"[SERVER] TinyTelemetry sharded collector: {num_workers} workers on {host}:{port}")
+    log.info(f"[SERVER] Device steering: {steering}")
+    log.info(f"[SERVER] Sink output: {shard_output}")
+    if metrics_port is not None:
+        log.info(f"[SERVER] Metrics: one endpoint per worker on {metrics_host}, "
+                 f"ports {metrics_port}-{metrics_port + num_workers - 1} (label shard=\"i\")")
+
+    workers = []
+    for index, sock in enumerate(sockets):
+        csv_filename = f"telemetry_{run_stamp}_shard{index}.csv"
+        process = ctx.Process(target=run_shard, name=f"collector-shard-{index}",
+                              args=(index, sock, config, stats_queue, row_queue, csv_filename))
+        process.start()
+        workers.append(process)
+    # Workers hold their own references; the launcher only keeps the group alive through them
+    for sock in sockets:
+        sock.close()
+
+    if hasattr(signal, 'SIGUSR1'):
+        # Latency percentiles on demand: each worker logs its own
+        def forward_latency_signal(signum, frame):
+            for process in workers:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGUSR1)
+        signal.signal(signal.SIGUSR1, forward_latency_signal)
+        log.info(f"[SERVER] Latency percentiles on demand: kill -USR1 {os.getpid()}")
+
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    # Shutdown has started: a repeated Ctrl+C must not cut the statistics collection short
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    log.info("-" * 80)
+    log.info(f"[SERVER] Stopping {num_workers} workers...")
+    for process in workers:
+        if process.is_alive():
+            process.terminate()
+
+    stats_list = []
+    for _ in workers:
+        try:
+            stats_list.append(stats_queue.get(timeout=10))
+        except queue.Empty:
+            break
+    for process in workers:
+        process.join(timeout=5)
+
+    if writer is not None:
+        row_queue.put(None)
+        writer.join(timeout=10)
+        log.info(f"[SERVER] Merged output written to: {merged_sink.filename} ({merged_sink.rows_written} rows)")
+
+    flush_logging()
+
+    for stats in sorted(stats_list, key=lambda s: s['worker_index']):
+        print(f"[SHARD {stats['worker_index']}] {len(stats['devices'])} devices, "
+              f"{stats['total_received']} received, {stats['total_lost']} lost, "
+              f"{stats['total_cpu_time_ms']:.2f} ms CPU")
+    if len(stats_list) < num_workers:
+        print(f"[WARNING] Only {len(stats_list)} of {num_workers} workers reported statistics")
+
+    merged = merge_statistics(stats_list)
+    if writer is not None:
+        # Rows are written by the launcher, not the workers
+        merged['sink_rows_written'] = merged_sink.rows_written
+        merged['sink_write_errors'] = getattr(merged_sink, 'write_errors', 0)
+        merged['sink_latency'] = merged_sink.latency.summary()
+        merged['latency']['sink'] = merged_sink.latency.to_dict()
+    TelemetryCollector.print_report(merged)
+    if stats_json:
+        write_stats_json(merged, stats_json)
@@ -0,0 +1,402 @@
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from telemetry_log import get_logger
+from histogram import LatencyHistogram
+
+log = get_logger('sinks')
+
+# Columns written by every telemetry sink. Rows are passed as lists in this
+# order, with the timestamp as a Unix epoch (float); sinks format it. A row
+# may carry one more element, the time the collector received it, when that
+# is not its timestamp (BATCH_DATA rows keep the sensor's header timestamp);
+# it is only used for the ingest-to-sink latency and is not written.
+CSV_COLUMNS = ['timestamp', 'device_id', 'seq_num', 'msg_type', 'temperature', 'humidity',
+               'duplicate_flag', 'gap_flag', 'retransmit_flag', 'packet_bytes']
+INGEST_TIME = len(CSV_COLUMNS)  # Index of the optional ingest time in a row
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def format_row(row):
+    """Convert a sink row to its CSV form (epoch timestamp -> 'YYYY-MM-DD HH:MM:SS')"""
+    return [datetime.fromtimestamp(row[0]).strftime(TIMESTAMP_FORMAT)] + list(row[1:INGEST_TIME])
+
+
+def ingest_time(row):
+    """When the collector received a row: its ingest time if it carries one, else its timestamp"""
+    return row[INGEST_TIME] if len(row) > INGEST_TIME else row[0]
+
+
+class CsvSink:
+    """Writes rows to the telemetry CSV on the caller's thread"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(CSV_COLUMNS)
+        self.file.flush()
+        self.rows_written = 0
+        self.latency = LatencyHistogram()  # Ingest-to-sink latency of written rows
+
+    @property
+    def queue_depth(self):
+        """Rows accepted but not yet written (always 0 for a synchronous sink)"""
+        return 0
+
+    def write(self, row):
+        """Write one row"""
+        self.writer.writerow(format_row(row))
+        self.rows_written += 1
+        self.latency.record_seconds(time.time() - ingest_time(row))
+
+    def write_rows(self, rows):
+        """Write several rows"""
+        self.writer.writerows([format_row(row) for row in rows])
+        self.rows_written += len(rows)
+        self.latency.record_since([ingest_time(row) for row in rows], time.time())
+
+    def flush(self):
+        """Push written rows to the OS"""
+        self.file.flush()
+
+    def close(self):
+        """Flush and fsync the file so every accepted row is on disk"""
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def describe(self):
+        return f"csv ({self.filename})"
+
+
+class QueuedSink:
+    """
+    Base for sinks that take rows over a queue and write them on a dedicated thread.
+
+    The receive path only pays for a queue put. The writer thread buffers rows
+    and hands them to write_buffered() when any flush threshold is reached:
+    flush_rows rows, flush_bytes buffered bytes, or flush_interval seconds since
+    the last write. close() drains the queue and lets the subclass finish its
+    file (flush + fsync), so every accepted row is on disk afterwards.
+
+    A failed write keeps its rows buffered and is retried once per
+    flush_interval; rows only count as written once a write succeeds.
+    write_errors counts the failures, and close() logs the rows that were
+    still unwritten at shutdown.
+
+    Subclasses implement buffer_row(), buffered_bytes(), write_buffered() and finish().
+    """
+
+    _STOP = object()  # Sentinel telling the writer thread to finish
+
+    def __init__(self, flush_rows=1000, flush_bytes=256 * 1024, flush_interval=1.0, max_queue=100000):
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)  # Bounded: a stalled disk back-pressures the receiver
+        self.rows_written = 0
+        self.flush_count = 0
+        self.max_queue_depth = 0
+        self.latency = LatencyHistogram()  # Ingest-to-sink latency of written rows
+        self.write_errors = 0
+        self.error = None  # Last write error
+        self.unwritten_rows = 0  # Rows still buffered when the writer thread stopped
+        self.closed = False
+        self.thread = threading.Thread(target=self.writer_thread, name=f"{type(self).__name__}-writer", daemon=True)
+
+    @property
+    def queue_depth(self):
+        """Rows accepted but not yet written"""
+        return self.queue.qsize()
+
+    def write(self, row):
+        """Queue one row for the writer thread"""
+        self.queue.put(row)
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def write_rows(self, rows):
+        """Queue several rows"""
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        """No-op: the writer thread flushes according to the configured policy"""
+        pass
+
+    def writer_thread(self):
+        """Drain the queue, writing in batches according to the flush policy"""
+        pending_rows = 0
+        arrivals = []  # Ingest times of the buffered rows, for latency once they are written
+        last_flush = time.time()
+        failing = False  # Last write failed: retry on the interval only, not on every row
+        stopping = False
+        while not stopping:
+            timeout = max(0.0, last_flush + self.flush_interval - time.time())
+            try:
+                row = self.queue.get(timeout=timeout)
+                if row is self._STOP:
+                    stopping = True
+                else:
+                    self.buffer_row(row)
+                    arrivals.append(ingest_time(row))
+                    pending_rows += 1
+            except queue.Empty:
+                pass
+
+            if (stopping or time.time() - last_flush >= self.flush_interval
+                    or (not failing and (pending_rows >= self.flush_rows
+                                         or self.buffered_bytes() >= self.flush_bytes))):
+                if pending_rows:
+                    try:
+                        self.write_buffered()
+                    except Exception as e:
+                        # The rows stay buffered for the next attempt
+                        self.write_errors += 1
+                        self.error = e
+                        failing = True
+                        log.error(f"[ERROR] {type(self).__name__} write failed ({pending_rows} rows buffered): {e}")
+                    else:
+                        failing = False
+                        self.rows_written += pending_rows
+                        self.flush_count += 1
+                        self.latency.record_since(arrivals, time.time())
+                        arrivals.clear()
+                        pending_rows = 0
+                last_flush = time.time()
+        self.unwritten_rows = pending_rows
+
+    def close(self):
+        """Write every queued row, then finish the output (durable on shutdown)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.finish()
+        if self.unwritten_rows:
+            log.error(f"[ERROR] {type(self).__name__} closed with {self.unwritten_rows} rows not written "
+                      f"({self.write_errors} failed writes, last: {self.error})")
+
+
+class QueuedCsvSink(QueuedSink):
+    """CSV sink written by a writer thread through a large buffer"""
+
+    def __init__(self, filename, buffer_size=1024 * 1024, **policy):
+        super().__init__(**policy)
+        self.filename = filename
+        self.file = open(filename, 'w', newline='', buffering=buffer_size)
+        csv.writer(self.file).writerow(CSV_COLUMNS)
+        self.file.flush()
+        self.pending = io.StringIO()
+        self.pending_writer = csv.writer(self.pending)
+        self.thread.start()
+
+    def buffer_row(self, row):
+        self.pending_writer.writerow(format_row(row))
+
+    def buffered_bytes(self):
+        return self.pending.tell()
+
+    def write_buffered(self):
+        self.file.write(self.pending.getvalue())
+        self.file.flush()
+        self.pending.seek(0)
+        self.pending.truncate()
+
+    def finish(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def describe(self):
+        return (f"queued csv ({self.filename}; flush every {self.flush_rows} rows / "
+                f"{self.flush_bytes} bytes / {self.flush_interval}s)")
+
+
+# Typed layout of the columnar sink. msg_type is stored as an index into
+# COLUMNAR_MSG_TYPES, missing readings as NaN.
+COLUMNAR_MSG_TYPES = ('', 'DATA', 'BATCH_DATA', 'INIT', 'HEARTBEAT', 'BATCH')
+COLUMNAR_DTYPE = [
+    ('timestamp', '<f8'), ('device_id', '<u2'), ('seq_num', '<u2'), ('msg_type', 'u1'),
+    ('temperature', '<f4'), ('humidity', '<f4'), ('duplicate_flag', 'u1'), ('gap_flag', 'u1'),
+    ('retransmit_flag', 'u1'), ('packet_bytes', '<u2'),
+]
+_MSG_TYPE_CODES = {name: code for code, name in enumerate(COLUMNAR_MSG_TYPES)}
+
+
+def _float_or_nan(value):
+    return float('nan') if value is None or value == '' else value
+
+
+class ColumnarSink(QueuedSink):
+    """
+    Writes rows as typed columnar chunks into rotated segment files under a directory.
+
+    Each flush becomes one chunk: a NumPy structured array appended to the
+    current segment with np.save (segment_NNNNN.npy holds several consecutive
+    arrays), or a row group of segment_NNNNN.parquet when pyarrow is installed
+    and format is 'parquet' (or 'auto'). A new segment is started once the
+    current one reaches segment_bytes or is segment_seconds old.
+    Read segments back with read_columnar() / load_telemetry().
+    """
+
+    def __init__(self, directory, format='auto', segment_bytes=64 * 1024 * 1024, segment_seconds=3600,
+                 flush_rows=4096, flush_bytes=1024 * 1024, flush_interval=1.0, max_queue=100000):
+        super().__init__(flush_rows, flush_bytes, flush_interval, max_queue)
+        try:
+            import numpy  # Only needed by this sink
+        except ImportError:
+            raise RuntimeError("columnar sink needs numpy (pip install numpy)")
+        self.np = numpy
+        if format == 'auto':
+            format = 'parquet' if _pyarrow() else 'npy'
+        elif format == 'parquet' and not _pyarrow():
+            raise RuntimeError("columnar format 'parquet' needs pyarrow (pip install pyarrow)")
+        self.format = format
+        self.filename = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.dtype = numpy.dtype(COLUMNAR_DTYPE)
+        self.pending = []
+        self.segment_index = -1
+        self.segment_file = None
+        self.segment_writer = None  # ParquetWriter in parquet format
+        self.segment_started = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self.open_segment()
+        self.thread.start()
+
+    def open_segment(self):
+        """Close the current segment (if any) and start the next one"""
+        self.close_segment()
+        self.segment_index += 1
+        path = os.path.join(self.filename, f"segment_{self.segment_index:05d}.{self.format}")
+        self.segment_file = open(path, 'wb')
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self.segment_writer = pq.ParquetWriter(self.segment_file, _arrow_schema(self.dtype))
+        self.segment_started = time.time()
+
+    def close_segment(self):
+        if self.segment_file is None:
+            return
+        if self.segment_writer is not None:
+            self.segment_writer.close()
+            self.segment_writer = None
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        self.segment_file.close()
+        self.segment_file = None
+
+    def buffer_row(self, row):
+        self.pending.append((
+            row[0], row[1], row[2], _MSG_TYPE_CODES.get(row[3], 0),
+            _float_or_nan(row[4]), _float_or_nan(row[5]), row[6], row[7], row[8], row[9]
+        ))
+
+    def buffered_bytes(self):
+        return len(self.pending) * self.dtype.itemsize
+
+    def write_buffered(self):
+        chunk = self.np.array(self.pending, dtype=self.dtype)
+        if (self.segment_file.tell() >= self.segment_bytes
+                or time.time() - self.segment_started >= self.segment_seconds):
+            self.open_segment()
+        if self.segment_writer is not None:
+            import pyarrow as pa
+            self.segment_writer.write_table(pa.table({name: chunk[name] for name in chunk.dtype.names}))
+        else:
+            self.np.save(self.segment_file, chunk, allow_pickle=False)
+        self.segment_file.flush()
+        self.pending = []  # Only once written: a failed write is retried with the same rows
+
+    def finish(self):
+        self.close_segment()
+
+    def describe(self):
+        return (f"columnar {self.format} ({self.filename}/; {self.flush_rows} rows per chunk, "
+                f"segments of {self.segment_bytes} bytes / {self.segment_seconds}s)")
+
+
+def _pyarrow():
+    """True if pyarrow (Parquet support) is importable"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _arrow_schema(dtype):
+    import pyarrow as pa
+    return pa.schema([(name, pa.from_numpy_dtype(dtype[name])) for name in dtype.names])
+
+
+def columnar_segments(path):
+    """Segment files of a columnar sink directory in write order (or [path] for a single segment)"""
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.startswith('segment_'))
+    return [path]
+
+
+def read_columnar(path):
+    """
+    Load a columnar sink directory (or a single segment file) into a pandas DataFrame
+    with the CSV columns. timestamp becomes a naive local-time datetime (the time
+    the CSV sink writes, see format_row()), msg_type a string.
+    """
+    import numpy as np
+    import pandas as pd
+    from dateutil.tz import tzlocal  # Installed with pandas
+
+    frames = []
+    for segment in columnar_segments(path):
+        if segment.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            frames.append(pq.read_table(segment).to_pandas())
+            continue
+        chunks = []
+        size = os.path.getsize(segment)
+        with open(segment, 'rb') as f:
+            while f.tell() < size:
+                chunks.append(np.load(f, allow_pickle=False))
+        if chunks:
+            frames.append(pd.DataFrame(np.concatenate(chunks)))
+    if not frames:
+        return pd.DataFrame({name: pd.Series(dtype=dt) for name, dt in COLUMNAR_DTYPE})
+
+    df = pd.concat(frames, ignore_index=True)
+    timestamps = pd.to_datetime(df['timestamp'], unit='s', utc=True)
+    df['timestamp'] = timestamps.dt.tz_convert(tzlocal()).dt.tz_localize(None)
+    df['msg_type'] = pd.Categorical.from_codes(df['msg_type'], COLUMNAR_MSG_TYPES).astype(str)
+    for column in ('device_id', 'seq_num', 'packet_bytes'):
+        df[column] = df[column].astype('int64')
+    return df
+
+
+def load_telemetry(path):
+    """Load collector output into pandas: a telemetry CSV or a columnar sink directory/segment"""
+    if path.endswith('.csv'):
+        import pandas as pd
+        return pd.read_csv(path)
+    return read_columnar(path)
+
+
+def create_sink(kind, filename, **options):
+    """Build a sink by name ('csv', 'queued-csv' or 'columnar'); filename is the CSV path"""
+    if kind == 'queued-csv':
+        return QueuedCsvSink(filename, **options)
+    if kind == 'columnar':
+        # Same name without the extension, as a directory of segments
+        return ColumnarSink(os.path.splitext(filename)[0], **options)
+    return CsvSink(filename)
@@ -0,0 +1,84 @@
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Defaults, overridable from the environment (the client has positional arguments only)
+LOG_LEVEL = os.environ.get('TT_LOG_LEVEL', 'INFO')
+LOG_FILE = os.environ.get('TT_LOG_FILE') or None
+LOG_SAMPLE = int(os.environ.get('TT_LOG_SAMPLE', 1))                   # Log 1 in N packets
+LOG_SUMMARY_INTERVAL = float(os.environ.get('TT_LOG_SUMMARY', 5.0))  # Seconds between summary lines
+
+ROOT_LOGGER = 'telemetry'
+
+_listener = None
+
+
+def get_logger(name):
+    """Logger below the 'telemetry' root (e.g. get_logger('server'))"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE):
+    """
+    Send all 'telemetry.*' records through a queue to a listener thread that
+    writes them to log_file (or stdout). The calling thread only formats the
+    message and enqueues it, so a slow terminal or disk does not stall the
+    receive/send loops. Call again in a forked child to restart the listener.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    return root
+
+
+def flush_logging():
+    """Wait until every queued record has been written (e.g. before printing a final report)"""
+    if _listener is not None:
+        _listener.stop()   # Drains the queue and joins the thread
+        _listener.start()
+
+
+def shutdown_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class PacketLogSampler:
+    """
+    Decides which packets get per-packet log lines: 1 in every `every` packets,
+    and none at all when the logger's level hides `level`. Callers check
+    `enabled` first so a disabled log costs one attribute read per packet.
+    """
+
+    __slots__ = ('enabled', 'every', 'count', 'skipped')
+
+    def __init__(self, logger, every=LOG_SAMPLE, level=logging.INFO):
+        self.enabled = every > 0 and logger.isEnabledFor(level)
+        self.every = max(1, every)
+        self.count = 0
+        self.skipped = 0  # Packets not logged because of sampling
+
+    def sample(self):
+        """True if this packet should be logged"""
+        self.count += 1
+        if self.count >= self.every:
+            self.count = 0
+            return True
+        self.skipped += 1
+        return False
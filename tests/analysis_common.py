@@ -0,0 +1,171 @@
+"""
+Helpers shared by the offline analysis scripts (analyze_results.py, make_graphs.py)
+
+Chunked reading of collector output (iter_telemetry(), the --stream option)
+and per-device aggregation (DeviceTotals). Whole files are read with
+sinks.load_telemetry(), re-exported here.
+"""
+
+import os
+import sys
+
+# Collector output readers and protocol constants live next to the collector
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from sinks import load_telemetry, columnar_segments, COLUMNAR_DTYPE
+from protocol import SEQ_MODULUS, SEQ_HALF
+
+
+# Columns of the per-device analysis, with compact dtypes for chunked reading
+ANALYSIS_DTYPES = {'device_id': 'uint16', 'seq_num': 'uint16', 'packet_bytes': 'uint32', 'duplicate_flag': 'uint8',
+                   'gap_flag': 'uint8', 'retransmit_flag': 'uint8'}
+STREAM_CHUNK_ROWS = 1000000
+
+
+def parse_stream_option(argv):
+    """
+    Remove --stream[=ROWS] from argv: returns (remaining args, chunk rows or None).
+    Streaming reads the telemetry in chunks instead of loading it whole.
+    """
+    args = []
+    stream_rows = None
+    for arg in argv:
+        if arg == '--stream':
+            stream_rows = STREAM_CHUNK_ROWS
+        elif arg.startswith('--stream='):
+            stream_rows = int(arg.split('=', 1)[1])
+        else:
+            args.append(arg)
+    return args, stream_rows
+
+
+def iter_telemetry(path, columns=tuple(ANALYSIS_DTYPES), chunksize=STREAM_CHUNK_ROWS):
+    """
+    Read collector output in DataFrame chunks of about chunksize rows, so files
+    larger than memory can be processed. Only the given columns are read (those
+    the file has), with ANALYSIS_DTYPES where they apply. Columnar segments are
+    read as stored (Parquet batches / np.save arrays) and regrouped into chunks.
+    """
+    import pandas as pd
+
+    if path.endswith('.csv'):
+        available = set(pd.read_csv(path, nrows=0).columns)
+        usecols = [column for column in columns if column in available]
+        dtype = {column: ANALYSIS_DTYPES[column] for column in usecols if column in ANALYSIS_DTYPES}
+        yield from pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize)
+        return
+
+    columns = [column for column in columns if column in dict(COLUMNAR_DTYPE)]
+    pending = []
+    pending_rows = 0
+    for segment in columnar_segments(path):
+        if segment.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            batches = (batch.to_pandas() for batch in
+                       pq.ParquetFile(segment).iter_batches(batch_size=chunksize, columns=columns))
+        else:
+            batches = _npy_chunks(segment, columns)
+        for batch in batches:
+            pending.append(batch)
+            pending_rows += len(batch)
+            if pending_rows >= chunksize:
+                yield pd.concat(pending, ignore_index=True)
+                pending = []
+                pending_rows = 0
+    if pending:
+        yield pd.concat(pending, ignore_index=True)
+
+
+def _npy_chunks(segment, columns):
+    """DataFrames of the given columns, one per np.save array in a .npy segment"""
+    import numpy as np
+    import pandas as pd
+    size = os.path.getsize(segment)
+    with open(segment, 'rb') as f:
+        while f.tell() < size:
+            chunk = np.load(f, allow_pickle=False)
+            yield pd.DataFrame({column: chunk[column] for column in columns})
+
+
+class DeviceTotals:
+    """
+    Per-device sums over telemetry chunks (see iter_telemetry()): rows and the
+    sums of packet_bytes and the flag columns, in the order devices first
+    appear. Adding a whole DataFrame at once or the same rows in chunks gives
+    the same totals, and means/rates derived from them (sum / rows) are those
+    pandas computes on the full data.
+
+    With a seq_num column, readings lost are counted from the sequence
+    numbers as well: the span of seqs received (unwrapped across the 16-bit
+    wraparound with serial arithmetic, duplicates left out) minus the
+    readings received, like the collector's gap counting.
+    """
+
+    SUM_COLUMNS = ['packet_bytes', 'duplicate_flag', 'gap_flag', 'retransmit_flag']
+
+    def __init__(self):
+        import pandas as pd
+        self.totals = None
+        self.pd = pd
+        # Per-device sequence state carried between chunks (Series indexed by device_id)
+        self.last_seq = pd.Series(dtype='int64')  # Last raw seq received
+        self.position = pd.Series(dtype='int64')  # Its unwrapped value
+        self.seq_min = pd.Series(dtype='int64')
+        self.seq_max = pd.Series(dtype='int64')
+
+    def add(self, chunk):
+        columns = [column for column in self.SUM_COLUMNS if column in chunk.columns]
+        grouped = chunk[columns].astype('int64').groupby(chunk['device_id'].astype('int64').values, sort=False)
+        part = grouped.sum()
+        part.insert(0, 'rows', grouped.size())
+        if 'seq_num' in chunk.columns:
+            self.add_sequences(chunk)
+        if self.totals is None:
+            self.totals = part
+            return
+        new = part.index[~part.index.isin(self.totals.index)]  # Devices first seen in this chunk, in order
+        if len(new):
+            self.totals = self.pd.concat([self.totals, self.pd.DataFrame(0, index=new, columns=self.totals.columns)])
+        self.totals.loc[part.index, part.columns] += part
+
+    def add_sequences(self, chunk):
+        """Extend each device's span of unwrapped sequence numbers with a chunk's non-duplicate rows"""
+        pd = self.pd
+        if 'duplicate_flag' in chunk.columns:
+            chunk = chunk[chunk['duplicate_flag'] == 0]
+        if not len(chunk):
+            return
+        device = pd.Series(chunk['device_id'].to_numpy('int64'))
+        seq = pd.Series(chunk['seq_num'].to_numpy('int64'))
+        # Serial distance to the device's previous row (the last row of an earlier chunk for the first one)
+        previous = seq.groupby(device).shift(1).fillna(device.map(self.last_seq))
+        delta = ((seq - previous + SEQ_HALF) % SEQ_MODULUS - SEQ_HALF).fillna(0).astype('int64')
+        # Unwrapped seq: the device's position before this chunk (its first seq if new) plus the distances
+        start = device.map(self.position).fillna(seq).astype('int64')
+        position = start.groupby(device).transform('first') + delta.groupby(device).cumsum()
+        by_device = position.groupby(device)
+        self.last_seq = seq.groupby(device).last().combine_first(self.last_seq).astype('int64')
+        self.position = by_device.last().combine_first(self.position).astype('int64')
+        self.seq_min = pd.concat([self.seq_min, by_device.min()]).groupby(level=0).min()
+        self.seq_max = pd.concat([self.seq_max, by_device.max()]).groupby(level=0).max()
+
+    def result(self):
+        """
+        DataFrame indexed by device_id: rows, packet_bytes, duplicate_flag, gap_flag,
+        retransmit_flag and (with seq_num) lost, all int64
+        """
+        if self.totals is None:
+            return self.pd.DataFrame(columns=['rows'] + self.SUM_COLUMNS, dtype='int64').rename_axis('device_id')
+        totals = self.totals.copy()
+        if len(self.seq_min):
+            received = totals['rows'] - totals.get('duplicate_flag', 0)
+            span = (self.seq_max - self.seq_min + 1).reindex(totals.index, fill_value=0)
+            totals['lost'] = (span - received).clip(lower=0).astype('int64')
+        return totals.rename_axis('device_id')
+
+
+def device_totals(path, chunksize=STREAM_CHUNK_ROWS):
+    """DeviceTotals.result() of collector output, read in chunks"""
+    totals = DeviceTotals()
+    for chunk in iter_telemetry(path, chunksize=chunksize):
+        totals.add(chunk)
+    return totals.result()
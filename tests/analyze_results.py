@@ -9,69 +9,70 @@ import sys
 import os
 from pathlib import Path
 
+# Readers for collector output (CSV or columnar sink directory) and per-device totals
+from analysis_common import load_telemetry, device_totals, DeviceTotals, parse_stream_option
+
 def load_csv_data(csv_file):
-    """Load telemetry CSV data"""
-    df = pd.read_csv(csv_file)
+    """Load telemetry data (CSV file or columnar sink directory)"""
+    df = load_telemetry(csv_file)
     return df
 
-def calculate_metrics(df, device_id):
-    """Calculate metrics for a specific device"""
-    device_df = df[df['device_id'] == device_id]
-    
-    if len(device_df) == 0:
-        return None
-    
-    # Calculate bytes per report (average packet size)
-    avg_bytes = device_df['packet_bytes'].mean()
-    
-    # Calculate duplicate rate
-    duplicates = device_df['duplicate_flag'].sum()
-    total_packets = len(device_df)
-    duplicate_rate = (duplicates / total_packets * 100) if total_packets > 0 else 0
-    
-    # Calculate loss (sequence gaps)
-    gaps = device_df['gap_flag'].sum()
-    gap_rate = (gaps / total_packets * 100) if total_packets > 0 else 0
-    
-    return {
-        'device_id': device_id,
-        'avg_bytes': avg_bytes,
-        'duplicate_rate': duplicate_rate,
-        'gap_rate': gap_rate,
+def telemetry_totals(telemetry_csv, stream_rows=None):
+    """Per-device totals (sinks.DeviceTotals) of the whole file, or streamed in chunks of stream_rows rows"""
+    if stream_rows:
+        return device_totals(telemetry_csv, stream_rows)
+    totals = DeviceTotals()
+    totals.add(load_telemetry(telemetry_csv))  # One groupby over all rows
+    return totals.result()
+
+def calculate_metrics(totals):
+    """
+    Metrics of every device at once from per-device totals (one row per device,
+    in order of first appearance):
+      avg_bytes      - bytes per report (average packet size)
+      duplicate_rate - duplicate rows (%)
+      gap_rate       - rows flagged with a sequence gap (%)
+      total_packets  - rows received
+      lost           - readings missing from the device's sequence numbers
+      loss_rate      - lost as a percentage of received + lost (as the collector reports it)
+    """
+    total_packets = totals['rows']
+    metrics = pd.DataFrame({
+        'avg_bytes': totals['packet_bytes'] / total_packets,
+        'duplicate_rate': totals['duplicate_flag'] / total_packets * 100,
+        'gap_rate': totals['gap_flag'] / total_packets * 100,
         'total_packets': total_packets
-    }
+    })
+    if 'lost' in totals.columns:
+        received = total_packets - totals['duplicate_flag']
+        metrics['lost'] = totals['lost']
+        metrics['loss_rate'] = (totals['lost'] / (received + totals['lost']) * 100).fillna(0.0)
+    return metrics.reset_index()
 
-def analyze_test_results(test_csv, telemetry_csv):
-    """Analyze results from test run"""
+def analyze_test_results(test_csv, telemetry_csv, stream_rows=None):
+    """Analyze results from test run (stream_rows: read the telemetry in chunks of that many rows)"""
     
     # Load test configuration
     test_df = pd.read_csv(test_csv)
     
-    # Load telemetry data
-    telemetry_df = pd.read_csv(telemetry_csv)
-    
-    results = []
-    
-    for _, test in test_df.iterrows():
-        device_id = test['device_id']
-        duration = test['duration']
-        netem = test['netem_config']
-        
-        metrics = calculate_metrics(telemetry_df, device_id)
-        
-        if metrics:
-            results.append({
-                'test_name': test['test_name'],
-                'device_id': device_id,
-                'duration': duration,
-                'netem_config': netem,
-                'avg_bytes': metrics['avg_bytes'],
-                'duplicate_rate': metrics['duplicate_rate'],
-                'gap_rate': metrics['gap_rate'],
-                'total_packets': metrics['total_packets']
-            })
-    
-    return pd.DataFrame(results)
+    # Per-device metrics, joined to the tests by device_id (tests whose device sent nothing are left out)
+    metrics = calculate_metrics(telemetry_totals(telemetry_csv, stream_rows))
+    tests = test_df[['test_name', 'device_id', 'duration', 'netem_config']]
+    return tests.merge(metrics, on='device_id', how='inner')
+
+def infer_tests(metrics):
+    """Test name, duration and netem config guessed from device_id ranges (when there is no test CSV)"""
+    device_id = metrics['device_id']
+    ids = device_id.astype(str)
+    baseline = device_id.between(1001, 1003)
+    duration = device_id.map({1001: 1, 1002: 5, 1003: 30}).fillna(30).astype('int64')  # 30 by default
+    return pd.DataFrame({
+        'test_name': ('Test ' + ids).where(device_id >= 1004, 'Device ' + ids)
+                     .where(~baseline, 'Baseline (' + duration.astype(str) + 's)'),
+        'device_id': device_id,
+        'duration': duration,
+        'netem_config': pd.Series('unknown', index=metrics.index).where(~baseline, 'none')
+    })
 
 def plot_bytes_vs_interval(results_df, output_file='bytes_vs_interval.png'):
     """
@@ -208,63 +209,36 @@ def plot_all_metrics(results_df, output_dir='graphs'):
     plt.close()
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 analyze_results.py <telemetry_csv> [test_results_csv]")
+    args, stream_rows = parse_stream_option(sys.argv[1:])
+    if len(args) < 1:
+        print("Usage: python3 analyze_results.py [--stream[=ROWS]] <telemetry_csv | columnar_dir> [test_results_csv]")
         print("\nExample:")
         print("  python3 analyze_results.py ../src/telemetry_20251210_224834.csv")
+        print("  python3 analyze_results.py ../src/telemetry_20251210_224834/")
         print("  python3 analyze_results.py ../src/telemetry_20251210_224834.csv ../logs/test_results_20251210.csv")
+        print("  python3 analyze_results.py --stream ../logs/telemetry_multiday.csv   # chunks of 1M rows, same output")
         sys.exit(1)
     
-    telemetry_csv = sys.argv[1]
-    test_csv = sys.argv[2] if len(sys.argv) > 2 else None
+    telemetry_csv = args[0]
+    test_csv = args[1] if len(args) > 1 else None
     
     if not os.path.exists(telemetry_csv):
-        print(f"Error: Telemetry CSV not found: {telemetry_csv}")
+        print(f"Error: Telemetry data not found: {telemetry_csv}")
         sys.exit(1)
     
-    print(f"Loading telemetry data from: {telemetry_csv}")
-    telemetry_df = pd.read_csv(telemetry_csv)
+    if stream_rows:
+        print(f"Streaming telemetry data from: {telemetry_csv} ({stream_rows} rows per chunk)")
+    else:
+        print(f"Loading telemetry data from: {telemetry_csv}")
     
     if test_csv and os.path.exists(test_csv):
         print(f"Loading test configuration from: {test_csv}")
-        results_df = analyze_test_results(test_csv, telemetry_csv)
+        results_df = analyze_test_results(test_csv, telemetry_csv, stream_rows)
     else:
         print("No test CSV provided. Analyzing telemetry data directly...")
         
-        # Get unique device IDs
-        device_ids = telemetry_df['device_id'].unique()
-        
-        results = []
-        for device_id in device_ids:
-            metrics = calculate_metrics(telemetry_df, device_id)
-            if metrics:
-                # Infer duration and test type from device_id ranges
-                if 1001 <= device_id <= 1003:
-                    duration = [1, 5, 30][device_id - 1001]
-                    test_name = f"Baseline ({duration}s)"
-                    netem = "none"
-                elif device_id >= 1004:
-                    # Estimate based on naming pattern
-                    duration = 30  # default
-                    test_name = f"Test {device_id}"
-                    netem = "unknown"
-                else:
-                    duration = 30
-                    test_name = f"Device {device_id}"
-                    netem = "unknown"
-                
-                results.append({
-                    'test_name': test_name,
-                    'device_id': device_id,
-                    'duration': duration,
-                    'netem_config': netem,
-                    'avg_bytes': metrics['avg_bytes'],
-                    'duplicate_rate': metrics['duplicate_rate'],
-                    'gap_rate': metrics['gap_rate'],
-                    'total_packets': metrics['total_packets']
-                })
-        
-        results_df = pd.DataFrame(results)
+        metrics = calculate_metrics(telemetry_totals(telemetry_csv, stream_rows))
+        results_df = infer_tests(metrics).merge(metrics, on='device_id')
     
     print(f"\nAnalyzing {len(results_df)} test results...")
     print("\nGenerating graphs...")
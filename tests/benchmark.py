@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+End-to-end collector benchmark: ramps offered load and records what the collector sustains
+
+For every load step a fresh collector is started (src/server.py, any extra
+server flags), driven by src/load_generator.py for --duration seconds and
+stopped with Ctrl+C (SIGINT). Both write their final statistics as JSON;
+the step result combines them with CPU/RSS samples of the collector.
+
+Usage:
+    python benchmark.py --rates 1000,5000,10000,20000 --output results.json
+    python benchmark.py --rates 1000,5000 --server-args "--workers 4" --baseline baseline.json
+    python benchmark.py --compare results.json baseline.json
+"""
+
+import argparse
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Metrics compared against a baseline: name -> True if higher is better
+COMPARED_METRICS = {
+    'readings_per_s': True,
+    'packets_per_s': True,
+    'delivered_ratio': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'latency_p999_ms': False,
+    'cpu_percent': False,
+    'rss_max_mb': False,
+}
+
+# Delivery below this fraction of generated readings means the step was not sustained
+SUSTAINED_DELIVERY = 0.99
+
+
+class ProcessSampler:
+    """Samples CPU% and RSS of a process tree (collector launcher + shard workers) in the background"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss_max_mb = None
+        self.cpu_samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        try:
+            import psutil  # Optional: without it CPU comes from the collector's own report only
+        except ImportError:
+            return
+        self.psutil = psutil
+        self.thread.start()
+
+    def processes(self, root):
+        try:
+            return [root] + root.children(recursive=True)
+        except self.psutil.Error:
+            return []
+
+    def run(self):
+        try:
+            root = self.psutil.Process(self.pid)
+        except self.psutil.Error:
+            return
+        tracked = {}
+        while not self.stopped.wait(self.interval):
+            rss = 0
+            cpu = 0.0
+            for process in self.processes(root):
+                try:
+                    # First call per process primes cpu_percent; later calls cover the interval since
+                    process = tracked.setdefault(process.pid, process)
+                    cpu += process.cpu_percent(None)
+                    rss += process.memory_info().rss
+                except self.psutil.Error:
+                    continue
+            if rss:
+                self.cpu_samples.append(cpu)
+                self.rss_max_mb = max(self.rss_max_mb or 0, rss / 1024 / 1024)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+def free_port():
+    """Ask the OS for a UDP port that is currently unused"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_step(rate, args, workdir):
+    """Run one load step at rate readings/s; returns the step result dict"""
+    port = args.port or free_port()
+    step_dir = os.path.join(workdir, f"rate_{rate}")
+    os.makedirs(step_dir)
+    collector_json = os.path.join(step_dir, 'collector.json')
+
+    # Fresh collector per step (own session, so SIGINT reaches shard workers like a terminal Ctrl+C)
+    collector_log = open(os.path.join(step_dir, 'collector.log'), 'w')
+    collector = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, 'server.py'), str(port), '127.0.0.1',
+         '--log-level', 'WARNING', '--summary-interval', '3600', '--stats-json', collector_json]
+        + shlex.split(args.server_args),
+        cwd=step_dir, stdout=collector_log, stderr=subprocess.STDOUT, start_new_session=True)
+    time.sleep(args.startup)
+    sampler = ProcessSampler(collector.pid)
+    sampler.start()
+
+    # Split the devices over the generator processes; interval gives the requested rate
+    interval = args.devices / rate
+    per_generator = args.devices // args.generators
+    generators = []
+    for index in range(args.generators):
+        generator_json = os.path.join(step_dir, f"generator{index}.json")
+        count = per_generator if index < args.generators - 1 else args.devices - per_generator * index
+        generators.append((generator_json, subprocess.Popen(
+            [sys.executable, os.path.join(SRC_DIR, 'load_generator.py'), str(count), str(args.duration),
+             '--host', '127.0.0.1', '--port', str(port), '--interval', str(interval),
+             '--batch-size', str(args.batch_size), '--first-device-id', str(args.first_device_id + index * per_generator),
+             '--ramp', str(min(interval, 1.0)), '--log-level', 'WARNING', '--stats-json', generator_json],
+            cwd=step_dir, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)))
+    for _, process in generators:
+        process.wait()
+
+    # Let the reorder buffer and sink drain, then stop the collector like Ctrl+C
+    time.sleep(args.settle)
+    sampler.stop()
+    os.killpg(collector.pid, signal.SIGINT)
+    try:
+        collector.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        os.killpg(collector.pid, signal.SIGKILL)
+        collector.wait()
+    collector_log.close()
+
+    if not os.path.exists(collector_json):
+        raise RuntimeError(f"collector wrote no statistics (see {step_dir}/collector.log)")
+    with open(collector_json) as f:
+        stats = json.load(f)
+    generated = 0
+    generator_packets = 0
+    for generator_json, _ in generators:
+        with open(generator_json) as f:
+            totals = json.load(f)
+        generated += totals['readings']
+        generator_packets += totals['packets_sent'] + totals['retransmissions']
+
+    duration = args.duration
+    latency = stats['sink_latency']
+    perf = stats['performance']
+    received = stats['sink_rows_written']  # Readings that reached the sink (INIT/HEARTBEAT write no rows)
+    return {
+        'offered_readings_per_s': rate,
+        'generated_readings_per_s': generated / duration,
+        'generator_packets_per_s': generator_packets / duration,
+        'packets_per_s': stats['total_datagrams'] / duration,
+        'readings_per_s': received / duration,
+        'delivered_ratio': received / generated if generated else 0.0,
+        'lost': stats['total_lost'],
+        'duplicates': stats['total_duplicates'],
+        'kernel_drops': stats['kernel_drops'],
+        'latency_p50_ms': latency.get('p50_ms'),
+        'latency_p99_ms': latency.get('p99_ms'),
+        'latency_p999_ms': latency.get('p999_ms'),
+        'latency_max_ms': latency.get('max_ms'),
+        'cpu_percent': (sum(sampler.cpu_samples) / len(sampler.cpu_samples) if sampler.cpu_samples
+                        else perf['cpu_time_ms'] / 1000 / perf['elapsed_s'] * 100),
+        'cpu_time_ms': perf['cpu_time_ms'],
+        'rss_max_mb': sampler.rss_max_mb if sampler.rss_max_mb is not None else perf['memory_mb'],
+        'acks_sent': stats['total_acks_sent'],
+    }
+
+
+def print_step(step):
+    latency = step['latency_p99_ms']
+    print(f"  {step['offered_readings_per_s']:>9.0f} offered {step['generated_readings_per_s']:>9.0f} generated | "
+          f"{step['readings_per_s']:>9.0f} readings/s "
+          f"{step['packets_per_s']:>9.0f} packets/s | delivered {step['delivered_ratio'] * 100:6.2f}% | "
+          f"p50/p99/p99.9 {step['latency_p50_ms'] or 0:7.1f}/{latency or 0:7.1f}/{step['latency_p999_ms'] or 0:7.1f} ms | "
+          f"drops {step['kernel_drops']} | CPU {step['cpu_percent']:5.1f}% | RSS {step['rss_max_mb']:.0f} MB")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare steps with the same offered load. Returns a list of regression
+    messages (metric worse than the baseline by more than tolerance).
+    """
+    base_steps = {step['offered_readings_per_s']: step for step in baseline['steps']}
+    regressions = []
+    print(f"\n[COMPARE] against {baseline.get('created', 'baseline')} (tolerance {tolerance * 100:.0f}%)")
+    for step in results['steps']:
+        rate = step['offered_readings_per_s']
+        base = base_steps.get(rate)
+        if base is None:
+            print(f"  {rate:>9.0f} offered | no baseline step")
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            new, old = step.get(metric), base.get(metric)
+            if new is None or old is None or old == 0:
+                continue
+            change = (new - old) / abs(old)
+            worse = -change if higher_is_better else change
+            marker = ''
+            if worse > tolerance:
+                marker = ' REGRESSION'
+                regressions.append(f"{metric} at {rate:.0f}/s: {old:.2f} -> {new:.2f} ({change * 100:+.1f}%)")
+            changes.append(f"{metric} {change * 100:+.1f}%{marker}")
+        print(f"  {rate:>9.0f} offered | " + ", ".join(changes))
+
+    old_max, new_max = baseline.get('max_sustained_readings_per_s'), results.get('max_sustained_readings_per_s')
+    if old_max and new_max is not None and (old_max - new_max) / old_max > tolerance:
+        regressions.append(f"max sustained rate: {old_max:.0f} -> {new_max:.0f} readings/s")
+    print(f"  max sustained: {old_max} -> {new_max} readings/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TinyTelemetry collector throughput/latency benchmark')
+    parser.add_argument('--rates', default='1000,2000,5000,10000',
+                        help='Offered load steps in readings/s (comma separated)')
+    parser.add_argument('--devices', type=int, default=1000, help='Simulated devices per step')
+    parser.add_argument('--batch-size', type=int, default=1, help='Readings per packet (1 = DATA packets)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of load per step')
+    parser.add_argument('--generators', type=int, default=1, help='Load generator processes per step')
+    parser.add_argument('--first-device-id', type=int, default=10000)
+    parser.add_argument('--server-args', default='', help='Extra collector flags, e.g. "--workers 4 --sink columnar"')
+    parser.add_argument('--port', type=int, default=0, help='Collector port (default: a free port per step)')
+    parser.add_argument('--startup', type=float, default=1.0, help='Seconds to wait for the collector to start')
+    parser.add_argument('--settle', type=float, default=3.0,
+                        help='Seconds between the end of load and stopping the collector (reorder buffer, sink)')
+    parser.add_argument('--output', default=None, help='Write results JSON here')
+    parser.add_argument('--baseline', default=None, help='Compare the results with this results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression (0.10 = 10%%)')
+    parser.add_argument('--compare', nargs=2, metavar=('RESULTS', 'BASELINE'),
+                        help='Only compare two stored results files')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            results = json.load(f)
+        with open(args.compare[1]) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+    else:
+        rates = [float(rate) for rate in args.rates.split(',')]
+        workdir = tempfile.mkdtemp(prefix='tt_benchmark_')
+        print(f"=== TinyTelemetry Collector Benchmark ({args.devices} devices, {args.duration}s per step) ===")
+        print(f"Collector flags: {args.server_args or '(defaults)'} | work dir: {workdir}")
+        steps = []
+        for rate in rates:
+            step = run_step(rate, args, workdir)
+            print_step(step)
+            steps.append(step)
+
+        sustained = [step['readings_per_s'] for step in steps if step['delivered_ratio'] >= SUSTAINED_DELIVERY]
+        results = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'baseline', 'compare')},
+            'steps': steps,
+            'max_sustained_readings_per_s': max(sustained) if sustained else None,
+        }
+        print(f"\nMax sustained: {results['max_sustained_readings_per_s']} readings/s "
+              f"(delivery >= {SUSTAINED_DELIVERY * 100:.0f}%)")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to: {args.output}")
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+
+    if regressions:
+        print("\n[REGRESSIONS]")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
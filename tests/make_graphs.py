@@ -5,9 +5,12 @@ Generates:
 1. bytes_per_report vs reporting_interval (1s, 5s, 30s)
 2. duplicate_rate vs loss
 
-Usage: python3 make_graphs.py [csv_file] [output_dir]
-  csv_file: Path to telemetry CSV file (default: ../src/telemetry_*.csv - finds latest)
+Usage: python3 make_graphs.py [--stream[=ROWS]] [csv_file] [output_dir]
+  csv_file: Path to telemetry CSV file or columnar sink directory
+            (default: ../src/telemetry_* - finds latest)
   output_dir: Output directory for graphs (default: graphs)
+  --stream: Read the file in chunks (default 1M rows) instead of loading it whole;
+            for logs larger than memory. The graphs and numbers are the same.
 """
 
 import pandas as pd
@@ -16,12 +19,18 @@ import os
 import sys
 import glob
 
+# Readers for collector output (CSV or columnar sink directory) and per-device totals
+from analysis_common import load_telemetry, device_totals, DeviceTotals, parse_stream_option
+
 # Parse command line arguments
-if len(sys.argv) > 1:
-    csv_file = sys.argv[1]
+args, stream_rows = parse_stream_option(sys.argv[1:])
+
+if len(args) > 0:
+    csv_file = args[0]
 else:
     # Find most recent telemetry CSV file
-    csv_files = glob.glob('../src/telemetry_*.csv') + glob.glob('../logs/telemetry_*.csv')
+    csv_files = [path for path in glob.glob('../src/telemetry_*') + glob.glob('../logs/telemetry_*')
+                 if path.endswith('.csv') or os.path.isdir(path)]
     if not csv_files:
         print("Error: No telemetry CSV files found!")
         print("Usage: python3 make_graphs.py <csv_file> [output_dir]")
@@ -29,21 +38,29 @@ else:
     csv_file = max(csv_files, key=os.path.getmtime)
     print(f"Auto-detected latest CSV: {csv_file}")
 
-output_dir = sys.argv[2] if len(sys.argv) > 2 else 'graphs'
+output_dir = args[1] if len(args) > 1 else 'graphs'
 
 # Validate CSV file exists
 if not os.path.exists(csv_file):
     print(f"Error: CSV file not found: {csv_file}")
     sys.exit(1)
 
-# Load CSV file
-print(f"Loading data from: {csv_file}")
-df = pd.read_csv(csv_file)
+# Every graph below is built from per-device totals (rows and sums of packet_bytes and
+# the flags), so loading the file whole or streaming it in chunks gives the same output
+if stream_rows:
+    print(f"Streaming data from: {csv_file} ({stream_rows} rows per chunk)")
+    totals = device_totals(csv_file, stream_rows)
+else:
+    print(f"Loading data from: {csv_file}")
+    accumulator = DeviceTotals()
+    accumulator.add(load_telemetry(csv_file))
+    totals = accumulator.result()
+df = totals.sort_index().reset_index()  # One row per device
 
 # Create output directory
 os.makedirs(output_dir, exist_ok=True)
 
-print(f"Loaded {len(df)} packets from {len(df['device_id'].unique())} devices")
+print(f"Loaded {df['rows'].sum()} packets from {len(df)} devices")
 
 # ============================================================================
 # GRAPH 1: bytes_per_report vs reporting_interval (1s, 5s, 30s)
@@ -96,10 +113,11 @@ interval_mapping = {
 
 df['interval'] = df['device_id'].map(interval_mapping)
 
-# Calculate average bytes per interval
-interval_stats = df.groupby('interval').agg({
-    'packet_bytes': 'mean',
-    'device_id': 'nunique'
+# Calculate average bytes per interval (over all packets of the interval's devices)
+interval_groups = df.groupby('interval')
+interval_stats = pd.DataFrame({
+    'packet_bytes': interval_groups['packet_bytes'].sum() / interval_groups['rows'].sum(),
+    'device_id': interval_groups.size()
 }).reset_index()
 
 interval_stats = interval_stats.sort_values('interval')
@@ -159,12 +177,11 @@ df['network_loss'] = df['device_id'].map(loss_mapping)
 loss_df = df[df['network_loss'].notna()]
 
 # Calculate duplicate rate per device
-device_stats = loss_df.groupby('device_id').agg({
-    'duplicate_flag': lambda x: (x.sum() / len(x) * 100),
-    'network_loss': 'first'
-}).reset_index()
-
-device_stats.columns = ['device_id', 'duplicate_rate', 'network_loss']
+device_stats = pd.DataFrame({
+    'device_id': loss_df['device_id'],
+    'duplicate_rate': loss_df['duplicate_flag'] / loss_df['rows'] * 100,
+    'network_loss': loss_df['network_loss']
+}).reset_index(drop=True)
 
 # Group by loss percentage
 loss_stats = device_stats.groupby('network_loss').agg({
@@ -216,12 +233,11 @@ plt.close()
 # ============================================================================
 
 # Calculate actual packet loss from gap_flag
-loss_detection_stats = loss_df.groupby('device_id').agg({
-    'gap_flag': lambda x: (x.sum() / len(x) * 100),
-    'network_loss': 'first'
-}).reset_index()
-
-loss_detection_stats.columns = ['device_id', 'detected_loss_rate', 'network_loss']
+loss_detection_stats = pd.DataFrame({
+    'device_id': loss_df['device_id'],
+    'detected_loss_rate': loss_df['gap_flag'] / loss_df['rows'] * 100,
+    'network_loss': loss_df['network_loss']
+}).reset_index(drop=True)
 
 # Group by network loss
 loss_detection_grouped = loss_detection_stats.groupby('network_loss').agg({
@@ -275,11 +291,12 @@ plt.close()
 # ============================================================================
 
 # Get detailed duplicate stats per device
-dup_detail = df.groupby('device_id').agg({
-    'duplicate_flag': ['sum', 'count', lambda x: (x.sum() / len(x) * 100)]
-}).reset_index()
-
-dup_detail.columns = ['device_id', 'duplicate_count', 'total_packets', 'duplicate_rate']
+dup_detail = pd.DataFrame({
+    'device_id': df['device_id'],
+    'duplicate_count': df['duplicate_flag'],
+    'total_packets': df['rows'],
+    'duplicate_rate': df['duplicate_flag'] / df['rows'] * 100
+})
 
 # Add interval mapping
 dup_detail['interval'] = dup_detail['device_id'].map(interval_mapping)
@@ -319,12 +336,11 @@ else:
 # Check if retransmit_flag column exists
 if 'retransmit_flag' in df.columns:
     # Calculate retransmission stats
-    retransmit_stats = loss_df.groupby('device_id').agg({
-        'retransmit_flag': lambda x: (x.sum() / len(x) * 100),
-        'network_loss': 'first'
-    }).reset_index()
-    
-    retransmit_stats.columns = ['device_id', 'retransmit_rate', 'network_loss']
+    retransmit_stats = pd.DataFrame({
+        'device_id': loss_df['device_id'],
+        'retransmit_rate': loss_df['retransmit_flag'] / loss_df['rows'] * 100,
+        'network_loss': loss_df['network_loss']
+    }).reset_index(drop=True)
     
     # Group by network loss
     retransmit_grouped = retransmit_stats.groupby('network_loss').agg({
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the protocol codec and the collector's packet processing
+
+Each case runs a prepared list of operations (timeit-style: several repeats,
+best and median reported, loop overhead subtracted) and reports ns/op. A
+separate pass under tracemalloc reports memory per op: the peak of
+short-lived allocations while the op runs, and what it leaves allocated.
+
+TelemetryCollector.process_packet runs with the socket and the sink replaced
+by stubs, so only decoding, duplicate/gap tracking, ACK bookkeeping and row
+building are measured.
+
+Usage:
+    python microbench.py                    # all cases
+    python microbench.py --filter process   # cases whose name contains 'process'
+    python microbench.py --ops 5000 --repeat 7 --json microbench.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from protocol import (TinyTelemetryProtocol, MSG_INIT, MSG_DATA, MSG_HEARTBEAT, MSG_BATCH, MSG_ACK,
+                      PROTOCOL_VERSION_JSON, PROTOCOL_VERSION_BINARY, FLAG_SACK_OK, SEQ_MASK)
+from server import TelemetryCollector
+
+ADDR = ('127.0.0.1', 40000)
+BATCH_READINGS = 20
+
+
+class StubSocket:
+    """Stands in for the collector's UDP socket: ACKs are dropped"""
+
+    def sendto(self, data, addr):
+        return len(data)
+
+
+class StubSink:
+    """Stands in for the telemetry sink: rows are counted, not written"""
+
+    rows_written = 0
+    queue_depth = 0
+    max_queue_depth = 0
+
+    def write(self, row):
+        self.rows_written += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def stub_collector(ack_mode):
+    """A collector that was never started: no socket, no files, logging off"""
+    collector = TelemetryCollector('127.0.0.1', 0)
+    collector.socket = StubSocket()
+    collector.sink = StubSink()
+    collector.ack_mode = ack_mode
+    return collector
+
+
+def reading(seq):
+    return {'seq_num': seq, 'temperature': 20.0 + (seq % 100) / 10, 'humidity': 50.0 + (seq % 50) / 10}
+
+
+def data_message(seq, version=PROTOCOL_VERSION_BINARY, device_id=1001):
+    if version == PROTOCOL_VERSION_BINARY:
+        payload = TinyTelemetryProtocol.encode_data_payload(21.5, 55.25)
+    else:
+        payload = json.dumps({'temperature': 21.5, 'humidity': 55.25}).encode('utf-8')
+    return TinyTelemetryProtocol.create_message(MSG_DATA, device_id, seq, payload, flags=FLAG_SACK_OK,
+                                                version=version)
+
+
+def batch_message(last_seq, device_id=1001):
+    readings = [reading(seq) for seq in range(last_seq - BATCH_READINGS + 1, last_seq + 1)]
+    return TinyTelemetryProtocol.create_message(MSG_BATCH, device_id, last_seq,
+                                                TinyTelemetryProtocol.encode_batch_payload(readings),
+                                                flags=FLAG_SACK_OK, version=PROTOCOL_VERSION_BINARY)
+
+
+# Each case builder returns (setup, function, argument tuples). setup() runs
+# before every repeat (fresh collector state) and returns the function to
+# call if it depends on that state, else None.
+
+def codec_cases(ops):
+    header = TinyTelemetryProtocol.pack_header(MSG_DATA, 1001, 42, 1700000000, FLAG_SACK_OK, PROTOCOL_VERSION_BINARY)
+    message = data_message(42)
+    batch = [reading(seq) for seq in range(1, BATCH_READINGS + 1)]
+    batch_payload = TinyTelemetryProtocol.encode_batch_payload(batch)
+    data_payload = TinyTelemetryProtocol.encode_data_payload(21.5, 55.25)
+    ack = TinyTelemetryProtocol.create_message(MSG_ACK, 1001, 42, timestamp=0,
+                                               payload=TinyTelemetryProtocol.encode_sack_payload(40, 0b11))
+    return {
+        'codec.pack_header': (None, TinyTelemetryProtocol.pack_header,
+                              [(MSG_DATA, 1001, seq, 1700000000, FLAG_SACK_OK, PROTOCOL_VERSION_BINARY)
+                               for seq in range(ops)]),
+        'codec.unpack_header': (None, TinyTelemetryProtocol.unpack_header, [(header,)] * ops),
+        'codec.create_message': (None, TinyTelemetryProtocol.create_message,
+                                 [(MSG_DATA, 1001, seq, data_payload, 1700000000, FLAG_SACK_OK,
+                                   PROTOCOL_VERSION_BINARY) for seq in range(ops)]),
+        'codec.parse_message': (None, TinyTelemetryProtocol.parse_message, [(message,)] * ops),
+        'codec.encode_data_payload': (None, TinyTelemetryProtocol.encode_data_payload, [(21.5, 55.25)] * ops),
+        'codec.decode_data_payload': (None, TinyTelemetryProtocol.decode_data_payload,
+                                      [(PROTOCOL_VERSION_BINARY, data_payload)] * ops),
+        'codec.encode_batch_payload[20]': (None, TinyTelemetryProtocol.encode_batch_payload, [(batch,)] * ops),
+        'codec.decode_batch_payload[20]': (None, TinyTelemetryProtocol.decode_batch_payload,
+                                           [(PROTOCOL_VERSION_BINARY, batch_payload)] * ops),
+        'codec.decode_sack_payload': (None, TinyTelemetryProtocol.decode_sack_payload,
+                                      [(TinyTelemetryProtocol.parse_message(ack)[1],)] * ops),
+    }
+
+
+def process_cases(ops, ack_mode):
+    def with_collector():
+        return stub_collector(ack_mode).process_packet
+
+    def with_known_device():
+        collector = stub_collector(ack_mode)
+        collector.process_packet(TinyTelemetryProtocol.create_message(MSG_INIT, 1001, 0), ADDR)
+        collector.process_packet(data_message(1), ADDR)
+        return collector.process_packet
+
+    # Sequence numbers advance as from a live sensor (wrapping at 16 bits)
+    return {
+        'process.INIT (new device)': (with_collector, None,
+                                      [(TinyTelemetryProtocol.create_message(MSG_INIT, device_id % 65536, 0), ADDR)
+                                       for device_id in range(ops)]),
+        'process.DATA binary': (with_known_device, None,
+                                [(data_message((seq + 2) & SEQ_MASK), ADDR) for seq in range(ops)]),
+        'process.DATA json': (with_known_device, None,
+                              [(data_message((seq + 2) & SEQ_MASK, PROTOCOL_VERSION_JSON), ADDR) for seq in range(ops)]),
+        'process.DATA duplicate': (with_known_device, None, [(data_message(1), ADDR)] * ops),
+        'process.HEARTBEAT': (with_known_device, None,
+                              [(TinyTelemetryProtocol.create_message(MSG_HEARTBEAT, 1001, 0), ADDR)] * ops),
+        'process.BATCH[20] binary': (with_known_device, None,
+                                     [(batch_message((1 + (index + 1) * BATCH_READINGS) & SEQ_MASK), ADDR)
+                                      for index in range(ops)]),
+    }
+
+
+def time_case(setup, function, arguments, repeat):
+    """Best and median ns/op over repeat runs, loop overhead subtracted"""
+    def noop(*args):
+        pass
+
+    def run(target):
+        started = time.perf_counter_ns()
+        for args in arguments:
+            target(*args)
+        return time.perf_counter_ns() - started
+
+    overhead = min(run(noop) for _ in range(3))
+    results = []
+    gc_was_enabled = gc.isenabled()
+    for _ in range(repeat):
+        target = setup() if setup else function
+        gc.disable()  # As timeit does: collections would land on arbitrary ops
+        try:
+            results.append(max(0, run(target) - overhead) / len(arguments))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+    return min(results), statistics.median(results)
+
+
+def memory_case(setup, function, arguments):
+    """(peak transient bytes/op, retained bytes/op) measured under tracemalloc"""
+    target = setup() if setup else function
+    tracemalloc.start()
+    try:
+        transient = 0
+        retained_start = tracemalloc.get_traced_memory()[0]
+        for args in arguments:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            target(*args)
+            transient += tracemalloc.get_traced_memory()[1] - before
+        retained = tracemalloc.get_traced_memory()[0] - retained_start
+    finally:
+        tracemalloc.stop()
+    return transient / len(arguments), retained / len(arguments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TinyTelemetry codec and process_packet microbenchmarks')
+    parser.add_argument('--ops', type=int, default=20000, help='Operations per repeat')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repeats per case (best and median reported)')
+    parser.add_argument('--filter', default='', help='Only run cases whose name contains this text')
+    parser.add_argument('--ack-mode', choices=['sack', 'immediate'], default='immediate',
+                        help='Collector ACK mode for process.* (immediate: every op encodes and "sends" an ACK)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc pass')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    cases = dict(codec_cases(args.ops))
+    cases.update(process_cases(args.ops, args.ack_mode))
+
+    print(f"=== TinyTelemetry Microbenchmarks ({args.ops} ops x {args.repeat} repeats, "
+          f"Python {sys.version.split()[0]}, ack mode {args.ack_mode}) ===")
+    print(f"  {'case':<34} {'best ns/op':>11} {'median':>11} {'alloc B/op':>11} {'retained B/op':>14}")
+    results = {}
+    for name, (setup, function, arguments) in cases.items():
+        if args.filter not in name:
+            continue
+        best, median = time_case(setup, function, arguments, args.repeat)
+        result = {'ns_per_op': best, 'median_ns_per_op': median}
+        line = f"  {name:<34} {best:>11.0f} {median:>11.0f}"
+        if not args.no_memory:
+            transient, retained = memory_case(setup, function, arguments)
+            result.update(alloc_bytes_per_op=transient, retained_bytes_per_op=retained)
+            line += f" {transient:>11.0f} {retained:>14.1f}"
+        print(line)
+        results[name] = result
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'ops': args.ops, 'repeat': args.repeat,
+                       'ack_mode': args.ack_mode, 'results': results}, f, indent=2)
+        print(f"Results written to: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Lossless-link RDT check: on localhost nothing is lost, so a sensor must never retransmit
+
+For each ACK mode a fresh collector (src/server.py) is started on a free port
+and a few sensors report to it for --duration seconds. Any retransmission, or
+a duplicate counted by the collector, means the RTO fired before an ACK that
+was on its way (e.g. an RTO below the collector's ACK hold time or the
+scheduler's granularity). Exits with status 1 on failure.
+
+Usage:
+    python rdt_lossless_test.py
+    python rdt_lossless_test.py --sensors 4 --duration 15 --ack-modes sack
+    python rdt_lossless_test.py --min-rto 0     # coalesced ACKs alone must not cause retransmissions
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+from client import TelemetrySensor
+from telemetry_log import setup_logging, shutdown_logging
+from benchmark import free_port
+
+
+def run_mode(ack_mode, args, workdir):
+    """Run the sensors against a collector in ack_mode; returns (retransmissions per sensor, collector duplicates)"""
+    port = free_port()
+    stats_json = os.path.join(workdir, f"collector_{ack_mode}.json")
+    collector_log = open(os.path.join(workdir, f"collector_{ack_mode}.log"), 'w')
+    collector = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, 'server.py'), str(port), '127.0.0.1', '--ack-mode', ack_mode,
+         '--log-level', 'WARNING', '--summary-interval', '3600', '--stats-json', stats_json],
+        cwd=workdir, stdout=collector_log, stderr=subprocess.STDOUT, start_new_session=True)
+    time.sleep(1.0)
+
+    sensors = [TelemetrySensor(args.first_device_id + index, '127.0.0.1', port) for index in range(args.sensors)]
+    if args.min_rto is not None:
+        for sensor in sensors:
+            sensor.min_rto = args.min_rto
+    threads = [threading.Thread(target=sensor.run, args=(args.interval, args.duration)) for sensor in sensors]
+    with contextlib.redirect_stdout(io.StringIO()):  # Each sensor prints its RDT report
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    os.killpg(collector.pid, signal.SIGINT)
+    collector.wait(timeout=30)
+    collector_log.close()
+    with open(stats_json) as f:
+        stats = json.load(f)
+    return [sensor.retransmission_count for sensor in sensors], stats['total_duplicates']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that sensors never retransmit on a lossless link')
+    parser.add_argument('--sensors', type=int, default=2)
+    parser.add_argument('--duration', type=int, default=8, help='Seconds each sensor reports')
+    parser.add_argument('--interval', type=float, default=0.05, help='Reporting interval (s)')
+    parser.add_argument('--first-device-id', type=int, default=3001)
+    parser.add_argument('--ack-modes', default='sack,immediate', help='Comma-separated collector ACK modes')
+    parser.add_argument('--min-rto', type=float, default=None,
+                        help="Override the sensors' min_rto (0: the RTO floor is then only the collector's ACK hold)")
+    args = parser.parse_args()
+    setup_logging('WARNING')
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='rdt_lossless_') as workdir:
+        for ack_mode in args.ack_modes.split(','):
+            retransmissions, duplicates = run_mode(ack_mode, args, workdir)
+            ok = not any(retransmissions) and duplicates == 0
+            failed = failed or not ok
+            print(f"[{'PASS' if ok else 'FAIL'}] ack mode {ack_mode}: retransmissions per sensor {retransmissions}, "
+                  f"collector duplicates {duplicates}")
+    shutdown_logging()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()